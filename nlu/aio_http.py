@@ -0,0 +1,182 @@
+'''
+Minimal asyncio HTTP/1.1 server for serving NLU queries
+'''
+
+import asyncio
+from http import HTTPStatus
+
+class RequestError(Exception):
+    '''요청을 더 읽지 않고 상태코드status로 답한 뒤 연결을 닫아야 할 때'''
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+class AsyncHttpServer:
+    '''
+    asyncio 기반의 작은 HTTP/1.1 서버.
+    연결 여러 개를 동시에 받으며, 한 연결에서 여러 요청을 이어 받는(keep-alive) 것도 된다.
+    요청 처리는 handler 코루틴에게 맡긴다.
+        handler(method, target) -> (status, headers, body)
+        예) handler('GET', '/nlu?text=...') -> (200, {'Content-type': ...}, b'{...}')
+    '''
+
+    def __init__(self, handler, keepAliveTimeout=15, requestTimeout=10,
+            maxHeaders=100, maxHeaderBytes=16 << 10, maxBodySize=1 << 20):
+        '''
+        Args:
+            handler: 요청을 처리하는 코루틴 함수
+            keepAliveTimeout: 다음 요청 없이 연결을 열어두는 최대 시간(초)
+            requestTimeout: 요청 줄을 받은 뒤 헤더와 본문을 모두 받기까지의 최대 시간(초). 넘으면 408.
+            maxHeaders, maxHeaderBytes: 헤더 줄 수와 헤더 전체 크기(bytes)의 한도. 넘으면 431.
+            maxBodySize: 본문 크기(bytes)의 한도. 넘으면 413.
+        느리거나 악의적인 클라이언트 하나가 연결을 한없이 붙잡거나 메모리를 한없이 쓰지 못하게 한다.
+        '''
+        self._handler = handler
+        self._keepAliveTimeout = keepAliveTimeout
+        self._requestTimeout = requestTimeout
+        self._maxHeaders = maxHeaders
+        self._maxHeaderBytes = maxHeaderBytes
+        self._maxBodySize = maxBodySize
+        self._stopEvent = None
+        self._activeRequests = 0
+
+    async def serve(self, host=None, port=None, sock=None, stopSignals=()):
+        '''
+        (host, port) 또는 이미 열린 소켓 sock에서 요청을 받기 시작한다.
+        stop()이 불리거나 stopSignals의 시그널을 받으면
+        새 연결을 그만 받고, 처리 중인 요청을 마친 뒤 돌아온다.
+        '''
+        loop = asyncio.get_running_loop()
+        self._stopEvent = asyncio.Event()
+        for signum in stopSignals:
+            loop.add_signal_handler(signum, self._stopEvent.set)
+        if sock is not None:
+            server = await asyncio.start_server(self._onConnection, sock=sock)
+        else:
+            server = await asyncio.start_server(self._onConnection, host, port)
+        async with server:
+            await self._stopEvent.wait()
+        while self._activeRequests > 0:
+            await asyncio.sleep(0.05)
+
+    def serveForever(self, host=None, port=None, sock=None, stopSignals=()):
+        asyncio.run(self.serve(host, port, sock, stopSignals))
+
+    def stop(self):
+        '''serve()를 끝낸다. 이벤트 루프 안에서 불러야 한다.'''
+        if self._stopEvent is not None:
+            self._stopEvent.set()
+
+    async def _onConnection(self, reader, writer):
+        try:
+            while not self._stopEvent.is_set():
+                request = await self._readRequest(reader)
+                if request is None:
+                    break
+                method, target, keepAlive = request
+                self._activeRequests += 1
+                try:
+                    status, headers, body = await self._handler(method, target)
+                except Exception:
+                    status, headers, body = 500, {}, b''
+                finally:
+                    self._activeRequests -= 1
+                if self._stopEvent.is_set():
+                    keepAlive = False
+                self._writeResponse(writer, status, headers, body, keepAlive)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except RequestError as e:
+            # 한도를 넘은 요청: 남은 것은 읽지 않고 답한 뒤 닫는다.
+            try:
+                self._writeResponse(writer, e.status, {}, b'', False)
+                await writer.drain()
+            except ConnectionError:
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # 클라이언트가 끊었거나 요청이 너무 크거나 망가짐.
+            pass
+        finally:
+            writer.close()
+
+    async def _readRequest(self, reader):
+        '''요청 하나를 읽는다. 연결이 끝났거나 다음 요청 없이 시간이 다 되면 None.'''
+        # 다음 요청의 첫 바이트는 keepAliveTimeout까지 기다린다.
+        try:
+            first = await asyncio.wait_for(reader.read(1), self._keepAliveTimeout)
+        except asyncio.TimeoutError:
+            return None
+        if not first:
+            return None
+        # 그 뒤로 요청 줄, 헤더, 본문은 한 기한 안에 모두 받아야 한다.
+        try:
+            return await asyncio.wait_for(
+                self._readRequestFrom(reader, first), self._requestTimeout )
+        except asyncio.TimeoutError:
+            raise RequestError(408)
+
+    async def _readRequestFrom(self, reader, first):
+        '''첫 바이트first에 이어 요청 하나를 읽는다. 결과: (method, target, keepAlive)'''
+        try:
+            requestLine = first + await reader.readline()
+        except ValueError:
+            # 요청 줄이 StreamReader의 버퍼 한도보다 길다.
+            raise RequestError(414)
+        parts = requestLine.decode('latin-1').split()
+        if len(parts) != 3:
+            raise ValueError('Malformed request line.')
+        method, target, version = parts
+        headers = await self._readHeadersAndBody(reader)
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keepAlive = connection != 'close'
+        else:
+            keepAlive = connection == 'keep-alive'
+        return method, target, keepAlive
+
+    async def _readHeadersAndBody(self, reader):
+        '''헤더들을 읽고 본문은 읽어 버린다. 결과: {소문자 헤더 이름: 값}'''
+        headers = {}
+        headerLines = 0
+        headerBytes = 0
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # 한 줄이 StreamReader의 버퍼 한도보다 길다.
+                raise RequestError(431)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            headerLines += 1
+            headerBytes += len(line)
+            if headerLines > self._maxHeaders or headerBytes > self._maxHeaderBytes:
+                raise RequestError(431)
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        # 본문은 쓰지 않지만 다음 요청을 읽으려면 비워야 한다.
+        try:
+            contentLength = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise RequestError(400)
+        if contentLength < 0:
+            raise RequestError(400)
+        if contentLength > self._maxBodySize:
+            raise RequestError(413)
+        if contentLength > 0:
+            await reader.readexactly(contentLength)
+        return headers
+
+    def _writeResponse(self, writer, status, headers, body, keepAlive):
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ''
+        lines = ['HTTP/1.1 {} {}'.format(status, reason)]
+        for name, value in headers.items():
+            lines.append('{}: {}'.format(name, value))
+        lines.append('Content-Length: {}'.format(len(body)))
+        lines.append('Connection: {}'.format('keep-alive' if keepAlive else 'close'))
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        writer.write(head.encode('latin-1') + body)
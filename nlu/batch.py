@@ -0,0 +1,169 @@
+'''
+Training many domains at once in a pool of processes
+'''
+
+import os
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from nlu import train as nluTrain
+from nlu.predict import configureThreads
+
+# 도메인 하나를 학습하는 프로세스가 쓰는 메모리의 어림값(bytes). TensorFlow, 모델과 데이터셋.
+MEMORY_PER_WORKER = 2 << 30
+
+def discoverDomains():
+    '''DATA_ROOT 아래에서 raw.xlsx가 있는 도메인들 (이름순)'''
+    if not os.path.isdir(nluTrain.DATA_ROOT):
+        return []
+    return sorted(
+        name for name in os.listdir(nluTrain.DATA_ROOT)
+        if not name.startswith('.')
+        and os.path.isfile(os.path.join(nluTrain.DATA_ROOT, name, 'raw.xlsx')) )
+
+def availableCpus():
+    '''이 프로세스가 쓸 수 있는 CPU 코어 수'''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def availableMemory():
+    '''지금 새로 쓸 수 있는 메모리(bytes). /proc/meminfo의 MemAvailable. 알 수 없으면 None.'''
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def poolSize(numDomains, memoryPerWorker=MEMORY_PER_WORKER, maxWorkers=None):
+    '''
+    함께 학습할 도메인 수: CPU 코어 수, 지금 쓸 수 있는 메모리로 띄울 수 있는 프로세스 수,
+    도메인 수, maxWorkers 중 가장 작은 것. 적어도 1.
+    '''
+    limits = [availableCpus(), numDomains]
+    memory = availableMemory()
+    if memory is not None and memoryPerWorker:
+        limits.append(memory // memoryPerWorker)
+    if maxWorkers:
+        limits.append(maxWorkers)
+    return max(1, min(limits))
+
+def trainDomains(domains, trainArgs=None, workers=None,
+    memoryPerWorker=MEMORY_PER_WORKER, force=False, verbose=False):
+    '''
+    도메인들domains을 프로세스 풀에서 함께 학습한다. 도메인마다 Trainer.train(**trainArgs)와 같다.
+    지난번에 성공한 학습과 데이터, 학습 조건이 모두 같은 도메인(Trainer.isUpToDate)은 건너뛴다. force이면 모두 학습한다.
+    풀의 크기는 workers(없으면 poolSize)이고, 프로세스마다 TensorFlow 연산 스레드는 코어 수를 나눠 갖는다.
+    큰 데이터(raw.xlsx)의 도메인부터 시작해 마지막에 혼자 오래 도는 도메인이 없게 한다.
+    한 도메인이 실패해도 나머지는 계속한다.
+    결과: 도메인마다 {'domain', 'status': 'trained' | 'skipped' | 'failed', 'seconds',
+        'summary': nlu.train.metricsSummary의 값 또는 None, 'error': 실패했을 때 그 내용}의 리스트 (domains 순서)
+    '''
+    trainArgs = dict(trainArgs or {})
+    if trainArgs.get('parallel'):
+        raise ValueError('Domains are already trained in parallel; parallel=True is not supported here.')
+    results = {}
+    pending = []
+    for domain in domains:
+        trainer = nluTrain.Trainer(domain)
+        try:
+            upToDate = not force and trainer.isUpToDate(**trainArgs)
+        except OSError:
+            # raw.xlsx가 없거나 읽을 수 없다: 학습에서 실패로 알린다.
+            upToDate = False
+        if upToDate:
+            results[domain] = _result(domain, 'skipped', 0.0, trainer.buildStamp())
+            _log(verbose, domain, 'Up to date. Skipping.')
+        else:
+            pending.append(domain)
+
+    if pending:
+        if workers is None:
+            workers = poolSize(len(pending), memoryPerWorker)
+        workers = max(1, min(workers, len(pending)))
+        threads = max(1, availableCpus() // workers)
+        pending.sort(key=_dataSize, reverse=True)
+        _log(verbose, None, 'Training {} domains in {} processes ({} threads each): {}'.format(
+            len(pending), workers, threads, pending ))
+        # TensorFlow는 fork를 견디지 못하므로 새로 띄운(spawn) 프로세스에서 학습한다.
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_initWorker, initargs=(threads,) ) as executor:
+            futures = {
+                executor.submit(_trainDomain, domain, trainArgs, verbose): domain
+                for domain in pending }
+            for future in as_completed(futures):
+                domain = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    # 프로세스가 죽었다 (메모리 부족으로 죽임을 당한 때 등)
+                    result = _result(domain, 'failed', None, error=traceback.format_exc())
+                results[domain] = result
+                _log(verbose, domain, 'Finished: {}'.format(result['status']))
+    return [ results[domain] for domain in domains ]
+
+def formatSummary(results):
+    '''trainDomains의 결과를 도메인마다 한 줄씩의 표로. 결과: 줄들의 리스트'''
+    lines = ['{:<20} {:<8} {:>9} {:>8} {:>8}'.format(
+        'domain', 'status', 'seconds', 'intent', 'entity' )]
+    for result in results:
+        summary = result['summary'] or {}
+        lines.append('{:<20} {:<8} {:>9} {:>8} {:>8}'.format(
+            result['domain'], result['status'],
+            '-' if result['seconds'] is None else '{:.1f}'.format(result['seconds']),
+            _percent(summary.get('intentAccuracy')), _percent(summary.get('entityAccuracy')) ))
+    for result in results:
+        if result['error']:
+            lines.append('')
+            lines.append('[{}] {}'.format(result['domain'], result['error'].rstrip()))
+    return lines
+
+def _trainDomain(domain, trainArgs, verbose):
+    '''풀의 프로세스에서 도메인 하나를 학습한다.'''
+    started = time.time()
+    # 여러 도메인의 출력이 섞이므로 줄마다 도메인을 붙이고, Keras도 에포크마다 한 줄씩 알린다.
+    trainer = nluTrain.Trainer(
+        domain, verbose, log=lambda line: _log(verbose, domain, line) )
+    try:
+        stamp = trainer.train(**trainArgs)
+    except Exception:
+        return _result(domain, 'failed', time.time() - started, error=traceback.format_exc())
+    return _result(domain, 'trained', time.time() - started, stamp)
+
+def _initWorker(threads):
+    # 프로세스마다 코어 수를 나눠 갖는다. (TensorFlow가 처음 돌기 전이어야 한다.)
+    configureThreads(intraOp=threads, interOp=min(2, threads))
+
+def _result(domain, status, seconds, stamp=None, error=None):
+    summary = None
+    if stamp and 'metrics' in stamp:
+        summary = nluTrain.metricsSummary(stamp['metrics'])
+    return {
+        'domain': domain,
+        'status': status,
+        'seconds': None if seconds is None else round(seconds, 3),
+        'summary': summary,
+        'error': error,
+    }
+
+def _dataSize(domain):
+    try:
+        return os.path.getsize(nluTrain.Trainer(domain).rawExcelFile())
+    except OSError:
+        return 0
+
+def _percent(value):
+    return '-' if value is None else '{:.2%}'.format(value)
+
+def _log(verbose, domain, line):
+    if verbose:
+        # 한 번에 한 줄로 찍어야 다른 프로세스의 출력과 섞이지 않는다.
+        prefix = '[TRAINER:{}]'.format(domain) if domain else '[TRAINER]'
+        print('{} {}'.format(prefix, line), flush=True)
@@ -0,0 +1,121 @@
+'''
+Micro-batching Natural Language Understanding (NLU) predictions
+'''
+
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+# 배처 스레드를 멈추게 하는 표식
+_STOP = object()
+
+class QueueFullError(Exception):
+    '''대기 중인 질의가 이미 maxQueueSize개라서 더 받을 수 없음.'''
+    pass
+
+class MicroBatcher:
+    '''
+    마이크로배처: 동시에 들어온 질의들을 모아서 한 번의 배치로 예측한다.
+    배치 하나는 최대 maxBatchSize개이며, 첫 질의가 들어온 뒤로
+    최대 maxWaitMs 밀리초까지만 다른 질의를 기다린다.
+    '''
+
+    def __init__(self, predictBatch, maxBatchSize=32, maxWaitMs=5, maxQueueSize=0):
+        '''
+        Args:
+            predictBatch: 텍스트 리스트를 받아 같은 순서의 결과 리스트를 돌려주는 함수.
+                예) Predictor.predictBatch
+            maxBatchSize: 한 배치의 최대 질의 수
+            maxWaitMs: 배치를 채우기 위해 기다리는 최대 시간(ms)
+            maxQueueSize: 처리가 끝나지 않은 질의의 최대 수. 넘치면 submit이
+                QueueFullError를 낸다. 0이면 제한 없음.
+        '''
+        if maxBatchSize < 1:
+            raise ValueError('maxBatchSize must be at least 1.')
+        self._predictBatch = predictBatch
+        self._maxBatchSize = maxBatchSize
+        self._maxWait = max(0.0, maxWaitMs) / 1000.0
+        self._maxQueueSize = maxQueueSize
+        self._pending = 0  # 대기 중이거나 예측 중인 질의 수
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        '''
+        text를 예측 대기열에 넣고 결과를 받을 Future를 돌려준다.
+        대기열이 가득 찼으면 QueueFullError.
+        '''
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The batcher is already closed.')
+            if self._maxQueueSize and self._pending >= self._maxQueueSize:
+                raise QueueFullError('Too many pending queries.')
+            self._pending += 1
+            self._queue.put((text, future))
+        future.add_done_callback(self._onDone)
+        return future
+
+    def pending(self):
+        '''대기 중이거나 예측 중인 질의 수'''
+        return self._pending
+
+    def _onDone(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def predict(self, text):
+        '''text 하나를 예측한다. 배치가 처리될 때까지 기다린다.'''
+        return self.submit(text).result()
+
+    def close(self):
+        '''대기열에 남은 질의를 모두 처리한 뒤 배처 스레드를 끝낸다.'''
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self._maxWait
+            # 최대 크기가 되거나 기다림 시간이 다할 때까지 모은다.
+            while len(batch) < self._maxBatchSize:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._runBatch(batch)
+
+    def _runBatch(self, batch):
+        # 이미 취소된 질의는 빼고 예측한다.
+        batch = [(text, future) for text, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if len(batch) == 0:
+            return
+        try:
+            results = self._predictBatch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,44 @@
+'''
+Length buckets for static-shape NLU inference
+'''
+
+import json
+import math
+import numpy as np
+
+# buckets.json이 없을 때 쓰는 버킷 경계(글자 수)
+DEFAULT_BUCKETS = [8, 16, 24, 40, 64]
+
+def chooseBuckets(lengths, quantiles=(0.5, 0.8, 0.95, 0.99, 1.0), multiple=8):
+    '''
+    학습 데이터 텍스트 길이들의 분포에서 버킷 경계를 고른다.
+    각 분위수quantiles의 길이를 multiple의 배수로 올린 것들이다.
+    예) lengths의 50%가 11자 이하, 최대가 37자이면 [16, ..., 40]
+    '''
+    lengths = np.asarray(list(lengths))
+    if len(lengths) == 0:
+        return list(DEFAULT_BUCKETS)
+    edges = set()
+    for q in quantiles:
+        length = max(1, int(math.ceil(np.quantile(lengths, q))))
+        edges.add( int(math.ceil(length / multiple)) * multiple )
+    return sorted(edges)
+
+def bucketWidth(length, buckets):
+    '''
+    길이length인 입력을 채워 넣을(padding) 너비: length 이상인 가장 작은 버킷 경계.
+    가장 큰 경계보다 길면 그 경계의 배수로 올린다.
+    '''
+    for edge in buckets:
+        if length <= edge:
+            return edge
+    largest = buckets[-1]
+    return int(math.ceil(length / largest)) * largest
+
+def saveBuckets(fname, buckets):
+    with open(fname, 'w') as f:
+        json.dump({'buckets': list(buckets)}, f)
+
+def loadBuckets(fname):
+    with open(fname, 'r') as f:
+        return json.load(f)['buckets']
@@ -0,0 +1,97 @@
+'''
+Single-file binary bundle of named NumPy arrays, memory-mapped on load
+'''
+
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+BUNDLE_MAGIC = b'NLUBUNDL'
+BUNDLE_VERSION = 1
+
+# magic, 형식 버전, 헤더 길이, 체크섬(CRC32)
+_PREFIX = struct.Struct('<8sIII')
+# 배열들의 시작 위치를 이 배수로 맞춘다.
+_ALIGN = 64
+
+class BundleError(ValueError):
+    '''번들 파일이 아니거나, 버전이 맞지 않거나, 깨졌다.'''
+
+def writeBundle(fname, sections):
+    '''
+    여러 묶음(section)의 배열들을 파일 하나로 쓴다.
+    sections: 이름 -> {'class': 클래스 이름, 'arrays': {배열 이름: ndarray}}
+    다른 프로세스가 읽는 도중에 바뀌지 않도록 임시 파일에 쓴 뒤 바꿔 끼운다.
+    '''
+    header = {'sections': {}}
+    chunks = []
+    offset = 0
+    for name, section in sections.items():
+        arrays = {}
+        for arrayName, array in section['arrays'].items():
+            array = np.ascontiguousarray(array)
+            padding = (-offset) % _ALIGN
+            chunks.append(b'\0' * padding)
+            offset += padding
+            arrays[arrayName] = {
+                'dtype': array.dtype.str,
+                'shape': list(array.shape),
+                'offset': offset,
+            }
+            chunks.append(array.tobytes())
+            offset += array.nbytes
+        header['sections'][name] = {'class': section['class'], 'arrays': arrays}
+
+    headerBytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    # 데이터가 _ALIGN 배수 위치에서 시작하도록 헤더 뒤를 공백으로 채운다.
+    headerBytes += b' ' * ((-(_PREFIX.size + len(headerBytes))) % _ALIGN)
+    data = b''.join(chunks)
+    checksum = zlib.crc32(data, zlib.crc32(headerBytes))
+    tmpName = '{}.tmp{}'.format(fname, os.getpid())
+    with open(tmpName, 'wb') as f:
+        f.write(_PREFIX.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(headerBytes), checksum))
+        f.write(headerBytes)
+        f.write(data)
+    os.replace(tmpName, fname)
+
+def readBundle(fname, verify=True):
+    '''
+    writeBundle로 쓴 파일을 읽는다. 배열들은 복사하지 않고 파일을 메모리맵(mmap)한 것이라
+    여러 프로세스가 같은 파일을 읽으면 같은 물리 메모리를 나눠 쓴다.
+    verify이면 체크섬을 확인한다.
+    결과: 이름 -> {'class': 클래스 이름, 'arrays': {배열 이름: 읽기 전용 ndarray}}
+    '''
+    with open(fname, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        if len(prefix) < _PREFIX.size:
+            raise BundleError('Not a bundle file: {}'.format(fname))
+        magic, version, headerLen, checksum = _PREFIX.unpack(prefix)
+        if magic != BUNDLE_MAGIC:
+            raise BundleError('Not a bundle file: {}'.format(fname))
+        if version != BUNDLE_VERSION:
+            raise BundleError('Unsupported bundle version {}: {}'.format(version, fname))
+        headerBytes = f.read(headerLen)
+
+    dataStart = _PREFIX.size + headerLen
+    if os.path.getsize(fname) > dataStart:
+        data = np.memmap(fname, dtype=np.uint8, mode='r', offset=dataStart)
+    else:
+        data = np.zeros(0, dtype=np.uint8)
+    if verify and zlib.crc32(data, zlib.crc32(headerBytes)) != checksum:
+        raise BundleError('Checksum mismatch: {}'.format(fname))
+
+    header = json.loads(headerBytes.decode('utf-8'))
+    sections = {}
+    for name, section in header['sections'].items():
+        arrays = {}
+        for arrayName, spec in section['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            start = spec['offset']
+            arrays[arrayName] = np.frombuffer(
+                data, dtype=dtype, count=count, offset=start
+                ).reshape(spec['shape'])
+        sections[name] = {'class': section['class'], 'arrays': arrays}
+    return sections
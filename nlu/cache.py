@@ -0,0 +1,133 @@
+'''
+Caching NLU prediction results
+'''
+
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from nlu.predict import modelVersion
+
+def normalizeText(text):
+    '''
+    캐시 키로 쓸 수 있게 질의 텍스트를 정규화한다.
+    유니코드 NFC(자모가 나뉜 한글을 완성형으로)와 앞뒤 공백 제거만 한다.
+    BIO 태그가 글자마다 붙기 때문에 글자 수를 바꾸는 정규화(공백 합치기 등)는 하지 않는다.
+    '''
+    return unicodedata.normalize('NFC', text).strip()
+
+class ResultCache:
+    '''
+    예측 결과 캐시: (도메인, 모델 버전, 정규화된 텍스트) -> 결과
+    최대 maxEntries개를 두며(LRU), 항목마다 ttl초 동안만 유효하다.
+    같은 질의가 동시에 여럿 들어오면 예측은 한 번만 하고 결과를 나눠준다.
+    도메인의 모델 파일이 바뀌면 그 도메인의 항목을 모두 버린다.
+    '''
+
+    def __init__(self, maxEntries=10000, ttl=300, checkInterval=1.0):
+        '''
+        Args:
+            maxEntries: 최대 항목 수
+            ttl: 항목이 유효한 시간(초)
+            checkInterval: 모델 파일이 바뀌었는지 확인하는 최소 간격(초)
+        '''
+        self._maxEntries = maxEntries
+        self._ttl = ttl
+        self._checkInterval = checkInterval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (만료시각, 결과), 오래 안 쓰인 것이 앞
+        self._inflight = {}  # key -> 예측 중인 Future
+        self._fileVersions = {}  # domain -> (확인한 시각, 모델 파일 버전)
+        self._hits = 0
+        self._misses = 0
+        self._deduplicated = 0
+
+    def submit(self, domain, version, text, submitFn):
+        '''
+        (domain, version, text)의 결과를 받을 Future를 돌려준다.
+        캐시에 없고 예측 중이지도 않을 때만 submitFn()으로 예측을 맡긴다.
+        submitFn은 결과를 받을 Future를 돌려주는 함수이다.
+        '''
+        self._checkModelFiles(domain)
+        key = (domain, version, text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expiresAt, result = entry
+                if expiresAt > now:
+                    self._hits += 1
+                    self._entries.move_to_end(key)
+                    future = Future()
+                    future.set_result(result)
+                    return future
+                del self._entries[key]
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self._deduplicated += 1
+                return inflight
+            self._misses += 1
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._inflight[key] = future
+
+        try:
+            predicting = submitFn()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        predicting.add_done_callback(
+            lambda done: self._onPredicted(key, future, done) )
+        return future
+
+    def invalidate(self, domain=None):
+        '''도메인domain의(없으면 모든) 항목을 버린다.'''
+        with self._lock:
+            if domain is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == domain]:
+                del self._entries[key]
+
+    def stats(self):
+        '''적중/실패 횟수 등'''
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'deduplicated': self._deduplicated,
+            }
+
+    def _onPredicted(self, key, future, done):
+        try:
+            result = done.result()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            return
+        with self._lock:
+            del self._inflight[key]
+            self._entries[key] = (time.monotonic() + self._ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last=False)
+        future.set_result(result)
+
+    def _checkModelFiles(self, domain):
+        now = time.monotonic()
+        with self._lock:
+            checkedAt, lastVersion = self._fileVersions.get(domain, (None, None))
+            if checkedAt is not None and now - checkedAt < self._checkInterval:
+                return
+            # 다른 스레드가 같이 확인하지 않도록 시각을 먼저 적어둔다.
+            self._fileVersions[domain] = (now, lastVersion)
+        version = modelVersion(domain)
+        with self._lock:
+            self._fileVersions[domain] = (now, version)
+        if lastVersion is not None and version != lastVersion:
+            self.invalidate(domain)
@@ -0,0 +1,232 @@
+'''
+On-disk cache of the encoded and padded training arrays
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from nlu.mapper import Mapper
+from nlu.exact_index import ExactIndex
+from nlu.bundle import readBundle, writeBundle, BundleError
+from nlu.text_encoder import padArrays
+from nlu.util import parseRawtable
+
+# 인코딩 방법이나 저장 형식이 바뀌면 올린다. (이전 캐시는 모두 무효가 됨)
+DATASET_VERSION = 3
+DATASET_FILE = 'dataset.bundle'
+DATASET_MAPPER_FILE = 'mapper.bundle'
+DATASET_EXACT_INDEX_FILE = 'exact_index.json'
+DATASET_INFO_FILE = 'dataset.json'
+
+def dataHash(rawTable):
+    '''표rawTable의 (intent, text) 행들의 해시. 행 순서도 포함한다.'''
+    h = hashlib.sha1()
+    for intent, text in zip(rawTable['intent'], rawTable['text']):
+        h.update('{}\t{}\n'.format(intent, text).encode('utf-8'))
+    return h.hexdigest()
+
+def datasetKey(rawTable, paddedLen, vocabMinCount=1, vocabMaxSize=None, extends=None):
+    '''
+    캐시 항목의 이름: 데이터, 매퍼를 만드는 조건(글자 사전 제한), paddedLen, 형식 버전의 해시.
+    이 중 하나라도 바뀌면 다른 항목이 된다.
+    extends: 매퍼를 새로 만들지 않고 예전 매퍼를 늘려 쓴 것이면 그 예전 빌드(build.json의 fingerprint)
+    '''
+    fields = {
+        'version': DATASET_VERSION,
+        'data': dataHash(rawTable),
+        'paddedLen': paddedLen,
+        'vocabMinCount': vocabMinCount,
+        'vocabMaxSize': vocabMaxSize,
+    }
+    if extends is not None:
+        fields['extends'] = extends
+    h = hashlib.sha1()
+    h.update(json.dumps(fields, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+class Dataset:
+    '''
+    학습에 쓰는, 인코딩하고 Padding한 배열들과 그것을 만든 매퍼.
+        X: [N, paddedLen] 글자 ID (IC와 ER이 같은 입력을 쓴다)
+        yIntent: [N] 의도 ID
+        yBio: [N, paddedLen] BIO 태그 ID
+        lengths: [N] 순수 텍스트의 글자 수 (길이 버킷을 고를 때 씀)
+        order: [N] 섞은 순서. 앞쪽 testRatio만큼이 Test set이다.
+        ids, bio, offsets: 자르지도 채우지도 않은 행마다의 글자 ID, BIO 태그 ID를 이어 붙인 것과
+            행마다의 시작 위치 [N+1]. rowIds, rowBio로 한 행씩 꺼낸다. (nlu.pipeline)
+    캐시에서 불러온 배열들은 파일을 메모리맵(mmap)한 읽기 전용이다.
+    '''
+
+    def __init__(self, mapper, exactIndex, arrays, info):
+        self.mapper = mapper
+        self.exactIndex = exactIndex
+        self.X = arrays['X']
+        self.yIntent = arrays['yIntent']
+        self.yBio = arrays['yBio']
+        self.lengths = arrays['lengths']
+        self.order = arrays['order']
+        self.ids = arrays['ids']
+        self.bio = arrays['bio']
+        self.offsets = arrays['offsets']
+        self.info = info
+
+    def __len__(self):
+        return len(self.X)
+
+    def rowIds(self, row):
+        '''행row의 글자 ID 배열 (paddedLen으로 자르지 않은 것)'''
+        return self.ids[self.offsets[row]:self.offsets[row+1]]
+
+    def rowBio(self, row):
+        '''행row의 BIO 태그 ID 배열 (paddedLen으로 자르지 않은 것)'''
+        return self.bio[self.offsets[row]:self.offsets[row+1]]
+
+    def split(self, testRatio):
+        '''(Train set 행 번호들, Test set 행 번호들). 같은 캐시이면 언제나 같게 나뉜다.'''
+        testSize = int(len(self)*testRatio)
+        return self.order[testSize:], self.order[:testSize]
+
+    @classmethod
+    def build(cls, rawTable, paddedLen, vocabMinCount=1, vocabMaxSize=None,
+        mapper=None, extends=None):
+        '''
+        표rawTable을 파싱·인코딩해 새로 만든다. 섞는 순서는 이때 정한다.
+        mapper를 주면 매퍼를 새로 만들지 않고 그것으로 인코딩한다.
+        (예전 매퍼를 늘린 것이면 extends에 그 예전 빌드를 준다. datasetKey 참고)
+        '''
+        rawTable = parseRawtable(rawTable)
+        if mapper is None:
+            mapper = Mapper.buildFromRawtable(rawTable, vocabMinCount, vocabMaxSize)
+        exactIndex = ExactIndex.buildFromRawtable(rawTable)
+        ids = [ mapper.textEncoder.encodeArray(t) for t in rawTable['ptext'] ]
+        bio = [ np.asarray(tags, dtype=np.int32) for tags in mapper.mapRawtableBioTags(rawTable) ]
+        lengths = np.array([ len(i) for i in ids ], dtype=np.int32)
+        arrays = {
+            'X': padArrays(ids, paddedLen),
+            'yIntent': np.array(
+                [ mapper.mapIntent(it) for it in rawTable['intent'] ], dtype=np.int32 ),
+            'yBio': padArrays(bio, paddedLen),
+            'lengths': lengths,
+            'order': np.random.permutation(len(rawTable)).astype(np.int32),
+            'ids': np.concatenate(ids + [np.zeros(0, dtype=np.int32)]),
+            'bio': np.concatenate(bio + [np.zeros(0, dtype=np.int32)]),
+            'offsets': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+        }
+        info = {
+            'version': DATASET_VERSION,
+            'key': datasetKey(rawTable, paddedLen, vocabMinCount, vocabMaxSize, extends),
+            'dataHash': dataHash(rawTable),
+            'paddedLen': paddedLen,
+            'vocabMinCount': vocabMinCount,
+            'vocabMaxSize': vocabMaxSize,
+            'size': len(rawTable),
+            'textVocab': mapper.textVocabReport(),
+        }
+        return cls(mapper, exactIndex, arrays, info)
+
+    def saveToDir(self, dirname):
+        '''
+        디렉토리dirname에 저장한다. 다른 프로세스가 반쯤 쓴 것을 읽지 않도록
+        임시 디렉토리에 모두 쓴 뒤 바꿔 끼운다.
+        '''
+        tmpName = '{}.tmp{}'.format(dirname, os.getpid())
+        os.makedirs(tmpName, exist_ok=True)
+        writeBundle(os.path.join(tmpName, DATASET_FILE), {
+            'dataset': {
+                'class': self.__class__.__name__,
+                'arrays': {
+                    'X': self.X,
+                    'yIntent': self.yIntent,
+                    'yBio': self.yBio,
+                    'lengths': self.lengths,
+                    'order': self.order,
+                    'ids': self.ids,
+                    'bio': self.bio,
+                    'offsets': self.offsets,
+                },
+            } })
+        self.mapper.saveBundle(os.path.join(tmpName, DATASET_MAPPER_FILE))
+        self.exactIndex.saveToFile(os.path.join(tmpName, DATASET_EXACT_INDEX_FILE))
+        # 이 배열들을 만든 매퍼가 어느 것인지 (매퍼 번들의 해시)
+        self.info['mapperVersion'] = _fileHash(os.path.join(tmpName, DATASET_MAPPER_FILE))
+        with open(os.path.join(tmpName, DATASET_INFO_FILE), 'w') as f:
+            json.dump(self.info, f, indent=2)
+        if os.path.exists(dirname):
+            shutil.rmtree(dirname)
+        os.replace(tmpName, dirname)
+
+    @classmethod
+    def loadFromDir(cls, dirname, key=None):
+        '''
+        saveToDir로 저장한 것을 불러온다. key를 주면 그 항목이 맞는지 확인한다.
+        형식 버전, key, 매퍼, 체크섬 중 하나라도 맞지 않으면 BundleError.
+        '''
+        with open(os.path.join(dirname, DATASET_INFO_FILE), 'r') as f:
+            info = json.load(f)
+        if info.get('version') != DATASET_VERSION:
+            raise BundleError('Unsupported dataset version: {}'.format(dirname))
+        if key is not None and info.get('key') != key:
+            raise BundleError('Dataset key mismatch: {}'.format(dirname))
+        mapperFile = os.path.join(dirname, DATASET_MAPPER_FILE)
+        if info.get('mapperVersion') != _fileHash(mapperFile):
+            raise BundleError('Dataset mapper mismatch: {}'.format(dirname))
+        section = readBundle(os.path.join(dirname, DATASET_FILE))['dataset']
+        if section['class'] != cls.__name__:
+            raise TypeError('Wrong dataset class.')
+        mapper = Mapper.loadBundle(mapperFile)
+        exactIndex = ExactIndex.loadFromFile(os.path.join(dirname, DATASET_EXACT_INDEX_FILE))
+        return cls(mapper, exactIndex, section['arrays'], info)
+
+
+class DatasetCache:
+    '''
+    디렉토리cacheDir 아래에 Dataset들을 datasetKey 이름으로 둔다.
+    같은 데이터와 조건이면 파싱·인코딩 없이 바로 불러오고, 데이터가 바뀌면 예전 항목들은 지운다.
+    (데이터가 같고 paddedLen 등만 다른 항목들은 남겨 둔다: 하이퍼파라미터 탐색용)
+    '''
+
+    def __init__(self, cacheDir):
+        self._cacheDir = cacheDir
+
+    def entryDir(self, key):
+        return os.path.join(self._cacheDir, key)
+
+    def get(self, rawTable, paddedLen, vocabMinCount=1, vocabMaxSize=None):
+        '''(Dataset, 캐시에서 불러왔는지)'''
+        key = datasetKey(rawTable, paddedLen, vocabMinCount, vocabMaxSize)
+        try:
+            return Dataset.loadFromDir(self.entryDir(key), key), True
+        except (OSError, ValueError, KeyError, TypeError):
+            # 없거나, 예전 형식이거나, 깨졌다: 새로 만든다.
+            pass
+        dataset = Dataset.build(rawTable, paddedLen, vocabMinCount, vocabMaxSize)
+        os.makedirs(self._cacheDir, exist_ok=True)
+        dataset.saveToDir(self.entryDir(key))
+        self.prune(dataset.info['dataHash'])
+        return dataset, False
+
+    def prune(self, dataHash):
+        '''데이터가 dataHash가 아닌 항목들을 지운다.'''
+        for name in os.listdir(self._cacheDir):
+            if '.tmp' in name:
+                # 다른 프로세스가 쓰고 있는 중
+                continue
+            entry = os.path.join(self._cacheDir, name)
+            try:
+                with open(os.path.join(entry, DATASET_INFO_FILE), 'r') as f:
+                    stale = json.load(f).get('dataHash') != dataHash
+            except (OSError, ValueError):
+                stale = True
+            if stale and os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+
+
+def _fileHash(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
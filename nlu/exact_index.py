@@ -0,0 +1,70 @@
+'''
+Exact-match index of the annotated training utterances
+'''
+
+import json
+from collections import Counter
+from nlu.util import parseRawtable
+
+class ExactIndex:
+    '''
+    완전일치 색인: 학습 데이터의 순수 텍스트 -> (intent, BIO 태그배열, 확률)
+    학습 문장이 그대로 들어온 질의는 모델을 돌리지 않고 바로 답할 수 있다.
+    같은 텍스트에 주석이 여러 가지면 가장 많은 것을 쓰고, 그 비율을 확률로 둔다.
+    '''
+
+    def __init__(self, table=None):
+        # table: 순수 텍스트 -> [intent, [[태그, 반복수], ...], 확률]
+        self._table = table if table is not None else {}
+
+    @classmethod
+    def buildFromRawtable(cls, rawTable):
+        rawTable = parseRawtable(rawTable)
+        counts = {}
+        for intent, ptext, tags in zip(rawTable['intent'], rawTable['ptext'], rawTable['bioTags']):
+            tags = tuple(tags)
+            counts.setdefault(ptext, Counter())[(intent, tags)] += 1
+
+        table = {}
+        for ptext, counter in counts.items():
+            (intent, tags), count = counter.most_common(1)[0]
+            prob = count / sum(counter.values())
+            table[ptext] = [intent, _runLengthEncode(tags), prob]
+        return cls(table)
+
+    def __len__(self):
+        return len(self._table)
+
+    def lookup(self, text):
+        '''text가 학습 데이터에 있으면 (intent, BIO 태그배열, 확률), 없으면 None.'''
+        found = self._table.get(text)
+        if found is None:
+            return None
+        intent, runs, prob = found
+        return intent, _runLengthDecode(runs), prob
+
+    def saveToFile(self, fname):
+        with open(fname, 'w', encoding='utf-8') as f:
+            json.dump({'exactIndex': self._table}, f, ensure_ascii=False)
+
+    @classmethod
+    def loadFromFile(cls, fname):
+        with open(fname, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)['exactIndex'])
+
+
+def _runLengthEncode(tags):
+    '''['O', 'O', 'B-loc', 'I-loc'] -> [['O', 2], ['B-loc', 1], ['I-loc', 1]]'''
+    runs = []
+    for tag in tags:
+        if runs and runs[-1][0] == tag:
+            runs[-1][1] += 1
+        else:
+            runs.append([tag, 1])
+    return runs
+
+def _runLengthDecode(runs):
+    tags = []
+    for tag, count in runs:
+        tags.extend([tag] * count)
+    return tags
@@ -0,0 +1,474 @@
+'''
+Exporting trained NLU models into formats that are faster to serve
+'''
+
+import os
+
+SAVEDMODEL_POSTFIX = '.savedmodel'
+
+def savedModelDir(h5File):
+    '''모델 HDF5 파일 옆에 둘 SavedModel 디렉토리 주소'''
+    return os.path.splitext(h5File)[0] + SAVEDMODEL_POSTFIX
+
+def exportSavedModel(model, exportDir):
+    '''
+    Keras 모델을 SavedModel로 내보낸다.
+    [배치, 길이] int32 입력을 받는 predict 함수를 미리 trace해 두므로,
+    불러올 때 Keras 모델을 다시 짓거나 그래프를 다시 trace하지 않는다.
+    '''
+    import tensorflow as tf
+
+    class _Serving(tf.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int32)])
+        def predict(self, X):
+            return self.model(X, training=False)
+
+    tf.saved_model.save(_Serving(model), exportDir)
+
+def exportSavedModelFromFile(h5File):
+    '''HDF5 모델 파일을 불러와 그 옆에 SavedModel로 내보낸다.'''
+    from tensorflow.keras.models import load_model as keras_load_model
+    exportSavedModel(keras_load_model(h5File), savedModelDir(h5File))
+    return savedModelDir(h5File)
+
+NUMPY_POSTFIX = '.npz'
+
+# NumPy 엔진과 Keras 출력이 이만큼 넘게 다르면 내보내기를 실패로 본다.
+NUMPY_TOLERANCE = 1e-4
+
+def numpyWeightsFile(h5File):
+    '''모델 HDF5 파일 옆에 둘 NumPy 가중치 파일 주소'''
+    return os.path.splitext(h5File)[0] + NUMPY_POSTFIX
+
+def exportNumpyWeights(model, fname, X=None, tolerance=NUMPY_TOLERANCE):
+    '''
+    Keras 모델의 가중치와 층 설정을 nlu.numpy_engine.NumpyModel이 읽는 .npz 파일로 내보낸다.
+    입력 예시 X([배치, 길이] int 행렬)를 주면 내보낸 모델의 출력이
+    Keras 출력과 tolerance 안에서 같은지 확인하고, 아니면 ValueError를 낸다.
+    '''
+    import json
+    import numpy as np
+
+    layers, weights, heads = _inferenceLayers(model)
+    arrays = {}
+    for i, layerWeights in enumerate(weights):
+        for j, w in enumerate(layerWeights):
+            arrays['layer{}_{}'.format(i, j)] = w
+    for h, (_, headWeights) in enumerate(heads):
+        for i, layerWeights in enumerate(headWeights):
+            for j, w in enumerate(layerWeights):
+                arrays['head{}_layer{}_{}'.format(h, i, j)] = w
+    config = {'layers': layers}
+    if heads:
+        config['heads'] = [ headLayers for headLayers, _ in heads ]
+    arrays['config'] = np.array(json.dumps(config))
+    np.savez(fname, **arrays)
+
+    if X is not None:
+        diff = numpyModelError(model, fname, X)
+        if diff > tolerance:
+            raise ValueError('NumPy model differs from Keras by {:.3g} (> {:.3g}): {}'
+                .format(diff, tolerance, fname))
+    return fname
+
+def exportNumpyWeightsFromFile(h5File, X=None):
+    '''HDF5 모델 파일을 불러와 그 옆에 NumPy 가중치 파일로 내보낸다.'''
+    from tensorflow.keras.models import load_model as keras_load_model
+    return exportNumpyWeights(keras_load_model(h5File), numpyWeightsFile(h5File), X)
+
+def importNumpyWeights(model, fname):
+    '''
+    exportNumpyWeights로 내보낸 가중치를 층 구성이 같은 Keras 모델model에 다시 싣는다. (이어서 학습할 때)
+    글자 사전이나 출력(의도, BIO 태그)이 늘어난 모델이면 Embedding의 행들과
+    출력마다 마지막 Dense 층의 열들만 늘어나 있어도 된다: 있던 자리에는 예전 값을 싣고
+    늘어난 자리는 model의 초기값 그대로 둔다. 그 밖의 모양이 다르면 ValueError.
+    '''
+    import numpy as np
+    from nlu.numpy_engine import loadWeights
+    savedLayers, savedWeights, savedHeads = loadWeights(fname)
+    savedParts = [ (savedLayers, savedWeights) ] + savedHeads
+    if not model.built:
+        model.build((None, None))
+    trunk, heads = _inferenceLayerObjects(model)
+    parts = [trunk] + heads
+    if len(parts) != len(savedParts):
+        raise ValueError('Different number of outputs: {}'.format(fname))
+    for layers, (savedLayers, savedWeights) in zip(parts, savedParts):
+        if [ _numpyLayerConfig(l)['type'] for l in layers ] != [ c['type'] for c in savedLayers ]:
+            raise ValueError('Different layers: {}'.format(fname))
+        for i, (layer, weights) in enumerate(zip(layers, savedWeights)):
+            kind = type(layer).__name__
+            # 늘어날 수 있는 축: Embedding은 글자(행), 출력의 마지막 Dense는 분류(열)
+            growAxis = None
+            if kind == 'Embedding':
+                growAxis = 0
+            elif i == len(layers) - 1 and kind in ('Dense', 'TimeDistributed'):
+                growAxis = -1
+            current = layer.get_weights()
+            if len(current) != len(weights):
+                raise ValueError('Different weights in {}: {}'.format(layer.name, fname))
+            layer.set_weights([
+                _grownWeight(np, old, new, growAxis, layer.name, fname)
+                for old, new in zip(weights, current) ])
+    return model
+
+def _grownWeight(np, old, new, growAxis, name, fname):
+    # 예전 가중치old를 새 모양new에 싣는다. growAxis 축으로만 늘어날 수 있다.
+    if old.shape == new.shape:
+        return old
+    axis = None if growAxis is None else growAxis % old.ndim
+    grown = old.ndim == new.ndim and axis is not None and all(
+        o == n if a != axis else o <= n
+        for a, (o, n) in enumerate(zip(old.shape, new.shape)) )
+    if not grown:
+        raise ValueError('Weight shape of {} changed from {} to {}: {}'.format(
+            name, old.shape, new.shape, fname ))
+    merged = np.array(new, dtype=np.float32)
+    index = [ slice(None) ] * old.ndim
+    index[axis] = slice(0, old.shape[axis])
+    merged[tuple(index)] = old
+    return merged
+
+def numpyModelError(model, fname, X):
+    '''입력 X에서 Keras 모델과 NumPy 모델 출력의 최대 절대 오차 (출력이 여럿이면 그 모두에서)'''
+    import numpy as np
+    from nlu.numpy_engine import NumpyModel
+    X = np.asarray(X, dtype=np.int32)
+    expected = _outputList(model(X, training=False))
+    actual = _outputList(NumpyModel.loadFromFile(fname).predict(X))
+    # Keras의 mask된 GlobalAveragePooling1D는 모두 Padding인 행에서 NaN이므로 그런 행은 빼고 잰다.
+    return max( float(np.nanmax(np.abs(np.asarray(e) - a))) for e, a in zip(expected, actual) )
+
+def _outputList(outputs):
+    # 출력이 하나인 모델도 여럿인 모델과 같이 [출력, ...]으로
+    if isinstance(outputs, (list, tuple)):
+        return list(outputs)
+    return [outputs]
+
+def _inferenceLayers(model):
+    '''
+    추론에 쓰이는 층들의 설정과 가중치.
+    출력이 여럿인 모델(Trainer의 결합 모델)은 공유하는 몸통(trunk)과 출력마다의 머리(head)로 나눈다.
+    머리는 그 출력과 이름이 같거나 '<출력 이름>_'으로 시작하는 층들이며, 몸통의 마지막 출력에서 이어진다.
+    결과: ([층 설정, ...], [[가중치 배열, ...], ...], [(머리의 층 설정들, 머리의 가중치들), ...])
+        출력이 하나이면 머리는 []이다.
+    '''
+    import numpy as np
+
+    def configs(layerObjects):
+        layers = []
+        weights = []
+        for layer in layerObjects:
+            config = _numpyLayerConfig(layer)
+            layerWeights = [ np.asarray(w, dtype=np.float32) for w in layer.get_weights() ]
+            config['numWeights'] = len(layerWeights)
+            layers.append(config)
+            weights.append(layerWeights)
+        return layers, weights
+
+    trunk, heads = _inferenceLayerObjects(model)
+    layers, weights = configs(trunk)
+    return layers, weights, [ configs(head) for head in heads ]
+
+def _inferenceLayerObjects(model):
+    '''
+    추론에 쓰이는 Keras 층들을 몸통과 출력마다의 머리로 나눈다. (_inferenceLayers 참고)
+    결과: ([층, ...], [[층, ...], ...])
+    '''
+    outputNames = list(model.output_names) if len(model.outputs) > 1 else []
+
+    def headOf(layer):
+        for h, name in enumerate(outputNames):
+            if layer.name == name or layer.name.startswith(name + '_'):
+                return h
+        return None
+
+    trunk = []
+    heads = [ [] for _ in outputNames ]
+    for layer in model.layers:
+        if _numpyLayerConfig(layer) is None:
+            continue
+        h = headOf(layer)
+        if h is None:
+            trunk.append(layer)
+        else:
+            heads[h].append(layer)
+    return trunk, heads
+
+def _numpyLayerConfig(layer):
+    '''NumPy 엔진이 층을 다시 계산하는 데 필요한 설정. 추론에 쓰이지 않는 층은 None.'''
+    kind = type(layer).__name__
+    if kind in ('InputLayer', 'Dropout', 'SpatialDropout1D'):
+        return None
+    if kind == 'Embedding':
+        return {'type': kind, 'maskZero': bool(layer.mask_zero)}
+    if kind == 'LSTM':
+        return _lstmConfig(layer)
+    if kind == 'Bidirectional':
+        forward = _lstmConfig(layer.forward_layer)
+        forward['numWeights'] = len(layer.forward_layer.get_weights())
+        return {
+            'type': kind,
+            'mergeMode': layer.merge_mode,
+            'forward': forward,
+            'backward': _lstmConfig(layer.backward_layer),
+        }
+    if kind == 'Dense':
+        return {'type': kind, 'activation': _activationName(layer.activation)}
+    if kind == 'GlobalAveragePooling1D':
+        return {'type': kind}
+    if kind == 'TimeDistributed' and type(layer.layer).__name__ == 'Dense':
+        return {'type': kind, 'activation': _activationName(layer.layer.activation)}
+    raise ValueError('Layer not supported by the NumPy engine: {}'.format(kind))
+
+def _lstmConfig(layer):
+    if type(layer).__name__ != 'LSTM':
+        raise ValueError('Layer not supported by the NumPy engine: {}'
+            .format(type(layer).__name__))
+    return {
+        'type': 'LSTM',
+        'activation': _activationName(layer.activation),
+        'recurrentActivation': _activationName(layer.recurrent_activation),
+        'returnSequences': bool(layer.return_sequences),
+        'goBackwards': bool(layer.go_backwards),
+    }
+
+def _activationName(activation):
+    name = activation.__name__
+    if name == 'hard_sigmoid':
+        # Keras 2는 0.2x+0.5, Keras 3은 x/6+0.5로 정의가 다르다.
+        import numpy as np
+        if abs(float(np.asarray(activation(np.array([1.0], dtype=np.float32)))[0]) - 0.7) > 1e-3:
+            return 'hard_sigmoid_v3'
+    return name
+
+TFLITE_POSTFIX = '.tflite'
+TFLITE_REPORT_POSTFIX = '.tflite.json'
+
+# TFLite 양자화 방법들
+#   dynamic: 가중치만 int8로 (계산은 float)
+#   int8: 가중치와 함께 활성값도 보정(calibration) 데이터로 int8 범위를 정한다.
+#   float16: 가중치를 float16으로
+QUANTIZATIONS = ('dynamic', 'int8', 'float16')
+
+def tfliteFile(h5File):
+    '''모델 HDF5 파일 옆에 둘 TFLite 모델 파일 주소'''
+    return os.path.splitext(h5File)[0] + TFLITE_POSTFIX
+
+def tfliteReportFile(h5File):
+    '''TFLite 모델의 양자화 보고서 파일 주소'''
+    return os.path.splitext(h5File)[0] + TFLITE_REPORT_POSTFIX
+
+def exportTflite(model, fname, quantization='dynamic', calibrationX=None):
+    '''
+    Keras 모델을 양자화된 TFLite 모델로 내보낸다.
+    LSTM은 가중치를 상수로 갖는 while 루프로 다시 지어서 내보내므로
+    입력 모양이 [배치, 길이] 모두 정해지지 않은 채로 남는다(resize_tensor_input으로 바꿀 수 있다).
+    출력이 여럿인 모델은 그 출력들을 같은 순서로 내는 TFLite 모델이 된다.
+    quantization이 int8이면 보정 데이터 calibrationX([배치, 길이] int 행렬)가 있어야 한다.
+    '''
+    import numpy as np
+    import tensorflow as tf
+    if quantization not in QUANTIZATIONS:
+        raise ValueError('Unknown quantization: {}'.format(quantization))
+    if quantization == 'int8' and calibrationX is None:
+        raise ValueError('int8 quantization needs calibration data.')
+
+    layers, weights, heads = _inferenceLayers(model)
+    forward = tf.function(
+        lambda X: _tfForward(tf, X, layers, weights, heads),
+        input_signature=[tf.TensorSpec([None, None], tf.int32)] )
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [forward.get_concrete_function()] )
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        calibrationX = np.asarray(calibrationX, dtype=np.int32)
+        converter.representative_dataset = lambda: (
+            [ calibrationX[i:i+1] ] for i in range(len(calibrationX)) )
+    with open(fname, 'wb') as f:
+        f.write(converter.convert())
+    return fname
+
+def tfliteReport(model, fname, X, y, quantization=None, calibrationSize=0):
+    '''
+    양자화된 TFLite 모델과 원래 Keras 모델을 시험 데이터 (X, y)에서 견준다.
+    y가 [배치] 모양이면 의도분석, [배치, 길이] 모양이면 개체명인식 모델로 보고
+    개체명인식은 Padding이 아닌 글자들만 센다.
+    출력이 여럿인 모델이면 y는 출력마다의 정답 리스트이고,
+    정확도들은 출력 이름마다 'outputs'에 담는다.
+    '''
+    import numpy as np
+    from nlu.tflite_engine import TfliteModel
+    X = np.asarray(X, dtype=np.int32)
+    expected = _outputList(model(X, training=False))
+    actual = _outputList(TfliteModel.loadFromFile(fname).predict(X))
+    report = {
+        'quantization': quantization,
+        'calibrationSize': calibrationSize,
+        'testSize': len(X),
+    }
+    if len(expected) == 1:
+        report.update(_compareOutputs(X, y, np.asarray(expected[0]), actual[0]))
+    else:
+        report['outputs'] = {
+            name: _compareOutputs(X, outputY, np.asarray(e), a)
+            for name, outputY, e, a in zip(model.output_names, y, expected, actual) }
+    report['tfliteBytes'] = os.path.getsize(fname)
+    return report
+
+def _compareOutputs(X, y, expected, actual):
+    # 한 출력에서 Keras와 TFLite의 정확도, 일치율, 확률 차이
+    import numpy as np
+    y = np.asarray(y)
+    counted = np.ones(y.shape, dtype=bool) if y.ndim == 1 else X != 0
+
+    def accuracy(pred):
+        return float( (np.argmax(pred, -1) == y)[counted].mean() )
+    kerasAccuracy = accuracy(expected)
+    tfliteAccuracy = accuracy(actual)
+    return {
+        'kerasAccuracy': kerasAccuracy,
+        'tfliteAccuracy': tfliteAccuracy,
+        'accuracyDelta': tfliteAccuracy - kerasAccuracy,
+        'agreement': float( (np.argmax(expected, -1) == np.argmax(actual, -1))[counted].mean() ),
+        'maxProbDiff': float( np.nanmax(np.abs(expected - actual)) ),
+    }
+
+def _tfForward(tf, X, layers, weights, heads=()):
+    '''
+    NumpyModel.predict와 같은 계산을 TensorFlow 연산으로 짓는다. 가중치는 상수가 된다.
+    머리heads가 있으면 몸통의 출력에서 머리마다 계산한 출력들의 tuple.
+    '''
+    out, mask = _tfLayers(tf, X, X, None, layers, weights)
+    if not heads:
+        return out
+    return tuple(
+        _tfLayers(tf, X, out, mask, headLayers, headWeights)[0]
+        for headLayers, headWeights in heads )
+
+def _tfLayers(tf, X, out, mask, layers, weights):
+    # 층들layers을 차례로 쌓는다. 결과: (출력, 그 출력의 mask)
+    for layer, layerWeights in zip(layers, weights):
+        kind = layer['type']
+        if kind == 'Embedding':
+            if layer['maskZero']:
+                mask = tf.cast(tf.not_equal(X, 0), tf.float32)
+            out = tf.gather(tf.constant(layerWeights[0]), out)
+        elif kind == 'LSTM':
+            out = _tfLstm(tf, out, mask, layer, layerWeights)
+            if not layer['returnSequences']:
+                mask = None
+        elif kind == 'Bidirectional':
+            numForward = layer['forward']['numWeights']
+            forward = _tfLstm(tf, out, mask, layer['forward'], layerWeights[:numForward])
+            backward = _tfLstm(tf, out, mask, layer['backward'], layerWeights[numForward:])
+            mode = layer['mergeMode']
+            if mode == 'concat':
+                out = tf.concat([forward, backward], -1)
+            elif mode == 'sum':
+                out = forward + backward
+            elif mode == 'mul':
+                out = forward * backward
+            elif mode == 'ave':
+                out = (forward + backward) / 2
+            else:
+                raise ValueError('Unsupported merge mode: {}'.format(mode))
+            if not layer['forward']['returnSequences']:
+                mask = None
+        elif kind == 'GlobalAveragePooling1D':
+            if mask is None:
+                out = tf.reduce_mean(out, 1)
+            else:
+                m = tf.expand_dims(mask, -1)
+                out = tf.reduce_sum(out * m, 1) / tf.maximum(tf.reduce_sum(m, 1), 1.0)
+            mask = None
+        else:  # Dense, TimeDistributed
+            out = tf.tensordot(out, tf.constant(layerWeights[0]), 1)
+            if len(layerWeights) > 1:
+                out = out + tf.constant(layerWeights[1])
+            out = _tfActivation(tf, layer['activation'])(out)
+    return out, mask
+
+# TFLite로 내보낸 LSTM이 while 루프 한 번에 펼쳐서 도는 시점 수
+TFLITE_LSTM_BLOCK = 16
+
+def _tfLstm(tf, X, mask, config, weights):
+    '''
+    nlu.numpy_engine._lstm과 같은 계산. TFLITE_LSTM_BLOCK 시점씩 펼친 while 루프가 된다.
+    TensorArray(TensorList)는 배치 크기가 정해지지 않으면 TFLite 기본 연산으로 바뀌지 않고,
+    TFLite의 while 루프는 고쳐 쓴 루프 변수를 돌 때마다 복사한다.
+    그래서 출력은 블록마다 한 번만 이어 붙여서 복사량을 블록 길이만큼 줄인다.
+    '''
+    kernel = tf.constant(weights[0])
+    recurrentKernel = tf.constant(weights[1])
+    bias = tf.constant(weights[2]) if len(weights) > 2 else 0.0
+    units = weights[1].shape[0]
+    activation = _tfActivation(tf, config['activation'])
+    recurrentActivation = _tfActivation(tf, config['recurrentActivation'])
+    returnSequences = config['returnSequences']
+
+    if config['goBackwards']:
+        X = tf.reverse(X, [1])
+        if mask is not None:
+            mask = tf.reverse(mask, [1])
+    batch, steps = tf.shape(X)[0], tf.shape(X)[1]
+    if mask is None:
+        mask = tf.ones([batch, steps])
+    # 길이를 블록 길이의 배수로 채운다. 채운 시점은 마스크가 0이라 상태를 바꾸지 않는다.
+    padding = (TFLITE_LSTM_BLOCK - steps % TFLITE_LSTM_BLOCK) % TFLITE_LSTM_BLOCK
+    X = tf.pad(X, [[0, 0], [0, padding], [0, 0]])
+    mask = tf.pad(mask, [[0, 0], [0, padding]])
+    # 시점이 앞에 오게 한다: [길이, 배치, 4*units]
+    XW = tf.transpose(tf.tensordot(X, kernel, 1) + bias, [1, 0, 2])
+    # [길이, 배치, 1]. (...과 newaxis를 함께 쓴 자르기는 TFLite 기본 연산으로 바뀌지 않는다.)
+    M = tf.expand_dims(tf.transpose(mask, [1, 0]), -1)
+
+    def step(t, h, c):
+        z = XW[t] + tf.matmul(h, recurrentKernel)
+        i = recurrentActivation(z[:, :units])
+        f = recurrentActivation(z[:, units:2*units])
+        cNew = f * c + i * activation(z[:, 2*units:3*units])
+        o = recurrentActivation(z[:, 3*units:])
+        hNew = o * activation(cNew)
+        m = M[t]
+        return m * hNew + (1 - m) * h, m * cNew + (1 - m) * c, m * hNew
+
+    def block(t, h, c, outputs):
+        blockOutputs = []
+        for k in range(TFLITE_LSTM_BLOCK):
+            h, c, hOut = step(t + k, h, c)
+            blockOutputs.append(hOut)
+        if returnSequences:
+            outputs = tf.concat([outputs, tf.stack(blockOutputs, 1)], 1)
+        return t + TFLITE_LSTM_BLOCK, h, c, outputs
+
+    zeros = tf.zeros([batch, units])
+    _, h, c, outputs = tf.while_loop(
+        lambda t, h, c, outputs: t < steps + padding, block,
+        [tf.constant(0), zeros, zeros, tf.zeros([batch, 0, units])],
+        shape_invariants=[
+            tf.TensorShape([]), tf.TensorShape([None, units]),
+            tf.TensorShape([None, units]), tf.TensorShape([None, None, units]) ] )
+    if not returnSequences:
+        return h
+    outputs = outputs[:, :steps]
+    if config['goBackwards']:
+        outputs = tf.reverse(outputs, [1])
+    return outputs
+
+def _tfActivation(tf, name):
+    return {
+        'sigmoid': tf.sigmoid,
+        'hard_sigmoid': lambda x: tf.clip_by_value(0.2 * x + 0.5, 0.0, 1.0),
+        'hard_sigmoid_v3': lambda x: tf.clip_by_value(x / 6.0 + 0.5, 0.0, 1.0),
+        'tanh': tf.tanh,
+        'relu': tf.nn.relu,
+        'softmax': tf.nn.softmax,
+        'linear': lambda x: x,
+    }[name]
@@ -0,0 +1,87 @@
+'''
+Selecting the rows for incremental (warm-start) retraining
+'''
+
+import json
+from collections import Counter
+import numpy as np
+from nlu.util import parseRawtable
+
+def newRowMask(rawTable, previousIndex):
+    '''
+    표rawTable의 행마다, 예전 학습 데이터에 없던 행인지. [행 수] bool 배열
+    예전 학습 데이터는 그때의 완전일치 색인previousIndex(nlu.exact_index.ExactIndex)로 알아본다:
+    같은 순수 텍스트가 같은 의도와 BIO 태그로 있었으면 예전 행이다.
+    주석을 고친 행은 새 행이 된다. (한 텍스트에 주석이 여러 가지였으면 가장 많던 것만 예전 행으로 본다.)
+    '''
+    rawTable = parseRawtable(rawTable)
+    mask = np.zeros(len(rawTable), dtype=bool)
+    for row, (intent, ptext, tags) in enumerate(zip(
+            rawTable['intent'], rawTable['ptext'], rawTable['bioTags'] )):
+        found = previousIndex.lookup(ptext)
+        mask[row] = found is None or found[0] != intent or list(found[1]) != list(tags)
+    return mask
+
+def unseenRowMask(rawTable, previousIndex):
+    '''표rawTable의 행마다, 그 순수 텍스트가 예전 학습 데이터에 아예 없던 것인지. [행 수] bool 배열'''
+    rawTable = parseRawtable(rawTable)
+    return np.array([ previousIndex.lookup(ptext) is None for ptext in rawTable['ptext'] ], dtype=bool)
+
+def fineTuneRows(trainRows, isNew, replayRatio=2.0):
+    '''
+    이어서 학습할 행들: Train set 행들trainRows 중 새 행들 모두와,
+    잊어버리지 않도록 섞어 넣는 예전 행들(replay) 새 행 수의 replayRatio배(있는 만큼)를 무작위로.
+    결과: (행 번호들, 새 행 수, 예전 행 수)
+    '''
+    trainRows = np.asarray(trainRows)
+    newRows = trainRows[isNew[trainRows]]
+    oldRows = trainRows[~isNew[trainRows]]
+    replaySize = min(len(oldRows), int(np.ceil(len(newRows) * replayRatio)))
+    replayRows = np.random.choice(oldRows, replaySize, replace=False) \
+        if replaySize else oldRows[:0]
+    rows = np.concatenate([newRows, replayRows]).astype(trainRows.dtype)
+    return rows, len(newRows), len(replayRows)
+
+def heldOutKeys(rawTable, testRows):
+    '''Test set 행들testRows을 알아볼 열쇠들: 행마다 [의도, 주석 텍스트] (같은 행이 여럿이면 그 수만큼)'''
+    return [ [str(rawTable['intent'].iloc[row]), str(rawTable['text'].iloc[row])]
+        for row in testRows ]
+
+def saveHeldOut(fname, keys):
+    with open(fname, 'w', encoding='utf-8') as f:
+        json.dump({'heldOut': keys}, f, ensure_ascii=False)
+
+def loadHeldOut(fname):
+    '''saveHeldOut으로 저장한 열쇠들. 파일이 없으면 None.'''
+    try:
+        with open(fname, 'r', encoding='utf-8') as f:
+            return json.load(f)['heldOut']
+    except FileNotFoundError:
+        return None
+
+def splitKeepingHeldOut(rawTable, order, isUnseen, heldOut, testRatio):
+    '''
+    이어서 학습할 때의 train/test 분리. 지금까지의 어느 모델도 학습하지 않은 행들만 Test set이 된다.
+        예전 Test set의 행들(열쇠들heldOut, heldOutKeys)은 그대로 Test set에,
+        텍스트가 처음 보는 행들(isUnseen, unseenRowMask)은 섞은 순서order대로 testRatio만큼 Test set에,
+        나머지는 모두 Train set에 둔다. (주석만 고친 행은 텍스트를 학습한 적이 있으므로 Train set에)
+    heldOut이 None이면(예전 Test set을 모르면) 새 행들 중 Test set에 둔 것만으로 검증한다.
+    결과: (Train set 행 번호들, Test set 행 번호들, Test set 중 예전 Test set의 행 수)
+    '''
+    remaining = Counter( tuple(key) for key in (heldOut or []) )
+    trainRows, testRows, newRows = [], [], []
+    for row in order:
+        key = (str(rawTable['intent'].iloc[row]), str(rawTable['text'].iloc[row]))
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            testRows.append(row)
+        elif isUnseen[row]:
+            newRows.append(row)
+        else:
+            trainRows.append(row)
+    numHeldOut = len(testRows)
+    newTestSize = int(len(newRows) * testRatio)
+    testRows += newRows[:newTestSize]
+    trainRows += newRows[newTestSize:]
+    dtype = np.asarray(order).dtype
+    return np.asarray(trainRows, dtype=dtype), np.asarray(testRows, dtype=dtype), numHeldOut
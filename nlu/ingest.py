@@ -0,0 +1,190 @@
+'''
+Streaming, per-sheet cached ingestion of the annotated Excel workbook
+'''
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+import pandas as pd
+from nlu.read_excel import SEPARATOR_SHEET, WorkbookError, checkFunctionAndSheet
+
+# 캐시 형식이나 행을 읽는 방법이 바뀌면 올린다. (이전 캐시는 모두 무효가 됨)
+INGEST_VERSION = 1
+# 시트마다 읽어 두는 열 수: A~E (function 시트의 기능명은 B, intent는 E / 내용 시트의 intent는 D, 주석은 E)
+_COLUMNS = 5
+
+_NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+# 공유 문자열(sharedStrings)을 가리키는 셀: <c r="E2" t="s"><v>12</v></c>
+_SHARED_CELL = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+def readWorkbookTable(xlsxFile, cacheDir=None):
+    '''
+    엑셀 파일 xlsxFile을 학습용 표(intent, text 열의 DataFrame)로 바로 읽는다. (raw.txt를 거치지 않음)
+    cacheDir을 주면 시트마다 읽은 행들을 그 시트 내용의 해시를 이름으로 저장해 두고,
+    다음에는 내용이 바뀐 시트만 다시 읽는다. 쓰이지 않게 된 캐시 파일은 지운다.
+    function 시트와 내용 시트들이 맞지 않으면 WorkbookError.
+    결과: (표, {'sheets': 시트 수, 'cached': 캐시에서 읽은 시트 수, 'read': 새로 읽은 시트명들})
+    '''
+    keys = sheetKeys(xlsxFile)
+    names = list(keys)
+    if not names:
+        raise WorkbookError('No sheets in {}'.format(xlsxFile))
+    if SEPARATOR_SHEET in names:
+        contentNames = names[names.index(SEPARATOR_SHEET)+1:]
+    else:
+        contentNames = []
+    used = [names[0]] + contentNames
+
+    rowsOf = {}
+    missing = []
+    for name in used:
+        rows = _loadCached(cacheDir, keys[name])
+        if rows is None:
+            missing.append(name)
+        else:
+            rowsOf[name] = rows
+    if missing:
+        for name, rows in _readSheets(xlsxFile, missing):
+            rowsOf[name] = rows
+            _saveCached(cacheDir, keys[name], name, rows)
+    if cacheDir is not None:
+        _pruneCache(cacheDir, { keys[name] for name in used })
+
+    # 첫 번째 시트(function)에서 {기능명, intent}
+    intent = {}
+    for row in rowsOf[names[0]][1:]:
+        intent[row[1]] = row[4]
+    # 내용 시트마다 intent는 D2 셀, 주석은 E열(머리 행 다음부터)
+    intentBySheet = {}
+    for name in contentNames:
+        rows = rowsOf[name]
+        intentBySheet[name] = rows[1][3] if len(rows) > 1 else ''
+    checkFunctionAndSheet(intent, intentBySheet)
+
+    intents = []
+    texts = []
+    for name in contentNames:
+        for row in rowsOf[name][1:]:
+            # 비어 있는 행(서식만 남은 행 등)은 학습 데이터가 아니다.
+            if row[4] == '':
+                continue
+            intents.append(intentBySheet[name])
+            texts.append(row[4])
+    table = pd.DataFrame({'intent': intents, 'text': texts})
+    report = {
+        'sheets': len(used),
+        'cached': len(used) - len(missing),
+        'read': missing,
+    }
+    return table, report
+
+def sheetKeys(xlsxFile):
+    '''
+    시트명 -> 그 시트 내용의 해시 (워크북 안의 순서대로).
+    셀 값을 해석하지 않고 xlsx(zip) 안의 시트 XML과, 그 시트가 가리키는 공유 문자열만으로 구한다.
+    다른 시트가 바뀌어 공유 문자열 표가 늘어나도 이 시트가 쓰는 문자열이 그대로이면 같은 값이다.
+    '''
+    with zipfile.ZipFile(xlsxFile) as z:
+        parts = _sheetParts(z)
+        sharedStrings = _sharedStrings(z)
+        keys = {}
+        for name, part in parts.items():
+            xml = z.read(part)
+            h = hashlib.sha1()
+            h.update('{}\0{}\0'.format(INGEST_VERSION, name).encode('utf-8'))
+            h.update(xml)
+            for index in sorted({ int(i) for i in _SHARED_CELL.findall(xml) }):
+                h.update(b'\0%d\0' % index)
+                if index < len(sharedStrings):
+                    h.update(sharedStrings[index])
+            keys[name] = h.hexdigest()
+    return keys
+
+def _sheetParts(z):
+    # 시트명 -> zip 안의 시트 XML 경로 (xl/workbook.xml과 그 관계 파일에서)
+    workbook = ET.fromstring(z.read('xl/workbook.xml'))
+    rels = ET.fromstring(z.read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    for rel in rels.iter(_NS_PKG_REL + 'Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join('xl', target))
+        targets[rel.get('Id')] = target
+    parts = {}
+    for sheet in workbook.iter(_NS_MAIN + 'sheet'):
+        parts[sheet.get('name')] = targets[sheet.get(_NS_REL + 'id')]
+    return parts
+
+def _sharedStrings(z):
+    # 공유 문자열마다의 글자들(utf-8). 해시에만 쓴다.
+    # (ET.tostring은 다른 모듈이 등록한 네임스페이스 접두어에 따라 바뀌므로 쓰지 않는다.)
+    if 'xl/sharedStrings.xml' not in z.namelist():
+        return []
+    strings = []
+    with z.open('xl/sharedStrings.xml') as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag == _NS_MAIN + 'si':
+                strings.append(''.join(elem.itertext()).encode('utf-8'))
+                elem.clear()
+    return strings
+
+def _readSheets(xlsxFile, names):
+    # 시트들names만 행 단위로 흘려 읽는다. 행마다 A~E열의 값을 문자열로.
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError('Reading the excel file needs openpyxl (pip install openpyxl).')
+    workbook = openpyxl.load_workbook(xlsxFile, read_only=True, data_only=True)
+    try:
+        for name in names:
+            rows = []
+            for values in workbook[name].iter_rows(max_col=_COLUMNS, values_only=True):
+                row = [ _cellText(v) for v in values ]
+                row += [''] * (_COLUMNS - len(row))
+                rows.append(row)
+            yield name, rows
+    finally:
+        workbook.close()
+
+def _cellText(value):
+    if value is None:
+        return ''
+    return str(value)
+
+def _cacheFile(cacheDir, key):
+    return os.path.join(cacheDir, '{}.json'.format(key))
+
+def _loadCached(cacheDir, key):
+    if cacheDir is None:
+        return None
+    try:
+        with open(_cacheFile(cacheDir, key), encoding='utf-8') as f:
+            return json.load(f)['rows']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _saveCached(cacheDir, key, name, rows):
+    if cacheDir is None:
+        return
+    os.makedirs(cacheDir, exist_ok=True)
+    fname = _cacheFile(cacheDir, key)
+    tmpName = '{}.tmp{}'.format(fname, os.getpid())
+    with open(tmpName, 'w', encoding='utf-8') as f:
+        json.dump({'sheet': name, 'rows': rows}, f, ensure_ascii=False)
+    os.replace(tmpName, fname)
+
+def _pruneCache(cacheDir, keep):
+    if not os.path.isdir(cacheDir):
+        return
+    for fname in os.listdir(cacheDir):
+        key, ext = os.path.splitext(fname)
+        if ext == '.json' and key not in keep:
+            os.remove(os.path.join(cacheDir, fname))
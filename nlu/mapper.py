@@ -1,8 +1,38 @@
-from nlu.util import RawTextParser
+from nlu.util import RawTextParser, parseRawtable
 from nlu.text_encoder import CharTextEncoder
 from nlu.text_encoder import IntentEncoder
 from nlu.text_encoder import BioEncoder
+from nlu.text_encoder import padArrays
+from nlu.bundle import readBundle, writeBundle
 import os
+import numpy as np
+
+# 매퍼 디렉토리 안의 번들 파일. 세 인코더를 한 파일에 배열로 담는다.
+BUNDLE_FILE = 'mapper.bundle'
+_ENCODER_CLASSES = {
+    'text': CharTextEncoder,
+    'intent': IntentEncoder,
+    'bio': BioEncoder,
+}
+
+class EncodedQueries:
+    '''
+    질의 텍스트들을 한 번씩만 파싱하고 인코딩한 것.
+    의도분석(IC)과 개체명인식(ER) 모델이 같은 입력을 쓰므로 둘 다 이것 하나로 돈다.
+    '''
+
+    def __init__(self, ids):
+        '''ids: 텍스트마다의 글자 ID 배열(int32)'''
+        self.ids = ids
+        self.lengths = np.array([ len(i) for i in ids ], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def padded(self, rows, width):
+        '''행들rows의 ID를 [len(rows), width] int32 행렬로 (pad_sequences와 같이 앞쪽 채움)'''
+        return padArrays([ self.ids[r] for r in rows ], width)
+
 
 class Mapper:
     '''
@@ -17,20 +47,47 @@ class Mapper:
         self.bioEncoder = None
         
     @classmethod
-    def buildFromRawtable(cls, rawTable):
+    def buildFromRawtable(cls, rawTable, minCount=1, maxSize=None):
+        '''
+        rawTable로 새 매퍼를 만든다. ID는 자주 나온 것부터 매기므로 같은 데이터이면 언제나 같다.
+        minCount, maxSize: 글자 사전의 크기 제한 (CharTextEncoder 참고)
+        '''
         m = cls()
-        m._fitTo(rawTable)
+        m._fitTo(rawTable, minCount, maxSize)
         return m
     
+    def extendedWith(self, rawTable, minCount=1, maxSize=None):
+        '''
+        표rawTable에서 처음 보는 글자, 의도(Intent), BIO 태그를 뒤쪽 번호로 더한 새 매퍼.
+        있던 것들의 ID는 그대로이므로 예전 모델을 이어서 학습할 수 있다. (Trainer의 incremental)
+        minCount, maxSize: 더하는 글자에만 적용하는 글자 사전 제한 (CharTextEncoder.extended 참고)
+        결과: (새 매퍼, {'chars': 더한 글자 수, 'intents': 더한 의도들, 'tags': 더한 태그들})
+        '''
+        rawTable = parseRawtable(rawTable)
+        m = self.__class__()
+        m.textEncoder = self.textEncoder.extended(
+            ( t for t in rawTable['ptext'] ), minCount=minCount, maxSize=maxSize )
+        m.intentEncoder = self.intentEncoder.extended( it for it in rawTable['intent'] )
+        m.bioEncoder = self.bioEncoder.extended( tags for tags in rawTable['bioTags'] )
+        added = {
+            'chars': m.textEncoder.vocabReport()['added'],
+            'intents': _addedNames(self.intentEncoder, m.intentEncoder),
+            'tags': _addedNames(self.bioEncoder, m.bioEncoder),
+        }
+        return m, added
+
     def _pureText(self, t):
         return self.rtper.pureText(t)
     def _bioTagsChar(self, t):
         return self.rtper.bioTagsChar(t)
     
-    def _fitTo(self, rawTable):
+    def _fitTo(self, rawTable, minCount=1, maxSize=None):
+        # 행마다 한 번만 파싱한다. (이미 파싱된 표이면 그 열을 쓴다.)
+        rawTable = parseRawtable(rawTable)
         # CharTextEncoder: rawTable 내 모든 텍스트의 글자를 id번호로 배정해준다.
         self.textEncoder = CharTextEncoder(
-            self._pureText(t) for t in rawTable['text']
+            ( t for t in rawTable['ptext'] ),
+            minCount=minCount, maxSize=maxSize
             )
         # IntentEncoder: rawTable 내 모든 Intent를 id번호로 배정해준다.
         self.intentEncoder = IntentEncoder(
@@ -38,12 +95,16 @@ class Mapper:
             )
         # BioEncoder: rawTable 내 모든 BIO태그를 id번호로 배정해준다.
         self.bioEncoder = BioEncoder(
-            self._bioTagsChar(t) for t in rawTable['text']
+            tags for tags in rawTable['bioTags']
             )
         
     def textVocabSize(self):
         return self.textEncoder.vocab_size
 
+    def textVocabReport(self):
+        '''글자 사전을 새로 만들었을 때의 크기와 적용률(coverage). CharTextEncoder.vocabReport 참고'''
+        return self.textEncoder.vocabReport()
+
     def maxIntentID(self):
         return self.intentEncoder.vocab_size+1
         #예: UNK인 1번부터 recruit.???인 23번까지 있으면 return 23.
@@ -59,10 +120,53 @@ class Mapper:
         self.bioEncoder.save_to_file(
             os.path.join(mapperDir, 'bio')
         )
+        self.saveBundle(os.path.join(mapperDir, BUNDLE_FILE))
+
+    def saveBundle(self, fname):
+        '''세 인코더를 번들 파일 하나로 저장 (nlu.bundle)'''
+        writeBundle(fname, {
+            name: {
+                'class': encoder.__class__.__name__,
+                'arrays': encoder.toArrays(),
+            } for name, encoder in self._encoders().items() })
+
+    @classmethod
+    def loadBundle(cls, fname, verify=True):
+        '''번들 파일을 메모리맵해서 불러온다.'''
+        sections = readBundle(fname, verify)
+        m = cls()
+        encoders = {}
+        for name, encoderClass in _ENCODER_CLASSES.items():
+            section = sections[name]
+            # 우리의 것이 맞나 확인한 뒤
+            if section['class'] != encoderClass.__name__:
+                raise TypeError('Wrong encoder class.')
+            encoders[name] = encoderClass.fromArrays(section['arrays'])
+        m.textEncoder = encoders['text']
+        m.intentEncoder = encoders['intent']
+        m.bioEncoder = encoders['bio']
+        return m
+
+    def _encoders(self):
+        return {
+            'text': self.textEncoder,
+            'intent': self.intentEncoder,
+            'bio': self.bioEncoder,
+        }
 
     @classmethod
     def loadFromFile(cls, mapperDir):
-        '''저장된 설정을 불러온다. mapperDir는 디렉토리 주소'''
+        '''
+        저장된 설정을 불러온다. mapperDir는 디렉토리 주소
+        번들 파일이 있으면 그것을, 없으면(예전 형식) 인코더마다의 *.vocab 파일들을 읽는다.
+        '''
+        if os.path.exists(os.path.join(mapperDir, BUNDLE_FILE)):
+            return cls.loadBundle(os.path.join(mapperDir, BUNDLE_FILE))
+        return cls.loadFromVocabFiles(mapperDir)
+
+    @classmethod
+    def loadFromVocabFiles(cls, mapperDir):
+        '''인코더마다의 *.vocab 파일들(JSON)에서 불러온다.'''
         m = cls()
         m.textEncoder = CharTextEncoder.load_from_file(
             os.path.join(mapperDir, 'text')
@@ -82,17 +186,41 @@ class Mapper:
         textIds = self.textEncoder.encode(ptext)
         return textIds
 
+    def mapTextsIC(self, texts, maxlen=None):
+        '''
+        여러 텍스트를 한꺼번에 매핑해 [배치, maxlen] int32 행렬로.
+        pad_sequences처럼 앞쪽을 0으로 채우고 앞쪽을 자른다.
+        '''
+        return self.textEncoder.encodeBatch([ self._pureText(t) for t in texts ], maxlen)
+
+    def mapRawtableIC(self, rawTable, maxlen=None):
+        '''mapTextsIC와 같되, 표rawTable의 파싱해 둔 열(nlu.util.parseRawtable)을 쓴다.'''
+        return self.textEncoder.encodeBatch(parseRawtable(rawTable)['ptext'], maxlen)
+
+    def pureText(self, text):
+        '''태그를 벗긴 순수 텍스트'''
+        return self._pureText(text)
+
+    def encodeQueries(self, texts):
+        '''
+        추론할 질의들을 파싱·인코딩해 IC와 ER 모델이 함께 쓸 EncodedQueries로.
+        태그 없는 텍스트(보통의 질의)는 파서를 거치지 않는다.
+        '''
+        encode = self.textEncoder.encodeArray
+        return EncodedQueries([ encode(self._pureText(t)) for t in texts ])
+
     def mapIntent(self, intent):
         '''Intent를 매핑'''
         intentId = self.intentEncoder.encode(intent)
         return intentId
 
     def getIntentFromId(self, intentId):
-        '''ID값 intentId의 원래 이름'''
-        try:
-            return self.intentEncoder.decode(intentId)
-        except IndexError:
-            return self.intentEncoder._UNK
+        '''ID값 intentId의 원래 이름. 없는 ID이면 UNK.'''
+        return self.intentEncoder.decode(intentId)
+
+    def getIntentsFromIds(self, intentIds):
+        '''ID값들intentIds 각각의 원래 이름의 리스트'''
+        return self.intentEncoder.decodeBatch(intentIds)
 
     def mapTextER(self, text):
         '''Entity Recognition에 쓰일 텍스트를 매핑'''
@@ -100,20 +228,40 @@ class Mapper:
         textIds = self.textEncoder.encode(ptext)
         return textIds
 
+    def mapTextsER(self, texts, maxlen=None):
+        '''mapTextsIC의 Entity Recognition판'''
+        return self.textEncoder.encodeBatch([ self._pureText(t) for t in texts ], maxlen)
+
+    def mapRawtableER(self, rawTable, maxlen=None):
+        '''mapRawtableIC의 Entity Recognition판'''
+        return self.textEncoder.encodeBatch(parseRawtable(rawTable)['ptext'], maxlen)
+
+    def mapRawtableBioTags(self, rawTable):
+        '''표rawTable의 행마다 BIO Tag 배열을 매핑한 ID 배열들'''
+        return [ self.mapBioTags(tags) for tags in parseRawtable(rawTable)['bioTags'] ]
+
     def mapBioTags(self, bioTags):
         '''BIO Tag 배열을 매핑'''
         tagIds = self.bioEncoder.encode(bioTags)
         return tagIds
 
-    def getBioTagsFromIds(self, ᅟtagIds):
-        '''ID배열 tagIds의 각각을 모두 원래 이름으로...'''
-        try:
-            return self.bioEncoder.decode(ᅟtagIds)
-        except IndexError:
-            #return [self.bioEncoder._UNK for _ in ᅟtagIds]
-            return [self.bioEncoder._UNK]
-            
+    def getBioTagsFromIds(self, tagIds):
+        '''ID배열 tagIds의 각각을 모두 원래 이름으로... 없는 ID는 UNK.'''
+        return self.bioEncoder.decode(tagIds)
+
+    def getBioTagsFromIdMatrix(self, tagIdMatrix, lengths=None):
+        '''
+        [배치, 길이] ID 행렬의 행마다 원래 이름 배열로.
+        lengths를 주면 앞쪽 Padding을 떼고 행마다 실제 글자 수만큼만 남긴다.
+        '''
+        return self.bioEncoder.decodeBatch(tagIdMatrix, lengths)
+
     def maxBiotagsID(self):
         return self.bioEncoder.vocab_size+1
         #예: UNK인 1번부터 I-??인 14번까지 있으면 return 14.
-        
\ No newline at end of file
+
+
+def _addedNames(before, after):
+    # 인코더after에 있고 before에는 없는 이름들 (번호순)
+    names = sorted( after._vocabMap.items(), key=lambda item: item[1] )
+    return [ name for name, _ in names if name not in before._vocabMap ]
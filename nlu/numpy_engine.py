@@ -0,0 +1,180 @@
+'''
+NumPy-only inference engine for the NLU models (no TensorFlow at serve time)
+'''
+
+import json
+import numpy as np
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def _hardSigmoid(x):
+    # Keras 2.x의 정의. (Keras 3은 relu6(x+3)/6이며 'hard_sigmoid_v3'로 저장)
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+def _hardSigmoidV3(x):
+    return np.clip(x / 6.0 + 0.5, 0.0, 1.0)
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+_ACTIVATIONS = {
+    'sigmoid': _sigmoid,
+    'hard_sigmoid': _hardSigmoid,
+    'hard_sigmoid_v3': _hardSigmoidV3,
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0.0),
+    'softmax': _softmax,
+    'linear': lambda x: x,
+}
+
+def loadWeights(fname):
+    '''
+    nlu.export.exportNumpyWeights로 내보낸 파일의 층 설정과 가중치.
+    결과: (층 설정들, 층마다의 가중치들, 출력마다의 (층 설정들, 가중치들) 리스트)
+    '''
+    with np.load(fname, allow_pickle=False) as npz:
+        config = json.loads(str(npz['config']))
+
+        def load(layers, prefix):
+            return [
+                [ npz['{}layer{}_{}'.format(prefix, i, j)].astype(np.float32)
+                  for j in range(layer['numWeights']) ]
+                for i, layer in enumerate(layers) ]
+        layers = config['layers']
+        heads = [
+            (headLayers, load(headLayers, 'head{}_'.format(h)))
+            for h, headLayers in enumerate(config.get('heads', [])) ]
+        return layers, load(layers, ''), heads
+
+
+class NumpyModel:
+    '''
+    nlu.export.exportNumpyWeights로 내보낸 모델을 NumPy만으로 돌린다.
+    Trainer가 짓는 모델들의 층(Embedding, LSTM, Bidirectional(LSTM), Dense,
+    TimeDistributed(Dense), GlobalAveragePooling1D)만 지원한다.
+    '''
+
+    def __init__(self, layers, weights, heads=None):
+        '''
+        Args:
+            layers: 층 설정들의 리스트. 예) [{'type': 'Embedding', 'maskZero': False}, ...]
+            weights: 층 번호 -> 그 층의 가중치 배열 리스트
+            heads: 출력이 여럿인 모델(결합 모델)이면 출력마다 (층 설정들, 가중치들).
+                layers는 그 출력들이 함께 쓰는 몸통이다.
+        '''
+        self._layers = layers
+        self._weights = weights
+        self._heads = heads or []
+
+    @classmethod
+    def loadFromFile(cls, fname):
+        return cls(*loadWeights(fname))
+
+    def predict(self, X):
+        '''
+        [배치, 길이] int 행렬 X의 예측값 (Keras model.predict와 같은 모양)
+        출력이 여럿인 모델이면 출력마다의 예측값 리스트. 몸통은 한 번만 돈다.
+        '''
+        X = np.asarray(X)
+        out, mask = _run(X, X, None, self._layers, self._weights)
+        if not self._heads:
+            return out.astype(np.float32)
+        return [
+            _run(X, out, mask, headLayers, headWeights)[0].astype(np.float32)
+            for headLayers, headWeights in self._heads ]
+
+
+def _run(X, out, mask, layers, weightsList):
+    '''층들layers을 차례로 돈다. 결과: (출력, 그 출력의 mask)'''
+    for layer, weights in zip(layers, weightsList):
+        kind = layer['type']
+        if kind == 'Embedding':
+            if layer['maskZero']:
+                mask = X != 0
+            out = weights[0][out]
+        elif kind == 'LSTM':
+            out = _lstm(out, mask, layer, weights)
+            if not layer['returnSequences']:
+                mask = None
+        elif kind == 'Bidirectional':
+            numForward = layer['forward']['numWeights']
+            forward = _lstm(out, mask, layer['forward'], weights[:numForward])
+            backward = _lstm(out, mask, layer['backward'], weights[numForward:])
+            out = _merge(forward, backward, layer['mergeMode'])
+            if not layer['forward']['returnSequences']:
+                mask = None
+        elif kind in ('Dense', 'TimeDistributed'):
+            out = out @ weights[0]
+            if len(weights) > 1:
+                out = out + weights[1]
+            out = _ACTIVATIONS[layer['activation']](out)
+        elif kind == 'GlobalAveragePooling1D':
+            if mask is None:
+                out = out.mean(axis=1)
+            else:
+                # Padding이 아닌 시점들의 평균. 모두 Padding인 행은 0 (Keras는 NaN)
+                m = mask[..., np.newaxis]
+                out = (out * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1)
+            mask = None
+        else:
+            raise ValueError('Unsupported layer: {}'.format(kind))
+    return out, mask
+
+
+def _lstm(X, mask, config, weights):
+    '''
+    Keras LSTM과 같은 계산. 게이트 순서는 i, f, c, o.
+    mask가 있으면 가려진(Padding) 시점에서는 상태를 그대로 두고 출력은 0으로 한다.
+    '''
+    kernel, recurrentKernel = weights[0], weights[1]
+    bias = weights[2] if len(weights) > 2 else 0.0
+    units = recurrentKernel.shape[0]
+    activation = _ACTIVATIONS[config['activation']]
+    recurrentActivation = _ACTIVATIONS[config['recurrentActivation']]
+
+    batch, steps = X.shape[0], X.shape[1]
+    if config['goBackwards']:
+        X = X[:, ::-1]
+        if mask is not None:
+            mask = mask[:, ::-1]
+    # 입력 쪽 계산은 모든 시점을 한꺼번에 한다.
+    XW = X @ kernel + bias
+    h = np.zeros((batch, units), dtype=np.float32)
+    c = np.zeros((batch, units), dtype=np.float32)
+    outputs = np.zeros((batch, steps, units), dtype=np.float32) \
+        if config['returnSequences'] else None
+    for t in range(steps):
+        z = XW[:, t] + h @ recurrentKernel
+        i = recurrentActivation(z[:, :units])
+        f = recurrentActivation(z[:, units:2*units])
+        cNew = f * c + i * activation(z[:, 2*units:3*units])
+        o = recurrentActivation(z[:, 3*units:])
+        hNew = o * activation(cNew)
+        if mask is not None:
+            m = mask[:, t:t+1]
+            c = np.where(m, cNew, c)
+            h = np.where(m, hNew, h)
+            hOut = np.where(m, hNew, 0.0)
+        else:
+            c, h, hOut = cNew, hNew, hNew
+        if outputs is not None:
+            outputs[:, t] = hOut
+
+    if outputs is None:
+        return h
+    if config['goBackwards']:
+        outputs = outputs[:, ::-1]
+    return outputs
+
+def _merge(forward, backward, mode):
+    if mode == 'concat':
+        return np.concatenate([forward, backward], axis=-1)
+    if mode == 'sum':
+        return forward + backward
+    if mode == 'mul':
+        return forward * backward
+    if mode == 'ave':
+        return (forward + backward) / 2
+    raise ValueError('Unsupported merge mode: {}'.format(mode))
@@ -0,0 +1,51 @@
+'''
+Streaming tf.data training pipeline with length bucketing
+'''
+
+import numpy as np
+import tensorflow as tf
+
+TARGETS = ('intent', 'bio', 'joint')
+
+def trainingPipeline(dataset, rows, target, batchSize, buckets, shuffle=True):
+    '''
+    데이터셋dataset(nlu.dataset.Dataset)의 행들rows을 길이가 비슷한 것끼리 배치로 묶어 흘려보내는 tf.data.Dataset.
+    target: 'intent'(의도 ID), 'bio'(글자마다의 BIO 태그 ID),
+        또는 'joint'(결합 모델의 두 출력 이름으로 된 {'intent': 의도 ID, 'bio': BIO 태그 ID})
+    buckets: 길이 버킷 경계(nlu.buckets). 배치는 그 버킷 안에서 가장 긴 행에 맞춰 뒤쪽을 0으로 채운다.
+    paddedLen으로 자르지 않으며, 모델의 Embedding(mask_zero=True)이 채운 0을 가린다.
+    행은 배치를 만들 때 (메모리맵된) 데이터셋에서 하나씩 꺼내고, 다음 배치는 학습과 겹쳐 미리 만든다.
+    따라서 메모리와 한 스텝의 시간은 말뭉치 크기가 아니라 배치 크기를 따른다.
+    '''
+    if target not in TARGETS:
+        raise ValueError('Unknown target: {}'.format(target))
+    rows = np.asarray(rows, dtype=np.int32)
+
+    def fetch(row):
+        return (
+            np.asarray(dataset.rowIds(row), dtype=np.int32),
+            np.asarray(dataset.yIntent[row], dtype=np.int32),
+            np.asarray(dataset.rowBio(row), dtype=np.int32) )
+
+    def load(row):
+        ids, intent, bio = tf.numpy_function(fetch, [row], [tf.int32, tf.int32, tf.int32])
+        ids.set_shape([None])
+        intent.set_shape([])
+        bio.set_shape([None])
+        if target == 'intent':
+            return ids, intent
+        if target == 'bio':
+            return ids, bio
+        return ids, {'intent': intent, 'bio': bio}
+
+    pipeline = tf.data.Dataset.from_tensor_slices(rows)
+    if shuffle:
+        # 섞는 것은 행 번호뿐이다.
+        pipeline = pipeline.shuffle(max(len(rows), 1), reshuffle_each_iteration=True)
+    pipeline = pipeline.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+    # 길이 edge 이하인 행들이 한 버킷. 가장 큰 경계보다 긴 행들은 마지막 버킷에 모인다.
+    pipeline = pipeline.bucket_by_sequence_length(
+        element_length_func=lambda ids, y: tf.shape(ids)[0],
+        bucket_boundaries=[ edge + 1 for edge in buckets ],
+        bucket_batch_sizes=[batchSize] * (len(buckets) + 1) )
+    return pipeline.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,224 @@
+'''
+Hosting the Predictors of many domains in one process
+'''
+
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from nlu.predict import Predictor, domainExists, modelVersion, buildStamp
+from nlu.batcher import MicroBatcher
+
+# 도메인 이름으로 쓸 수 있는 것: 모델 디렉토리 밖을 가리키지 못하게 한다.
+_DOMAIN_PATTERN = re.compile(r'^[A-Za-z0-9_\-][A-Za-z0-9_.\-]*$')
+
+class UnknownDomainError(KeyError):
+    '''모델이 준비되지 않은(또는 쓸 수 없는 이름의) 도메인'''
+    pass
+
+class _PoolEntry:
+    def __init__(self, predictor, batcher):
+        self.predictor = predictor
+        self.batcher = batcher
+
+class PredictorPool:
+    '''
+    여러 도메인의 Predictor를 한 프로세스에서 같이 쓴다.
+    도메인마다 Predictor와 마이크로배처를 하나씩 두며, 처음 쓰일 때 MODEL_ROOT/<domain>에서 불러온다.
+    maxDomains개를 넘으면 가장 오래 쓰이지 않은(LRU) 도메인부터 내린다.
+    재학습된 도메인은 reload()로 무중단 교체한다: 새 Predictor를 따로 불러와 데운 뒤 바꿔 끼운다.
+    '''
+
+    def __init__(self, maxDomains=4, maxBatchSize=32, maxWaitMs=5, maxQueueSize=0,
+            useExactIndex=False, backend='tensorflow', warmupTexts=None, verbose=False):
+        '''
+        Args:
+            maxDomains: 동시에 올려둘 도메인의 최대 수
+            maxBatchSize, maxWaitMs, maxQueueSize: 도메인마다 둘 MicroBatcher의 설정
+            useExactIndex, backend: Predictor의 설정
+            warmupTexts: 도메인을 불러올 때 모델을 데우는 데 쓸 텍스트들. 없으면 기본값.
+        '''
+        if maxDomains < 1:
+            raise ValueError('maxDomains must be at least 1.')
+        self._maxDomains = maxDomains
+        self._batcherOptions = dict(
+            maxBatchSize=maxBatchSize, maxWaitMs=maxWaitMs, maxQueueSize=maxQueueSize )
+        self._useExactIndex = useExactIndex
+        self._backend = backend
+        self._warmupTexts = warmupTexts
+        self._verbose = verbose
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # domain -> _PoolEntry, 오래 안 쓰인 것이 앞
+        self._loading = {}  # domain -> 불러오는 중인 _PoolEntry의 Future
+        self._reloading = {}  # domain -> 다시 불러오는 중인 Future
+        self._closed = threading.Event()
+
+    def vv(self, str):
+        if self._verbose:
+            print("[POOL]", str)
+
+    def domains(self):
+        '''지금 올라와 있는 도메인들'''
+        with self._lock:
+            return list(self._entries)
+
+    def versions(self):
+        '''지금 올라와 있는 도메인마다 그 모델 버전'''
+        with self._lock:
+            return { domain: entry.predictor.version()
+                for domain, entry in self._entries.items() }
+
+    def predictor(self, domain):
+        '''도메인domain의 Predictor. 없으면 불러온다.'''
+        return self._get(domain).predictor
+
+    def version(self, domain):
+        '''올라와 있는 도메인domain의 모델 버전. 없으면 불러온다.'''
+        return self._get(domain).predictor.version()
+
+    def submit(self, domain, text):
+        '''도메인domain의 배처에 text를 넣고 결과를 받을 Future를 돌려준다.'''
+        while True:
+            entry = self._get(domain)
+            with self._lock:
+                # 불러온 뒤 바로 내려졌으면 다시 불러온다.
+                if self._entries.get(domain) is entry:
+                    self._entries.move_to_end(domain)
+                    return entry.batcher.submit(text)
+
+    def predict(self, domain, text):
+        return self.submit(domain, text).result()
+
+    def reload(self, domain):
+        '''
+        도메인domain의 매퍼와 모델을 새로 불러와 데운 뒤 바꿔 끼운다.
+        바로 돌아오며, 끝나면 새 모델 버전을 주는 Future를 돌려준다.
+        바꿔 끼우기 전까지는 예전 Predictor가 계속 답하고,
+        이미 맡겨진 질의는 바꾼 뒤에도 예전 Predictor에서 마저 처리된다.
+        불러오다 실패하면 예전 Predictor를 그대로 쓴다.
+        '''
+        self._checkDomain(domain)
+        with self._lock:
+            future = self._reloading.get(domain)
+            if future is not None:
+                return future
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._reloading[domain] = future
+        threading.Thread(
+            target=self._reloadInBackground, args=(domain, future), daemon=True ).start()
+        return future
+
+    def startWatching(self, interval=10):
+        '''
+        interval초마다 올라와 있는 도메인들의 모델 파일을 살펴, 재학습되었으면 reload()한다.
+        build.json이 있으면 그것이 바뀌었을 때만(학습이 모두 끝났을 때만) 다시 불러온다.
+        없으면 모델 파일들이 바뀐 채로 두 번 연달아 같을 때 다시 불러온다.
+        '''
+        threading.Thread(target=self._watch, args=(interval,), daemon=True).start()
+
+    def close(self):
+        '''올라와 있는 모든 도메인을 내린다. 대기 중인 질의는 마저 처리한다.'''
+        self._closed.set()
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.batcher.close()
+
+    def _get(self, domain):
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is not None:
+                self._entries.move_to_end(domain)
+                return entry
+            loading = self._loading.get(domain)
+            isLoader = loading is None
+            if isLoader:
+                loading = Future()
+                self._loading[domain] = loading
+        # 같은 도메인을 여러 요청이 동시에 찾으면 한 번만 불러온다.
+        if not isLoader:
+            return loading.result()
+
+        try:
+            entry = self._load(domain)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[domain]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[domain]
+            self._entries[domain] = entry
+            evicted = []
+            while len(self._entries) > self._maxDomains:
+                evicted.append( self._entries.popitem(last=False) )
+        loading.set_result(entry)
+
+        for evictedDomain, evictedEntry in evicted:
+            self.vv('Evicting the domain: {}'.format(evictedDomain))
+            # 남은 질의를 마저 처리하고 내려가도록 따로 닫는다.
+            threading.Thread(target=evictedEntry.batcher.close, daemon=True).start()
+        return entry
+
+    def _reloadInBackground(self, domain, future):
+        try:
+            entry = self._load(domain)
+        except BaseException as e:
+            self.vv('Failed to reload the domain {}: {}'.format(domain, e))
+            with self._lock:
+                del self._reloading[domain]
+            future.set_exception(e)
+            return
+        with self._lock:
+            old = self._entries.get(domain)
+            self._entries[domain] = entry
+            self._entries.move_to_end(domain)
+            evicted = []
+            while len(self._entries) > self._maxDomains:
+                evicted.append( self._entries.popitem(last=False)[1] )
+            del self._reloading[domain]
+        self.vv('Reloaded the domain: {} (version {})'
+            .format(domain, entry.predictor.version()))
+        future.set_result(entry.predictor.version())
+        # 예전 배처는 맡겨진 질의를 마저 처리하고 닫힌다.
+        for oldEntry in [old] + evicted:
+            if oldEntry is not None:
+                oldEntry.batcher.close()
+
+    def _watch(self, interval):
+        changedVersions = {}  # domain -> 지난번에 본 바뀐 모델 파일 버전
+        while not self._closed.wait(interval):
+            with self._lock:
+                loaded = [ (domain, entry.predictor) for domain, entry in self._entries.items() ]
+            for domain, predictor in loaded:
+                stamp = buildStamp(domain)
+                if stamp is not None:
+                    changed = stamp != predictor.buildStamp()
+                else:
+                    version = modelVersion(domain)
+                    changed = ( version != predictor.version()
+                        and changedVersions.get(domain) == version )
+                    changedVersions[domain] = version
+                if changed:
+                    self.vv('The model of {} has changed.'.format(domain))
+                    try:
+                        self.reload(domain)
+                    except UnknownDomainError:
+                        pass
+
+    def _checkDomain(self, domain):
+        if not _DOMAIN_PATTERN.match(domain) or not domainExists(domain):
+            raise UnknownDomainError(domain)
+
+    def _load(self, domain):
+        self._checkDomain(domain)
+        self.vv('Loading the domain: {}'.format(domain))
+        predictor = Predictor(
+            domain=domain, verbose=self._verbose,
+            useExactIndex=self._useExactIndex, backend=self._backend )
+        # 바꿔 끼우기 전에 데워둬야 첫 질의들이 느려지지 않는다.
+        predictor.warmup(self._warmupTexts)
+        batcher = MicroBatcher(predictor.predictBatch, **self._batcherOptions)
+        return _PoolEntry(predictor, batcher)
@@ -7,21 +7,97 @@ Predicting Natural Language Understanding (NLU)
 '''
 
 import os
+import hashlib
 from nlu.mapper import Mapper
+from nlu.exact_index import ExactIndex
+from nlu.export import savedModelDir, numpyWeightsFile, tfliteFile
+from nlu.buckets import DEFAULT_BUCKETS, bucketWidth, loadBuckets
 import numpy as np
-# 당분간 Import error는 무시 가능
-# https://github.com/microsoft/vscode-python/issues/7390
-from tensorflow.keras.models import load_model as keras_load_model
-import tensorflow as tf
+# TensorFlow는 무거우므로 처음 쓰일 때 불러온다(import).
+# 서버가 TensorFlow를 불러오는 동안에도 /ready 등에 답할 수 있다.
 
 MODEL_ROOT = os.path.abspath( os.path.join(
     os.path.dirname(__file__), '..', 'model'
     ) )
+BUILD_FILE = 'build.json'
+
+# 모델을 돌리는 방법들
+#   tensorflow: SavedModel 또는 HDF5 모델을 TensorFlow로 돌린다.
+#   numpy: nlu_export.py로 내보낸 가중치(*.npz)를 NumPy로 돌린다. TensorFlow를 불러오지 않는다.
+#   tflite: 학습 때 양자화해 둔 TFLite 모델(*.tflite)을 돌린다. tflite_runtime이 있으면 그것을 쓴다.
+BACKENDS = ('tensorflow', 'numpy', 'tflite')
+
+# 모델을 미리 데울 때 쓰는 텍스트들
+_WARMUP_TEXTS = ['안녕하세요', '서울에서 일할 수 있는 개발자 채용 공고 알려줘']
+
+def domainExists(domain):
+    '''MODEL_ROOT 아래에 도메인domain의 모델 디렉토리가 있는지'''
+    return os.path.isdir(os.path.join(MODEL_ROOT, domain))
+
+def modelVersion(domain):
+    '''
+    도메인domain의 모델 파일(매퍼와 모델)들의 버전.
+    파일이 하나라도 바뀌면(수정시각이나 크기) 다른 값이 된다.
+    '''
+    domainDir = os.path.join(MODEL_ROOT, domain)
+    signature = []
+    for dirPath, dirNames, fileNames in os.walk(domainDir):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            path = os.path.join(dirPath, fileName)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append('{}:{}:{}'.format(
+                os.path.relpath(path, domainDir), st.st_mtime_ns, st.st_size ))
+    return hashlib.sha1( '\n'.join(signature).encode('utf-8') ).hexdigest()[:12]
+
+def buildStamp(domain):
+    '''
+    학습이 모두 끝났을 때 Trainer가 쓰는 build.json의 내용. 없으면 None.
+    모델 파일이 모두 새것으로 갖춰졌는지 알아볼 때 쓴다.
+    '''
+    try:
+        with open(os.path.join(MODEL_ROOT, domain, BUILD_FILE), 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def configureThreads(intraOp=0, interOp=0):
+    '''
+    TensorFlow 연산 스레드 수를 정한다. 0이면 TensorFlow가 알아서 정한다.
+    모델을 불러오기 전, 즉 TensorFlow가 처음 돌기 전에 불러야 한다.
+    '''
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intraOp)
+    tf.config.threading.set_inter_op_parallelism_threads(interOp)
 
 class Predictor:
-    def __init__(self, domain, verbose=False):
+    def __init__(self, domain, verbose=False, useExactIndex=False, backend='tensorflow'):
+        '''
+        Args:
+            domain: 도메인 이름. MODEL_ROOT/<domain>에서 매퍼와 모델을 불러온다.
+            useExactIndex: 학습 데이터와 완전히 같은 텍스트는 모델 대신
+                완전일치 색인(exact_index.json)으로 답한다. 색인 파일이 없으면 쓰지 않는다.
+            backend: 모델을 돌리는 방법. BACKENDS 참고.
+        backend가 tensorflow이면 모델마다 미리 trace된 SavedModel(*.savedmodel)이 있으면 그것을, 없으면 HDF5를 불러온다.
+        입력은 길이 버킷(buckets.json, 없으면 DEFAULT_BUCKETS)의 너비로 채워 넣어(padding)
+        버킷마다 모양이 고정된 그래프로 돈다.
+        결합 모델(joint_model.h5)로 학습한 도메인이면 두 모델 대신 그것 하나를 불러오고,
+        의도와 BIO 태그를 한 번의 계산으로 함께 얻는다.
+        '''
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend: {}'.format(backend))
         self._domain = domain
         self._verbose = verbose
+        self._backend = backend
+        # 불러오기 전에 재야 불러오는 사이에 바뀐 파일을 놓치지 않는다.
+        self._version = modelVersion(domain)
+        self._buildStamp = buildStamp(domain)
+        # 모델 디렉토리는 버전 디렉토리를 가리키는 링크이다. (nlu.train.Trainer.publish)
+        # 불러오는 도중에 새 버전으로 바뀌어도 파일들이 섞이지 않도록 한 번만 따라가 둔다.
+        self._modelDir = os.path.realpath(os.path.join(MODEL_ROOT, domain))
 
         self.vv("Domain name = {}".format(domain))
         
@@ -29,69 +105,289 @@ class Predictor:
         self.vv("Loading the mapper:")
         self.vv( self.mapperDir() )
         self._mapper = Mapper.loadFromFile( self.mapperDir() )
-        # Intent classifier
-        self.vv("Loading the model of Intent-classifier:")
-        self.vv( self.icModelFile() )
-        self._icModel = keras_load_model( self.icModelFile() )
-        if self._verbose: self._icModel.summary()
-        # Entity recognizer
-        self.vv("Loading the model of Entity-recognizer:")
-        self.vv( self.erModelFile() )
-        self._erModel = keras_load_model( self.erModelFile() )
-        if self._verbose: self._icModel.summary()
+        # Length buckets
+        self._buckets = list(DEFAULT_BUCKETS)
+        if os.path.exists(self.bucketsFile()):
+            self._buckets = loadBuckets( self.bucketsFile() )
+        self.vv("Length buckets = {}".format(self._buckets))
+        self._jointPredict = None
+        if os.path.exists(self.jointModelFile()):
+            # Joint model: 인코더를 함께 쓰는 두 출력 [의도, BIO 태그]
+            self.vv("Loading the joint model of Intent-classifier and Entity-recognizer:")
+            self._jointModel, self._jointPredict = self._loadModel( self.jointModelFile() )
+            self._icModel = self._erModel = self._jointModel
+            self._icPredict = lambda X: self._jointPredict(X)[0]
+            self._erPredict = lambda X: self._jointPredict(X)[1]
+        else:
+            # Intent classifier
+            self.vv("Loading the model of Intent-classifier:")
+            self._icModel, self._icPredict = self._loadModel( self.icModelFile() )
+            # Entity recognizer
+            self.vv("Loading the model of Entity-recognizer:")
+            self._erModel, self._erPredict = self._loadModel( self.erModelFile() )
+        # Exact-match index
+        self._exactIndex = None
+        if useExactIndex and os.path.exists(self.exactIndexFile()):
+            self.vv("Loading the exact-match index:")
+            self.vv( self.exactIndexFile() )
+            self._exactIndex = ExactIndex.loadFromFile( self.exactIndexFile() )
 
     def vv(self, str):
         if self._verbose:
             print("[PREDICTOR]", str)
 
+    def _loadModel(self, h5File):
+        '''
+        모델과, [배치, 길이] int32 행렬을 받아 예측값(numpy)을 돌려주는 함수.
+        출력이 여럿인 모델(결합 모델)이면 그 함수는 출력마다의 예측값 리스트를 돌려준다.
+        SavedModel이 있으면 그것을 쓴다.
+        '''
+        if self._backend == 'numpy':
+            from nlu.numpy_engine import NumpyModel
+            self.vv( numpyWeightsFile(h5File) )
+            model = NumpyModel.loadFromFile( numpyWeightsFile(h5File) )
+            return model, model.predict
+        if self._backend == 'tflite':
+            from nlu.tflite_engine import TfliteModel
+            self.vv( tfliteFile(h5File) )
+            model = TfliteModel.loadFromFile( tfliteFile(h5File) )
+            return model, model.predict
+
+        import tensorflow as tf
+        savedDir = savedModelDir(h5File)
+        if os.path.isdir(savedDir):
+            self.vv( savedDir )
+            model = tf.saved_model.load(savedDir)
+            return model, lambda X: _toNumpy(model.predict(tf.constant(X)))
+
+        from tensorflow.keras.models import load_model as keras_load_model
+        self.vv( h5File )
+        model = keras_load_model(h5File)
+        if self._verbose: model.summary()
+        # 버킷 너비마다 입력 모양이 고정된 그래프를 둔다.
+        # 입력 길이가 바뀔 때마다 다시 trace하지 않으며, 작은 배치에도 model.predict보다 부담이 적다.
+        def trace(width):
+            return tf.function(
+                lambda X: model(X, training=False),
+                input_signature=[tf.TensorSpec([None, width], tf.int32)] )
+        traced = { width: trace(width) for width in self._buckets }
+        def predict(X):
+            width = X.shape[1]
+            if width not in traced:  # 가장 큰 버킷보다 긴 입력: 그 배수 너비도 한 번만 trace
+                traced[width] = trace(width)
+            return _toNumpy(traced[width](tf.constant(X)))
+        return model, predict
+
     def domain(self):
         return self._domain
 
+    def backend(self):
+        return self._backend
+
+    def version(self):
+        '''불러온 모델 파일들의 버전. modelVersion() 참고.'''
+        return self._version
+
+    def buildStamp(self):
+        '''불러올 때의 build.json 내용. buildStamp() 참고.'''
+        return self._buildStamp
+
+    def warmup(self, texts=None):
+        '''
+        첫 질의들이 느리지 않도록 두 모델을 미리 돌려둔다.
+        버킷마다 한 번씩 돌려 그래프도 모두 trace해 둔다.
+        '''
+        if texts is None:
+            texts = _WARMUP_TEXTS
+        for width in self._buckets:
+            X = np.zeros((1, width), dtype=np.int32)
+            if self._jointPredict is not None:
+                self._jointPredict(X)
+                continue
+            self._icPredict(X)
+            self._erPredict(X)
+        self._predictChunk(list(texts))
+
     def mapperDir(self):
         '''매퍼 설정값(*.vocab)이 있어야 할 주소'''
-        return os.path.join(MODEL_ROOT, self._domain, 'mapper')
+        return os.path.join(self._modelDir, 'mapper')
 
     def icModelFile(self):
         '''의도분석(Intent Classifier)모델의 HDF5파일 주소'''
-        return os.path.join(MODEL_ROOT, self._domain, 'intent_classifier.h5')
+        return os.path.join(self._modelDir, 'intent_classifier.h5')
 
     def erModelFile(self):
         '''개체명인식(Entity recognizer)모델의 HDF5파일 주소'''
-        return os.path.join(MODEL_ROOT, self._domain, 'entity_recognizer.h5')
+        return os.path.join(self._modelDir, 'entity_recognizer.h5')
 
+    def jointModelFile(self):
+        '''의도분석과 개체명인식을 함께 하는 결합(Joint) 모델의 HDF5파일 주소'''
+        return os.path.join(self._modelDir, 'joint_model.h5')
+
+    def exactIndexFile(self):
+        '''학습 데이터 완전일치 색인 파일 주소'''
+        return os.path.join(self._modelDir, 'exact_index.json')
+
+    def bucketsFile(self):
+        '''길이 버킷 경계 파일 주소'''
+        return os.path.join(self._modelDir, 'buckets.json')
     
     def predictIntent(self, text):
         '''텍스트text의 의도Intent와 그 확률'''
-        mapTextIC = self._mapper.mapTextIC
-        getIntentFromId = self._mapper.getIntentFromId
-        model = self._icModel
-
-        X_user = tf.constant(np.array([ mapTextIC(text) ]))
-        pred_user = model.predict(X_user)
-        # pred_user = [[8.6426735e-07 1.1622906e-06 ... 3.8642287e-03]]
-
-        intentId = np.where(pred_user[0] == np.amax(pred_user[0]))[0][0]
-        # np.where(...) = [[13]]  #(13 = pred_user중 최고값의 index)
-        prob = pred_user[0][ intentId ]
-        return getIntentFromId(intentId), float(prob)
-        
+        return self.predictIntentBatch([text])[0]
 
     def predictEntity(self, text):
         '''
         텍스트text의 객체Entity를 가리키는 BIO 태그배열과 그 확률.
         예) ['O', 'O', 'B-loc', 'I-loc', 'O', 'O', 'O']
         '''
-        mapTextER = self._mapper.mapTextER
-        getBioFromIds = self._mapper.getBioTagsFromIds
-        model = self._erModel
-        
-        X_user = tf.constant(np.array([ mapTextER(text) ]))
-        pred_user = model.predict(X_user)
-        # pred_user = [[[8.6426735e-07 1.1622906e-06 ... 3.8642287e-03], [...], ...]]
-        
-        bioIds = np.argmax(pred_user, -1)[0]
-        # np.argmax(...) = [[1, 1, 4, 3, ??..]]
-        prob = min(
-            [ pred_user[0][i][ bioIds[i] ] for i in range(len(bioIds)) ]
-        ) # The minimal probability among the predicted BIO tags.
-        return getBioFromIds(bioIds), float(prob)
+        return self.predictEntityBatch([text])[0]
+
+    def predictIntentBatch(self, texts, batchSize=None):
+        '''텍스트들texts 각각의 (의도Intent, 그 확률)의 리스트'''
+        return self._predictWithIndex(
+            texts, batchSize, self._predictIntentChunk,
+            lambda intent, tags, prob: (intent, prob) )
+
+    def predictEntityBatch(self, texts, batchSize=None):
+        '''텍스트들texts 각각의 (BIO 태그배열, 그 확률)의 리스트'''
+        return self._predictWithIndex(
+            texts, batchSize, self._predictEntityChunk,
+            lambda intent, tags, prob: (tags, prob) )
+
+    def predictBatch(self, texts, batchSize=None):
+        '''
+        여러 텍스트를 한꺼번에 예측한다. 두 모델 모두 배치 하나당 한 번씩만 돈다.
+        결과: 텍스트마다 (intent, intent_prob, bioTags, tags_prob)의 리스트
+        batchSize를 주면 그 크기씩 나누어 돈다.
+        '''
+        return self._predictWithIndex(
+            texts, batchSize, self._predictChunk,
+            lambda intent, tags, prob: (intent, prob, tags, prob) )
+
+    def _predictWithIndex(self, texts, batchSize, predictChunk, fromIndex):
+        '''
+        완전일치 색인에 있는 텍스트는 색인으로 답하고, 나머지만 batchSize씩 predictChunk로 예측한다.
+        fromIndex: 색인의 (intent, 태그배열, 확률)을 결과 형태로 바꾸는 함수
+        '''
+        texts = list(texts)
+        results = [None] * len(texts)
+        misses = []
+        for i, text in enumerate(texts):
+            found = None
+            if self._exactIndex is not None:
+                found = self._exactIndex.lookup(text)
+            if found is None:
+                misses.append(i)
+            else:
+                results[i] = fromIndex(*found)
+        for chunk in _chunks(misses, batchSize):
+            if len(chunk) == 0:
+                continue
+            predicted = predictChunk([ texts[i] for i in chunk ])
+            for i, result in zip(chunk, predicted):
+                results[i] = result
+        return results
+
+    def _predictIntentChunk(self, texts):
+        queries = self._mapper.encodeQueries(texts)
+        results = [None] * len(texts)
+        for width, rows in self._groupByBucket(queries.lengths):
+            X = queries.padded(rows, width)
+            for r, result in zip(rows, self._decodeIntents( *self._runIntent(X) )):
+                results[r] = result
+        return results
+
+    def _predictEntityChunk(self, texts):
+        queries = self._mapper.encodeQueries(texts)
+        results = [None] * len(texts)
+        for width, rows in self._groupByBucket(queries.lengths):
+            X, lengths = queries.padded(rows, width), queries.lengths[rows]
+            entities = self._decodeEntities( *self._runEntity(X, lengths), lengths )
+            for r, result in zip(rows, entities):
+                results[r] = result
+        return results
+
+    def _predictChunk(self, texts):
+        # 텍스트마다 한 번만 인코딩하고, 두 모델이 같은 입력 행렬을 쓴다.
+        # 결합 모델이면 모델도 한 번만 돈다.
+        queries = self._mapper.encodeQueries(texts)
+        results = [None] * len(texts)
+        for width, rows in self._groupByBucket(queries.lengths):
+            X, lengths = queries.padded(rows, width), queries.lengths[rows]
+            icPred, erPred = None, None
+            if self._jointPredict is not None:
+                icPred, erPred = self._jointPredict(X)
+            intents = self._decodeIntents( *self._runIntent(X, icPred) )
+            entities = self._decodeEntities( *self._runEntity(X, lengths, erPred), lengths )
+            for r, (intent, intentProb), (tags, tagsProb) in zip(rows, intents, entities):
+                results[r] = (intent, intentProb, tags, tagsProb)
+        return results
+
+    def _groupByBucket(self, lengths):
+        '''
+        행들을 채워 넣을(padding) 버킷 너비별로 모은다. 짧은 질의가 긴 질의만큼 돌지 않게 한다.
+        결과: [(너비, [행 번호, ...]), ...]
+        '''
+        groups = {}
+        for row, length in enumerate(lengths):
+            groups.setdefault(bucketWidth(length, self._buckets), []).append(row)
+        return sorted(groups.items())
+
+    def _runIntent(self, X, pred=None):
+        '''
+        IC 모델을 한 번 돌려 행마다 최고 확률의 Intent ID와 그 확률을 얻는다.
+        예측값pred(결합 모델의 의도 출력)를 주면 모델을 돌리지 않고 그것을 쓴다.
+        '''
+        if pred is None:
+            pred = self._icPredict(X)
+        if self._jointPredict is not None:
+            # 결합 모델의 의도는 글자들의 평균에서 나오므로 빈 질의에는 의도가 없다: ID 0(UNK), 확률 0.
+            # (Keras의 mask된 평균은 NaN이고 NumPy·TFLite 엔진은 편향만의 출력이라 그대로 두면 백엔드마다 다르다.)
+            pred = np.where(X.any(axis=1)[:, np.newaxis], pred, 0.0)
+        # pred = [[8.6426735e-07 1.1622906e-06 ... 3.8642287e-03], ...]
+        intentIds = np.argmax(pred, -1)
+        probs = pred[ np.arange(len(pred)), intentIds ]
+        return intentIds, probs
+
+    def _runEntity(self, X, lengths, pred=None):
+        '''
+        ER 모델을 한 번 돌려 글자마다 최고 확률의 BIO ID를 얻는다.
+        행마다 Padding을 뺀 실제 글자들 중 최소 확률도 함께 얻는다.
+        예측값pred(결합 모델의 BIO 출력)를 주면 모델을 돌리지 않고 그것을 쓴다.
+        '''
+        if pred is None:
+            pred = self._erPredict(X)
+        # pred = [[[8.6426735e-07 1.1622906e-06 ... 3.8642287e-03], [...], ...], ...]
+        bioIds = np.argmax(pred, -1)
+        probs = np.take_along_axis(pred, bioIds[..., np.newaxis], -1)[..., 0]
+        # 앞쪽 Padding 자리를 가린다.
+        width = X.shape[1]
+        isText = np.arange(width)[np.newaxis, :] >= (width - lengths)[:, np.newaxis]
+        minProbs = np.where(isText, probs, np.inf).min(axis=1)
+        minProbs[lengths == 0] = 1.0
+        return bioIds, minProbs
+
+    def _decodeIntents(self, intentIds, probs):
+        intents = self._mapper.getIntentsFromIds(intentIds)
+        return [ (intent, float(p)) for intent, p in zip(intents, probs) ]
+
+    def _decodeEntities(self, bioIds, minProbs, lengths):
+        tags = self._mapper.getBioTagsFromIdMatrix(bioIds, lengths)
+        return [ (t, float(p)) for t, p in zip(tags, minProbs) ]
+
+
+def _toNumpy(outputs):
+    '''TensorFlow 출력(출력이 여럿이면 그 리스트)을 numpy로'''
+    if isinstance(outputs, (list, tuple)):
+        return [ o.numpy() for o in outputs ]
+    return outputs.numpy()
+
+def _chunks(items, size):
+    '''items를 size개씩 나눈다. size가 없으면 통째로 하나.'''
+    items = list(items)
+    if not size:
+        yield items
+        return
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
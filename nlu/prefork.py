@@ -0,0 +1,122 @@
+'''
+Pre-fork multi-process serving for the NLU service
+'''
+
+import os
+import signal
+import socket
+import time
+
+def listenSocket(host, port, backlog=1024):
+    '''워커들이 함께 받을 listening 소켓을 연다.'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+class _StopServing(Exception):
+    pass
+
+class PreforkServer:
+    '''
+    프리포크 서버: 미리 연 listening 소켓 하나를 워커 프로세스 numWorkers개가 나눠 받는다.
+    워커가 죽으면 다시 띄우고, SIGTERM/SIGINT를 받으면 워커들을 차례로 끝낸다.
+    '''
+
+    def __init__(self, sock, workerMain, numWorkers, gracefulTimeout=30, verbose=True):
+        '''
+        Args:
+            sock: listenSocket()으로 연 소켓
+            workerMain: 워커 프로세스에서 불릴 함수. workerMain(sock, workerIndex)
+                SIGTERM을 받으면 하던 요청을 마치고 돌아와야 한다.
+            numWorkers: 워커 프로세스 수
+            gracefulTimeout: 끝낼 때 워커를 기다려주는 최대 시간(초). 넘기면 SIGKILL.
+        '''
+        if numWorkers < 1:
+            raise ValueError('numWorkers must be at least 1.')
+        self._sock = sock
+        self._workerMain = workerMain
+        self._numWorkers = numWorkers
+        self._gracefulTimeout = gracefulTimeout
+        self._verbose = verbose
+        self._workers = {}  # pid -> (workerIndex, 시작시각)
+
+    def vv(self, str):
+        if self._verbose:
+            print("[PREFORK]", str)
+
+    def run(self):
+        '''워커들을 띄우고, 끝날 때까지 지켜본다.'''
+        signal.signal(signal.SIGTERM, self._onStopSignal)
+        signal.signal(signal.SIGINT, self._onStopSignal)
+        try:
+            for workerIndex in range(self._numWorkers):
+                self._spawn(workerIndex)
+            while True:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                if pid not in self._workers:
+                    continue
+                workerIndex, startedAt = self._workers.pop(pid)
+                self.vv('Worker {} (pid {}) exited with status {}. Restarting...'
+                    .format(workerIndex, pid, status))
+                # 곧바로 다시 죽는 워커가 CPU를 태우지 않도록 잠시 쉰다.
+                if time.monotonic() - startedAt < 1.0:
+                    time.sleep(1.0)
+                self._spawn(workerIndex)
+        except _StopServing:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self._stopWorkers()
+
+    def _spawn(self, workerIndex):
+        pid = os.fork()
+        if pid == 0:
+            # 워커 프로세스
+            exitCode = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                self._workerMain(self._sock, workerIndex)
+            except BaseException:
+                import traceback; traceback.print_exc()
+                exitCode = 1
+            finally:
+                os._exit(exitCode)
+        self._workers[pid] = (workerIndex, time.monotonic())
+        self.vv('Worker {} started (pid {}).'.format(workerIndex, pid))
+
+    def _onStopSignal(self, signum, frame):
+        # os.wait()가 시그널 뒤에 다시 기다리지 않도록 예외로 빠져나온다.
+        raise _StopServing()
+
+    def _stopWorkers(self):
+        self.vv('Stopping {} workers...'.format(len(self._workers)))
+        for pid in self._workers:
+            try: os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError: pass
+
+        deadline = time.monotonic() + self._gracefulTimeout
+        while self._workers and time.monotonic() < deadline:
+            for pid in list(self._workers):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done == pid:
+                    self._workers.pop(pid)
+            time.sleep(0.1)
+
+        for pid in self._workers:
+            self.vv('Worker (pid {}) did not stop in time. Killing...'.format(pid))
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self._workers = {}
@@ -1,42 +1,223 @@
-import tensorflow_datasets as tfds
 import json
+from collections import Counter
+import numpy as np
 
 VOCAB_POSTFIX = ".vocab"
 
+# CharTextEncoder의 글자 -> ID 표가 바로 덮는 코드포인트 범위: BMP 전체
+# (ASCII, 한글 자모와 호환 자모, 한글 음절 U+AC00..U+D7A3 포함). 그 밖의 글자는 사전으로 찾는다.
+_LOOKUP_SIZE = 0x10000
+
 # 훗날 인코딩된 값이 RNN 등지에서 쓰일 때 Zero-padding을 받을 수 있으므로
 # 모든 인코더에서 VocabMap의 0번에 해당하는 것은 항상 Padding을 뜻해야 한다.
 
-class CharTextEncoder(tfds.features.text.TextEncoder):
+def _inverseTable(vocabMap, UNK):
+    '''
+    ID -> 이름의 배열. 번호가 없는 자리(0번 Padding 등)는 UNK로 채운다.
+    디코딩할 때 vocabMap 전체를 훑지 않고 배열에서 바로 찾는다.
+    '''
+    table = np.full(max(vocabMap.values()) + 1, UNK, dtype=object)
+    for name, id in vocabMap.items():
+        table[id] = name
+    return table
+
+def _takeLabels(table, ids):
+    '''ID 배열ids(몇 차원이든)를 이름 배열로. 범위 밖의 ID는 UNK(1번)가 된다.'''
+    ids = np.asarray(ids, dtype=np.int64)
+    ids = np.where((ids >= 0) & (ids < len(table)), ids, 1)
+    return np.take(table, ids)
+
+
+def padArrays(arrays, maxlen=None):
+    '''
+    ID 배열들을 [배치, maxlen] int32 행렬 하나로 만든다.
+    Keras pad_sequences와 같이 앞쪽을 0으로 채우고(padding='pre'),
+    maxlen보다 길면 앞쪽을 자른다(truncating='pre'). maxlen이 없으면 가장 긴 것에 맞춘다.
+    '''
+    if maxlen is None:
+        maxlen = max([ len(ids) for ids in arrays ], default=0)
+    X = np.zeros((len(arrays), maxlen), dtype=np.int32)
+    for row, ids in enumerate(arrays):
+        ids = ids[len(ids)-maxlen:] if len(ids) > maxlen else ids
+        if len(ids) > 0:
+            X[row, maxlen-len(ids):] = ids
+    return X
+
+
+def _frequencyOrdered(counter, minCount=1, maxSize=None):
+    '''
+    자주 나온 것부터 (같으면 이름순으로) 늘어놓는다. set 순서와 달리 실행할 때마다 같다.
+    minCount번보다 적게 나온 것은 빼고, 최대 maxSize개까지만 남긴다.
+    '''
+    names = sorted(
+        ( name for name, count in counter.items() if count >= minCount ),
+        key=lambda name: (-counter[name], name) )
+    return names if maxSize is None else names[:maxSize]
+
+def _vocabFrom(names, UNK):
+    '''이름들에 2번부터 번호를 매긴다. 0번: Padding, 1번: UNK'''
+    vocabMap = dict( zip(names, range(2, len(names)+2)) )
+    vocabMap[UNK] = 1
+    return vocabMap
+
+def _extendedVocab(vocabMap, counter, minCount=1, maxSize=None):
+    '''
+    vocabMap에 없던 이름들을 자주 나온 것부터 뒤쪽 번호로 더한 새 사전. 있던 이름의 번호는 그대로이다.
+    minCount번보다 적게 나온 것은 더하지 않고, 이름 수(UNK 빼고)가 maxSize를 넘지 않게 더한다.
+    결과: (새 사전, 더한 이름들)
+    '''
+    unseen = Counter({ name: count for name, count in counter.items() if name not in vocabMap })
+    room = None if maxSize is None else max(0, maxSize - (len(vocabMap) - 1))
+    added = _frequencyOrdered(unseen, minCount, room)
+    extended = dict(vocabMap)
+    nextId = max(vocabMap.values()) + 1
+    for i, name in enumerate(added):
+        extended[name] = nextId + i
+    return extended, added
+
+
+class TextEncoder:
+    '''
+    인코더들의 공통 틀 (tensorflow_datasets의 TextEncoder와 같은 모양).
+    이것 하나 때문에 tensorflow_datasets와 TensorFlow 전체를 불러오지 않도록 직접 둔다.
+    '''
+
+    def encode(self, s):
+        raise NotImplementedError
+
+    def decode(self, ids):
+        raise NotImplementedError
+
+    @property
+    def vocab_size(self):
+        raise NotImplementedError
+
+    def save_to_file(self, filename_prefix):
+        raise NotImplementedError
+
+    @classmethod
+    def load_from_file(cls, filename_prefix):
+        raise NotImplementedError
+
+    def toArrays(self):
+        '''번들 파일(nlu.bundle)에 넣을 배열들: 이름 -> ndarray'''
+        raise NotImplementedError
+
+    @classmethod
+    def fromArrays(cls, arrays):
+        '''toArrays()의 배열들로 인코더를 다시 만든다.'''
+        raise NotImplementedError
+
+
+def _labelsToArrays(vocabMap):
+    '''이름 -> ID 사전을 UTF-8 바이트열, 그 끝 위치들, ID들의 배열로'''
+    names = list(vocabMap)
+    encoded = [ name.encode('utf-8') for name in names ]
+    return {
+        'labels': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'ends': np.cumsum([ len(b) for b in encoded ], dtype=np.int64),
+        'ids': np.array([ vocabMap[name] for name in names ], dtype=np.int32),
+    }
+
+def _labelsFromArrays(arrays):
+    blob = arrays['labels'].tobytes()
+    starts = [0] + arrays['ends'][:-1].tolist()
+    return {
+        blob[start:end].decode('utf-8'): id
+        for start, end, id in zip(starts, arrays['ends'].tolist(), arrays['ids'].tolist()) }
+
+
+class CharTextEncoder(TextEncoder):
 
-    def __init__(self, textGenerator, vocabMap=None):
+    def __init__(self, textGenerator, vocabMap=None, minCount=1, maxSize=None):
+        '''
+        Args:
+            minCount: 새로 번호를 매길 때, 이보다 적게 나온 글자는 UNK로 둔다.
+            maxSize: 새로 번호를 매길 때, 자주 나온 순으로 최대 이만큼의 글자에만 번호를 준다.
+        '''
         # VocabMap에 없을 문자, Unknown Character
         self._UNK = "UNK"
+        # 새로 번호를 매겼을 때의 보고 (buildVocab 참고)
+        self._report = None
         # 주어진 vocabMap이 없으면: 새로이 글자에 번호 매기기.
         if not vocabMap:
-            self._vocabMap = self.buildVocab(textGenerator)
+            self._vocabMap = self.buildVocab(textGenerator, minCount, maxSize)
         # 있으면: 그것으로 한다.
         else:
             self._vocabMap = vocabMap
+        self._buildLookup()
     
-    def buildVocab(self, textGenerator):
-        # 텍스트 모든 글자를 취합하여 번호를 매기자.
-        vocabSet = set()
+    def _buildLookup(self):
+        '''
+        코드포인트로 바로 찾는 글자 -> ID 표를 만든다. 없는 글자는 UNK의 ID.
+        표 밖(BMP 밖)의 글자는 _fallback 사전으로 찾는다.
+        '''
+        unkId = self._vocabMap[self._UNK]
+        self._lookup = np.full(_LOOKUP_SIZE, unkId, dtype=np.int32)
+        self._fallback = {}
+        for char, id in self._vocabMap.items():
+            if len(char) != 1:  # UNK
+                continue
+            if ord(char) < _LOOKUP_SIZE:
+                self._lookup[ord(char)] = id
+            else:
+                self._fallback[ord(char)] = id
+        self._unkId = unkId
+
+    def buildVocab(self, textGenerator, minCount=1, maxSize=None):
+        # 텍스트 모든 글자를 세어서 자주 나온 것부터 번호를 매기자.
+        counter = Counter()
         for t in textGenerator:
-            vocabSet.update(list(t))
-        vocabMap = dict( zip(vocabSet, range(2, len(vocabSet)+2)) )
-        vocabMap[self._UNK] = 1
-        return vocabMap
+            counter.update(t)
+        chars = _frequencyOrdered(counter, minCount, maxSize)
+        self._report = _charReport(counter, chars, minCount, maxSize)
+        return _vocabFrom(chars, self._UNK)
         # 0번: Padding, 1번: UNK
+
+    def extended(self, textGenerator, minCount=1, maxSize=None):
+        '''
+        텍스트들에서 처음 보는 글자들을 자주 나온 것부터 뒤쪽 번호로 더한 새 인코더.
+        있던 글자의 번호는 그대로이므로 예전 모델의 Embedding 행들을 그대로 쓸 수 있다.
+        minCount, maxSize는 더하는 글자에만 적용한다. (있던 글자는 빼지 않는다.)
+        vocabReport에는 더한 글자 수('added')도 담긴다.
+        '''
+        counter = Counter()
+        for t in textGenerator:
+            counter.update(t)
+        vocabMap, added = _extendedVocab(self._vocabMap, counter, minCount, maxSize)
+        encoder = self.__class__(None, vocabMap=vocabMap)
+        encoder._report = _charReport(
+            counter, [ char for char in vocabMap if len(char) == 1 ], minCount, maxSize )
+        encoder._report['added'] = len(added)
+        return encoder
+
+    def vocabReport(self):
+        '''
+        새로 번호를 매긴 인코더이면 그 보고, 불러온 것이면 None.
+        coverage: 학습 텍스트의 글자(중복 포함) 중 UNK가 아닌 것의 비율
+        '''
+        return self._report
     
     def encode(self, s):
-        encoded = []
-        vm = self._vocabMap
-        UNK = self._UNK
-        for char in s:
-            if not char in vm:
-                char = UNK
-            encoded.append(vm[char])
-        return encoded
+        return self.encodeArray(s).tolist()
+
+    def encodeArray(self, s):
+        '''문자열 s를 글자마다 ID로. 결과는 int32 배열'''
+        codepoints = np.frombuffer(s.encode('utf-32-le'), dtype=np.uint32)
+        inLookup = codepoints < _LOOKUP_SIZE
+        ids = self._lookup[ np.where(inLookup, codepoints, 0) ]
+        if not inLookup.all():
+            for i in np.flatnonzero(~inLookup):
+                ids[i] = self._fallback.get(int(codepoints[i]), self._unkId)
+        return ids
+
+    def encodeBatch(self, texts, maxlen=None):
+        '''
+        여러 문자열을 한꺼번에 인코딩해 [배치, maxlen] int32 행렬로.
+        Keras pad_sequences와 같이 앞쪽을 0으로 채우고(padding='pre'),
+        maxlen보다 길면 앞쪽을 자른다(truncating='pre'). maxlen이 없으면 가장 긴 것에 맞춘다.
+        '''
+        return padArrays([ self.encodeArray(s) for s in texts ], maxlen)
 
     def decode(self, ids):
         raise NotImplementedError('Not invertible encoder.')
@@ -66,8 +247,60 @@ class CharTextEncoder(tfds.features.text.TextEncoder):
         # vocabMap을 갖춘 인코더를 만든다.
         return cls(None, vocabMap=mySetupLoaded['vocabMap'])
 
+    def toArrays(self):
+        chars = [ char for char in self._vocabMap if len(char) == 1 ]
+        return {
+            'lookup': self._lookup,
+            'codepoints': np.array([ ord(char) for char in chars ], dtype=np.uint32),
+            'ids': np.array([ self._vocabMap[char] for char in chars ], dtype=np.int32),
+            'unk': np.array([ self._unkId ], dtype=np.int32),
+        }
+
+    @classmethod
+    def fromArrays(cls, arrays):
+        '''
+        글자 -> ID 표(lookup)는 주어진 배열을 그대로 쓴다(복사하지 않음).
+        vocabMap 사전은 처음 쓰일 때에야 만든다. 추론에는 쓰이지 않는다.
+        '''
+        encoder = cls.__new__(cls)
+        encoder._UNK = "UNK"
+        encoder._report = None
+        encoder._arrays = arrays
+        encoder._lookup = arrays['lookup']
+        encoder._unkId = int(arrays['unk'][0])
+        codepoints = arrays['codepoints']
+        outside = codepoints >= _LOOKUP_SIZE
+        encoder._fallback = dict(zip(
+            codepoints[outside].tolist(), arrays['ids'][outside].tolist() ))
+        return encoder
+
+    def __getattr__(self, name):
+        # fromArrays로 만든 인코더의 vocabMap을 처음 쓸 때 만든다.
+        if name == '_vocabMap' and '_arrays' in self.__dict__:
+            arrays = self._arrays
+            vocabMap = dict(zip(
+                map(chr, arrays['codepoints'].tolist()), arrays['ids'].tolist() ))
+            vocabMap[self._UNK] = self._unkId
+            self._vocabMap = vocabMap
+            return vocabMap
+        raise AttributeError(name)
+
+
+def _charReport(counter, chars, minCount, maxSize):
+    # 글자 사전chars이 텍스트 글자들counter을 얼마나 덮는지 (CharTextEncoder.vocabReport)
+    total = sum(counter.values())
+    covered = sum( counter[char] for char in chars )
+    return {
+        'minCount': minCount,
+        'maxSize': maxSize,
+        'seenChars': len(counter),
+        'vocabSize': len(chars),
+        'totalChars': total,
+        'coverage': covered / total if total else 1.0,
+    }
 
-class IntentEncoder(tfds.features.text.TextEncoder):
+
+class IntentEncoder(TextEncoder):
 
     def __init__(self, intentGenerator, vocabMap=None):
         # VocabMap에 없을 문자, Unknown Character
@@ -78,16 +311,18 @@ class IntentEncoder(tfds.features.text.TextEncoder):
         # 있으면: 그것으로 한다.
         else:
             self._vocabMap = vocabMap
+        # 디코딩용 역방향 표: id -> intent
+        self._idToIntent = _inverseTable(self._vocabMap, self._UNK)
     
     def buildVocab(self, intentGenerator):
-        # 모든 Intent를 취합하여 번호를 매기자.
-        vocabSet = set()
-        for i in intentGenerator:
-            vocabSet.add(i)
-        vocabMap = dict( zip(vocabSet, range(2, len(vocabSet)+2)) )
-        vocabMap[self._UNK] = 1
-        return vocabMap
+        # 모든 Intent를 세어서 자주 나온 것부터 번호를 매기자.
+        return _vocabFrom( _frequencyOrdered(Counter(intentGenerator)), self._UNK )
         # 1번: UNK
+
+    def extended(self, intentGenerator):
+        '''처음 보는 Intent들을 자주 나온 것부터 뒤쪽 번호로 더한 새 인코더. 있던 번호는 그대로이다.'''
+        vocabMap, _ = _extendedVocab(self._vocabMap, Counter(intentGenerator))
+        return self.__class__(None, vocabMap=vocabMap)
     
     def encode(self, s):
         '''intent s의 id'''
@@ -97,12 +332,14 @@ class IntentEncoder(tfds.features.text.TextEncoder):
         return vm[s]
 
     def decode(self, id):
-        '''id였던 것이 intent 문자열로 회귀'''
-        vm = self._vocabMap
-        find = [intent for intent, i in vm.items() if i == id]
-        if len(find) == 0 : # 없는 id
-            raise IndexError('Unavailable Intent ID.')
-        return find[0]
+        '''id였던 것이 intent 문자열로 회귀. 없는 id이면 UNK.'''
+        if 0 <= id < len(self._idToIntent):
+            return self._idToIntent[id]
+        return self._UNK
+
+    def decodeBatch(self, ids):
+        '''id들의 배열 ids를 한꺼번에 intent 문자열의 리스트로. 없는 id는 UNK.'''
+        return _takeLabels(self._idToIntent, ids).tolist()
     
     @property
     def vocab_size(self):
@@ -129,8 +366,15 @@ class IntentEncoder(tfds.features.text.TextEncoder):
         # vocabMap을 갖춘 인코더를 만든다.
         return cls(None, vocabMap=mySetupLoaded['vocabMap'])
 
+    def toArrays(self):
+        return _labelsToArrays(self._vocabMap)
+
+    @classmethod
+    def fromArrays(cls, arrays):
+        return cls(None, vocabMap=_labelsFromArrays(arrays))
 
-class BioEncoder(tfds.features.text.TextEncoder):
+
+class BioEncoder(TextEncoder):
 
     def __init__(self, bioGenerator, vocabMap=None):
         # VocabMap에 없을 문자, Unknown Character
@@ -141,16 +385,24 @@ class BioEncoder(tfds.features.text.TextEncoder):
         # 있으면: 그것으로 한다.
         else:
             self._vocabMap = vocabMap
+        # 디코딩용 역방향 표: id -> BIO Tag
+        self._idToTag = _inverseTable(self._vocabMap, self._UNK)
     
     def buildVocab(self, bioGenerator):
-        # 모든 BIO Tag를 취합하여 번호를 매기자.
-        vocabSet = set()
+        # 모든 BIO Tag를 세어서 자주 나온 것부터 번호를 매기자.
+        counter = Counter()
         for tagArray in bioGenerator:
-            vocabSet.update(tagArray)
-        vocabMap = dict( zip(vocabSet, range(2, len(vocabSet)+2)) )
-        vocabMap[self._UNK] = 1
-        return vocabMap
+            counter.update(tagArray)
+        return _vocabFrom( _frequencyOrdered(counter), self._UNK )
         # 1번: UNK
+
+    def extended(self, bioGenerator):
+        '''처음 보는 BIO Tag들을 자주 나온 것부터 뒤쪽 번호로 더한 새 인코더. 있던 번호는 그대로이다.'''
+        counter = Counter()
+        for tagArray in bioGenerator:
+            counter.update(tagArray)
+        vocabMap, _ = _extendedVocab(self._vocabMap, counter)
+        return self.__class__(None, vocabMap=vocabMap)
     
     def encode(self, ss):
         '''BIO Tag 배열 ss를 id 배열로...'''
@@ -163,16 +415,19 @@ class BioEncoder(tfds.features.text.TextEncoder):
         return ids
 
     def decode(self, ids):
-        '''ids였던 것이 BIO Tag 문자열의 배열로 회귀'''
-        vm = self._vocabMap
-        ss = []
-        for id in ids:
-            find = [k for k, i in vm.items() if i == id]
-            if len(find) == 0 : # 없는 id
-                raise IndexError('Unavailable Intent ID.')
-            tag = find[0]
-            ss.append(tag)
-        return ss
+        '''ids였던 것이 BIO Tag 문자열의 배열로 회귀. 없는 id는 UNK.'''
+        return _takeLabels(self._idToTag, ids).tolist()
+
+    def decodeBatch(self, idMatrix, lengths=None):
+        '''
+        [배치, 길이] id 행렬idMatrix를 한꺼번에 BIO Tag 배열들의 리스트로.
+        lengths를 주면 행마다 앞쪽 Padding(padding='pre')을 떼고 끝의 lengths[행]개만 남긴다.
+        '''
+        tags = _takeLabels(self._idToTag, idMatrix)
+        if lengths is None:
+            return tags.tolist()
+        width = tags.shape[1]
+        return [ tags[row, width-length:].tolist() for row, length in enumerate(lengths) ]
             
     @property
     def vocab_size(self):
@@ -197,4 +452,11 @@ class BioEncoder(tfds.features.text.TextEncoder):
         if mySetupLoaded['encoderClass'] != cls.__name__:
             raise TypeError('Wrong encoder class.')
         # vocabMap을 갖춘 인코더를 만든다.
-        return cls(None, vocabMap=mySetupLoaded['vocabMap'])
\ No newline at end of file
+        return cls(None, vocabMap=mySetupLoaded['vocabMap'])
+
+    def toArrays(self):
+        return _labelsToArrays(self._vocabMap)
+
+    @classmethod
+    def fromArrays(cls, arrays):
+        return cls(None, vocabMap=_labelsFromArrays(arrays))
@@ -0,0 +1,54 @@
+'''
+TFLite inference engine for the quantized NLU models
+'''
+
+import threading
+
+def _interpreterClass():
+    # 서버에는 가벼운 tflite_runtime만 깔아도 된다. 없으면 TensorFlow의 것을 쓴다.
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+class TfliteModel:
+    '''
+    nlu.export.exportTflite로 내보낸 모델을 TFLite 인터프리터로 돌린다.
+    입력 모양이 바뀔 때만 텐서를 다시 잡는다(resize_tensor_input).
+    인터프리터는 스레드에 안전하지 않으므로 한 번에 하나씩만 돌린다.
+    출력이 여럿인 모델(결합 모델)이면 내보낼 때의 순서대로 출력마다의 예측값 리스트를 돌려준다.
+    '''
+
+    def __init__(self, interpreter):
+        self._interpreter = interpreter
+        self._input = interpreter.get_input_details()[0]['index']
+        self._outputs = [ d['index'] for d in sorted(
+            interpreter.get_output_details(), key=_outputOrder ) ]
+        self._shape = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def loadFromFile(cls, fname):
+        return cls( _interpreterClass()(model_path=fname) )
+
+    def predict(self, X):
+        '''[배치, 길이] int32 행렬 X의 예측값 (Keras model.predict와 같은 모양)'''
+        with self._lock:
+            if X.shape != self._shape:
+                self._interpreter.resize_tensor_input(self._input, X.shape)
+                self._interpreter.allocate_tensors()
+                self._shape = X.shape
+            self._interpreter.set_tensor(self._input, X)
+            self._interpreter.invoke()
+            if len(self._outputs) == 1:
+                return self._interpreter.get_tensor(self._outputs[0])
+            return [ self._interpreter.get_tensor(i) for i in self._outputs ]
+
+def _outputOrder(details):
+    # 변환기는 k번째 출력을 'Identity_k'(첫 번째는 'Identity')로 이름 짓는다.
+    # 인터프리터가 알려주는 순서는 보장되지 않으므로 이름으로 정렬한다.
+    name = details['name']
+    suffix = name.rsplit('_', 1)[-1] if '_' in name else ''
+    return int(suffix) if suffix.isdigit() else 0
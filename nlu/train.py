@@ -6,19 +6,36 @@ Training Natural Language Understanding (NLU)
 2019
 '''
 
-import pandas as pd
+from nlu.dataset import DatasetCache, Dataset
+from nlu.export import exportSavedModel, savedModelDir, exportNumpyWeights, numpyWeightsFile
+from nlu.export import exportTflite, tfliteFile, tfliteReport, tfliteReportFile
+from nlu.export import importNumpyWeights
+from nlu.buckets import chooseBuckets, saveBuckets
+from nlu.pipeline import trainingPipeline
+from nlu.predict import configureThreads
 from nlu.mapper import Mapper
-from nlu.util import RawTextParser #ER에서 bioTags를 뽑아내기 위함
+from nlu.exact_index import ExactIndex
+from nlu.incremental import newRowMask, unseenRowMask, fineTuneRows
+from nlu.incremental import heldOutKeys, saveHeldOut, loadHeldOut, splitKeepingHeldOut
+from nlu.util import parseRawtable
 import os
-import numpy as np
-from nlu.read_excel import convertXlsxToText
+import re
+import json
+import time
+import hashlib
+import inspect
+import shutil
+import traceback
+import multiprocessing
+from queue import Empty
+from nlu.ingest import readWorkbookTable, sheetKeys
 # 당분간 Import error는 무시 가능
 # https://github.com/microsoft/vscode-python/issues/7390
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 from tensorflow.keras.layers import Embedding, Dense, LSTM
-from tensorflow.keras.layers import Bidirectional, TimeDistributed
-from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import Bidirectional, GlobalAveragePooling1D, Input
+from tensorflow.keras.models import Sequential, Model
 from tensorflow.keras.utils import to_categorical
+from tensorflow.keras.callbacks import LambdaCallback
 
 DATA_ROOT = os.path.abspath( os.path.join(
     os.path.dirname(__file__), '..', 'data'
@@ -26,16 +43,39 @@ DATA_ROOT = os.path.abspath( os.path.join(
 MODEL_ROOT = os.path.abspath( os.path.join(
     os.path.dirname(__file__), '..', 'model'
     ) )
+BUILD_FILE = 'build.json'
+# 병렬 학습에서 각 프로세스가 맡는 모델
+TASKS = ('intentClassifier', 'entityRecognizer')
+# 모델 구조
+#   separate: 의도분석과 개체명인식 모델을 따로 둔다. 각자 Embedding과 LSTM을 갖는다.
+#   joint: Embedding과 양방향 LSTM 인코더를 함께 쓰고 출력만 둘인 결합 모델 하나 (Trainer.jointModel)
+ARCHITECTURES = ('separate', 'joint')
+# 학습 방법만 바꾸고 만들어지는 모델에는 영향이 없는 train의 인자들. 지문(fingerprint)에 넣지 않는다.
+_RUN_ONLY_OPTIONS = ('self', 'parallel', 'compare')
+
+class TrainingError(RuntimeError):
+    '''병렬 학습의 한 프로세스가 실패했다. 모델 디렉토리는 그대로 남아 있다.'''
 
 class Trainer:
 
-    def __init__(self, domain, verbose=False):
+    def __init__(self, domain, verbose=False, log=None):
+        '''
+        Args:
+            log: 진행 상황 한 줄을 받을 함수. 없으면 화면에 찍는다.
+                있으면 Keras도 진행 막대 대신 에포크마다 한 줄씩 이것으로 알린다.
+        '''
         self._domain = domain
         self._verbose = verbose
+        self._log = log
+        # 학습하는 동안 모든 파일을 쓰는 임시 디렉토리 (train 참고)
+        self._outputDir = None
 
     def vv(self, str):
         if self._verbose:
-            print("[TRAINER]", str)
+            if self._log is not None:
+                self._log(str)
+            else:
+                print("[TRAINER]", str)
 
     def rawFile(self):
         '''raw.txt의 주소'''
@@ -45,21 +85,101 @@ class Trainer:
         '''raw.xlsx의 주소'''
         return os.path.join(DATA_ROOT, self._domain, 'raw.xlsx')
 
+    def ingestCacheDir(self):
+        '''raw.xlsx를 시트마다 읽어 둔 캐시의 디렉토리 주소 (nlu.ingest)'''
+        return os.path.join(DATA_ROOT, self._domain, '.ingest_cache')
+
+    def datasetCacheDir(self):
+        '''인코딩하고 Padding한 학습 배열들의 캐시 디렉토리 주소 (nlu.dataset)'''
+        return os.path.join(DATA_ROOT, self._domain, '.dataset_cache')
+
+    def modelDomainDir(self):
+        '''모델 파일들을 쓸 디렉토리. 학습 중에는 임시 디렉토리이다.'''
+        if self._outputDir is not None:
+            return self._outputDir
+        return os.path.join(MODEL_ROOT, self._domain)
+
+    def publishedPath(self, path):
+        '''학습 중인 임시 디렉토리 안의 주소path에 해당하는, 지금 쓰이고 있는 모델 디렉토리 안의 주소'''
+        return os.path.join(
+            MODEL_ROOT, self._domain, os.path.relpath(path, self.modelDomainDir()) )
+
+    def stagingDir(self):
+        '''학습하는 동안 쓰는 임시 디렉토리 주소. 다 쓰고 나면 모델 디렉토리와 바꿔 끼운다.'''
+        return os.path.join(MODEL_ROOT, '.{}.staging{}'.format(self._domain, os.getpid()))
+
     def mapperDir(self):
         '''매퍼 설정값(*.vocab)이 있어야 할 주소'''
-        return os.path.join(MODEL_ROOT, self._domain, 'mapper')
+        return os.path.join(self.modelDomainDir(), 'mapper')
 
     def icModelFile(self):
         '''의도분석(Intent Classifier)모델의 HDF5파일 주소'''
-        return os.path.join(MODEL_ROOT, self._domain, 'intent_classifier.h5')
+        return os.path.join(self.modelDomainDir(), 'intent_classifier.h5')
 
     def erModelFile(self):
         '''개체명인식(Entity Recognizer)모델의 HDF5파일 주소'''
-        return os.path.join(MODEL_ROOT, self._domain, 'entity_recognizer.h5')
+        return os.path.join(self.modelDomainDir(), 'entity_recognizer.h5')
+
+    def jointModelFile(self):
+        '''의도분석과 개체명인식을 함께 하는 결합(Joint) 모델의 HDF5파일 주소'''
+        return os.path.join(self.modelDomainDir(), 'joint_model.h5')
+
+    def exactIndexFile(self):
+        '''학습 데이터 완전일치 색인 파일 주소'''
+        return os.path.join(self.modelDomainDir(), 'exact_index.json')
+
+    def bucketsFile(self):
+        '''추론 때 쓸 길이 버킷 경계 파일 주소'''
+        return os.path.join(self.modelDomainDir(), 'buckets.json')
+
+    def heldOutFile(self):
+        '''Test set 행들의 열쇠 파일 주소. 이어서 학습할 때 같은 행들로 검증하려고 둔다.'''
+        return os.path.join(self.modelDomainDir(), 'held_out.json')
+
+    def buildFile(self):
+        '''학습이 모두 끝났음을 알리는 파일 주소. 서버는 이것이 바뀌면 모델을 다시 불러온다.'''
+        return os.path.join(self.modelDomainDir(), BUILD_FILE)
+
+    def trainOptions(self, **trainArgs):
+        '''
+        train에 넘길 인자들trainArgs에 기본값을 채운 것({인자 이름: 값}).
+        만들어지는 모델에 영향이 없는 인자들(parallel, compare)은 뺀다.
+        '''
+        bound = inspect.signature(self.train).bind(**trainArgs)
+        bound.apply_defaults()
+        return { name: value for name, value in bound.arguments.items()
+            if name not in _RUN_ONLY_OPTIONS }
+
+    def fingerprint(self, options):
+        '''
+        학습 데이터(raw.xlsx 시트마다의 내용 해시, nlu.ingest.sheetKeys)와 학습 조건options(trainOptions)의 해시.
+        build.json에 적어 두어, 둘 다 그대로인 도메인은 다시 학습하지 않을 수 있게 한다. (isUpToDate)
+        '''
+        h = hashlib.sha1()
+        h.update(json.dumps({
+            'sheets': sheetKeys(self.rawExcelFile()),
+            'options': options,
+        }, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def buildStamp(self):
+        '''모델 디렉토리의 build.json 내용. 없거나 읽을 수 없으면 None.'''
+        try:
+            with open(self.buildFile(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def isUpToDate(self, **trainArgs):
+        '''마지막으로 성공한 학습이 지금의 데이터와 같은 인자들trainArgs로 한 것인지'''
+        stamp = self.buildStamp()
+        if stamp is None or 'fingerprint' not in stamp:
+            return False
+        return stamp['fingerprint'] == self.fingerprint(self.trainOptions(**trainArgs))
 
     def readyModelDir(self):
         '''모델 디렉토리가 없으면 만듦.'''
-        MODEL_DOMAIN_DIR = os.path.join(MODEL_ROOT, self._domain)
+        MODEL_DOMAIN_DIR = self.modelDomainDir()
         if not os.path.exists(MODEL_DOMAIN_DIR):
             self.vv("No such directory for a model. creating...")
             self.vv(MODEL_DOMAIN_DIR)
@@ -73,169 +193,704 @@ class Trainer:
 
     def train(self,
         testRatio=0.2, paddedLen=40, wordEmbOutputDim=64,
-        lstmUnits=128, epochsIC=10, epochsER=5, batchSize=60 ):
+        lstmUnits=128, epochsIC=10, epochsER=5, batchSize=60,
+        quantization=None, calibrationSize=200,
+        vocabMinCount=1, vocabMaxSize=None, parallel=False,
+        architecture='separate', compare=False, incremental=False, replayRatio=2.0 ):
         '''
         주어진 데이터로 NLU서버가 Predication을 할 수 있는 상태를 만든다.
         즉, 매퍼(Mapper)와 모델(Model)이 준비되게 한다.
+        모든 파일은 임시 디렉토리(stagingDir)에 쓰고, 다 되었을 때에만 모델 디렉토리와 바꿔 끼운다.
+        도중에 실패하면 임시 디렉토리를 지우므로 모델 디렉토리는 예전 그대로 남는다.
         
         Args:
             testRatio: 전체 데이터에서 Test set이 차지할 비율
-            paddedLen: Training 시 Padding 상태 최대 길이
+            paddedLen: 검증·내보내기(양자화 보정 등)에 쓰는 고정 길이 배열의 너비. 학습 자체는 자르지 않는다.
             wordEmbOutputDim: Word Embedding의 벡터 출력 길이
             lstmUnits: LSTM 레이어의 유닛 수
             epochsIC: Training Intent Classifier 수행 에포크 수
             epochsER: Training Entity Recognizer 수행 에포크 수
             batchSize: Training Batch Size
+            quantization: 학습 뒤 TFLite로 양자화해 내보낼 방법(nlu.export.QUANTIZATIONS). 없으면 안 한다.
+            calibrationSize: int8 양자화 보정에 쓸 Train set 문장 수
+            vocabMinCount: 이보다 적게 나온 글자는 글자 사전에 넣지 않는다(UNK가 됨).
+            vocabMaxSize: 글자 사전의 최대 글자 수. 자주 나온 것부터 넣는다.
+            parallel: 두 모델을 CPU 코어를 나눠 가진 두 프로세스에서 함께 학습한다. (trainInParallel 참고)
+            architecture: 모델 구조(ARCHITECTURES). joint이면 결합 모델 하나를 max(epochsIC, epochsER) 에포크 학습한다.
+            compare: 다른 구조도 같은 Train/Test set으로 학습해 정확도를 견주고 build.json에 적는다.
+            incremental: 지금의 매퍼와 모델에서 이어서 학습한다. 매퍼에는 처음 보는 글자, 의도, BIO 태그만
+                뒤쪽 번호로 더하고(있던 ID는 그대로), 모델은 Embedding과 출력 층만 그만큼 늘려 예전 가중치에서 시작한다.
+                새로 더해지거나 주석이 바뀐 행들(nlu.incremental.newRowMask)과
+                예전 행들 중 무작위로 고른 일부(replay)만으로 학습한다. 지금의 모델이 없으면 처음부터 학습한다.
+                Test set은 예전 Test set의 행들과, 텍스트가 처음 보는 행들 중 testRatio만큼이다. (held_out.json, splitKeepingHeldOut)
+                즉 지금까지의 어느 모델도 학습하지 않은 행들로만 검증한다.
+            replayRatio: incremental일 때 섞어 넣을 예전 행 수. 새 행 수의 이만큼 배.
+        결과: build.json에 쓴 내용
         '''
+        if architecture not in ARCHITECTURES:
+            raise ValueError('Unknown architecture: {}'.format(architecture))
+        if parallel and architecture == 'joint':
+            raise ValueError('The joint model is a single model and cannot be trained in parallel.')
+        previous = None
+        if incremental:
+            if parallel or compare:
+                raise ValueError('Incremental training supports neither parallel nor compare.')
+            # 지금 쓰이고 있는 모델의 build.json (임시 디렉토리로 바꾸기 전에 읽는다)
+            previous = self.buildStamp()
+            if previous is None:
+                self.vv('No model to continue from. Training from scratch.')
+            elif previous.get('architecture', 'separate') != architecture:
+                raise ValueError('The model of {} has the {} architecture, not {}.'.format(
+                    self._domain, previous.get('architecture', 'separate'), architecture ))
+        options = self.trainOptions(
+            testRatio=testRatio, paddedLen=paddedLen, wordEmbOutputDim=wordEmbOutputDim,
+            lstmUnits=lstmUnits, epochsIC=epochsIC, epochsER=epochsER, batchSize=batchSize,
+            quantization=quantization, calibrationSize=calibrationSize,
+            vocabMinCount=vocabMinCount, vocabMaxSize=vocabMaxSize, architecture=architecture,
+            incremental=incremental, replayRatio=replayRatio )
+        staging = self.stagingDir()
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        self._outputDir = staging
+        try:
+            stamp = self._train(
+                testRatio, paddedLen, wordEmbOutputDim, lstmUnits,
+                epochsIC, epochsER, batchSize, quantization, calibrationSize,
+                vocabMinCount, vocabMaxSize, parallel, architecture, compare, options,
+                previous, replayRatio )
+        except BaseException:
+            self.vv('Training failed. The model directory is left as it was.')
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            self._outputDir = None
+        self.publish(staging)
+        return stamp
+
+    def _train(self,
+        testRatio, paddedLen, wordEmbOutputDim, lstmUnits,
+        epochsIC, epochsER, batchSize, quantization, calibrationSize,
+        vocabMinCount, vocabMaxSize, parallel, architecture, compare, options,
+        previous=None, replayRatio=2.0 ):
         # ---------전처리 과정------------
-        # raw.xlsx 엑셀파일을 읽고 raw.txt파일로 다시 쓰기
-        self.vv('Reading the excel file and converting it: ')
+        # raw.xlsx 엑셀파일을 바로 표로 읽기. 지난번과 내용이 같은 시트는 캐시에서 읽는다.
+        self.vv('Reading the excel file: ')
         self.vv(self.rawExcelFile())
         try:
-            convertXlsxToText( self.rawExcelFile(), self.rawFile() )
+            # 읽기 전에 재야 읽는 사이에 바뀐 내용을 놓치지 않는다.
+            fingerprint = self.fingerprint(options)
+            rawtable, ingestReport = readWorkbookTable(
+                self.rawExcelFile(), self.ingestCacheDir() )
         except FileNotFoundError:
             self.vv(
                 'ERROR - Could not find the excel file for \'{}\'. Did you forget?'
                 .format(self._domain) )
             raise
-        
-        # raw.txt 읽기
-        self.vv('Reading the raw file: ')
-        self.vv(self.rawFile())
-        rawtable = pd.read_table(self.rawFile()) #읽기
-        rawtable = rawtable.sample(frac=1).reset_index(drop=True) #섞기
-        self.vv("{}".format(rawtable))
+        self.vv('{} sheets: {} from the cache, re-read {}'.format(
+            ingestReport['sheets'], ingestReport['cached'], ingestReport['read'] ))
+
+        if previous is None:
+            # 파싱·ID매핑·Padding한 배열들. 데이터와 조건이 지난번과 같으면 캐시에서 바로 불러온다.
+            self.vv('Preparing the encoded dataset: ')
+            self.vv(self.datasetCacheDir())
+            dataset, cached = DatasetCache(self.datasetCacheDir()).get(
+                rawtable, paddedLen, vocabMinCount, vocabMaxSize )
+            self.vv('{} the dataset of {} rows: {}'.format(
+                'Loaded' if cached else 'Built', len(dataset), dataset.info['key'] ))
+        else:
+            # 이어서 학습: 지금의 매퍼에 처음 보는 것들만 더한 매퍼로 인코딩한다. (캐시하지 않음)
+            rawtable = parseRawtable(rawtable)
+            self.vv('Extending the mapper: ')
+            self.vv(self.publishedPath(self.mapperDir()))
+            mapper, added = Mapper.loadFromFile(self.publishedPath(self.mapperDir())).extendedWith(
+                rawtable, vocabMinCount, vocabMaxSize )
+            self.vv('Added {} chars, intents {}, tags {}'.format(
+                added['chars'], added['intents'], added['tags'] ))
+            dataset = Dataset.build(
+                rawtable, paddedLen, vocabMinCount, vocabMaxSize,
+                mapper=mapper, extends=previous.get('fingerprint') )
+            self.vv('Built the dataset of {} rows: {}'.format(len(dataset), dataset.info['key']))
 
         # 해당 Domain의 Model 디렉토리가 준비되었는지 검사한다. 없으면 만든다.
         self.readyModelDir()
         
-        # 매퍼를 준비한다. NLU서버에게 모델과 함께 필요한 것이기도 하다.
-        self.vv('Building a mapper for the data.')
-        mapper = Mapper.buildFromRawtable(rawtable)
+        # 매퍼: 데이터셋을 만든 그것이다. NLU서버에게 모델과 함께 필요한 것이기도 하다.
+        mapper = dataset.mapper
+        vocabReport = dataset.info['textVocab']
+        self.vv('Text vocab: {} of {} chars, coverage {:.4%}'.format(
+            vocabReport['vocabSize'], vocabReport['seenChars'], vocabReport['coverage'] ))
         # 저장: 매퍼.
         self.vv('The mapper is saved: ')
         self.vv(self.mapperDir())
         mapper.saveToFile(self.mapperDir())
 
-        # train/test 분리
+        # 학습 문장 그대로의 질의에는 모델 없이 답할 수 있도록 완전일치 색인을 둔다.
+        exactIndex = dataset.exactIndex
+        self.vv('The exact-match index ({} texts) is saved: '.format(len(exactIndex)))
+        self.vv(self.exactIndexFile())
+        exactIndex.saveToFile(self.exactIndexFile())
+
+        # 추론 때 쓸 길이 버킷을 텍스트 길이 분포에서 고른다.
+        buckets = chooseBuckets(dataset.lengths)
+        self.vv('Length buckets for inference = {}'.format(buckets))
+        saveBuckets(self.bucketsFile(), buckets)
+
+        # train/test 분리. 섞은 순서는 데이터셋에 저장되어 있어 캐시가 같으면 언제나 같게 나뉜다.
+        # 이어서 학습할 때는 예전 모델들이 학습한 행이 Test set에 들어가지 않게 나눈다.
         self.vv('Splitting the data into train/test.')
-        testSize = int(len(rawtable)*testRatio)
-        testTable = rawtable[:testSize]
-        trainTable = rawtable[testSize:]
-        self.vv( 'Train table size = {}'.format(len(trainTable)) )
-        self.vv( 'Test table size = {}'.format(len(testTable)) )
+        if previous is None:
+            trainRows, testRows = dataset.split(testRatio)
+        else:
+            previousIndex = ExactIndex.loadFromFile(self.publishedPath(self.exactIndexFile()))
+            isNew = newRowMask(rawtable, previousIndex)
+            heldOut = loadHeldOut(self.publishedPath(self.heldOutFile()))
+            if heldOut is None:
+                self.vv('No held-out rows of the previous model. Validating on new rows only.')
+            trainRows, testRows, numHeldOut = splitKeepingHeldOut(
+                rawtable, dataset.order, unseenRowMask(rawtable, previousIndex), heldOut, testRatio )
+            if len(testRows) == 0:
+                raise ValueError('No rows to validate on that the previous models have not trained on. '
+                    'Train {} from scratch.'.format(self._domain))
+        self.vv( 'Train set size = {}'.format(len(trainRows)) )
+        self.vv( 'Test set size = {}'.format(len(testRows)) )
+        saveHeldOut(self.heldOutFile(), heldOutKeys(rawtable, testRows))
+
+        # 이어서 학습: 새 행들과 예전 행들 일부만으로, 지금의 모델 가중치(*.npz)에서 시작한다.
+        incrementalReport = None
+        initialWeights = lambda h5File: None
+        if previous is not None:
+            fineTuneRowList, numNew, numReplay = fineTuneRows(trainRows, isNew, replayRatio)
+            if numNew == 0:
+                # 학습하지 않고 검증만 한다. (int8 보정은 Train set 전체에서)
+                self.vv('No new rows. Only validating the current models.')
+                epochsIC = epochsER = 0
+            else:
+                trainRows = fineTuneRowList
+                self.vv( 'Fine-tuning on {} new and {} replayed rows'.format(numNew, numReplay) )
+            incrementalReport = {
+                'extends': previous.get('fingerprint'),
+                'addedChars': added['chars'],
+                'addedIntents': added['intents'],
+                'addedTags': added['tags'],
+                'newRows': numNew,
+                'replayRows': numReplay,
+                'heldOutRows': numHeldOut,
+                'newTestRows': len(testRows) - numHeldOut,
+            }
+            initialWeights = lambda h5File: self.publishedPath(numpyWeightsFile(h5File))
         
         # --------------------------------
         
         # Training and validation...
-        self.vv('Starting to train Intent Classifier...')
-        self.trainIntentClassifier(
-            trainTable, testTable, mapper,
-            paddedLen, wordEmbOutputDim, lstmUnits,
-            epochsIC, batchSize,
-            self.icModelFile() )
-        self.vv('Starting to train Entity Recognizer...')
-        self.trainEntityRecognizer(
-            trainTable, testTable, mapper,
-            paddedLen, wordEmbOutputDim, lstmUnits,
-            epochsER, batchSize,
-            self.erModelFile() )
-            
+        icOptions = (wordEmbOutputDim, lstmUnits, epochsIC, batchSize)
+        erOptions = (wordEmbOutputDim, lstmUnits, epochsER, batchSize)
+        jointOptions = (wordEmbOutputDim, lstmUnits, max(epochsIC, epochsER), batchSize)
+        if architecture == 'joint':
+            self.vv('Starting to train the joint model...')
+            metrics = {'joint': self.trainJointModel(
+                dataset, trainRows, testRows, buckets,
+                *jointOptions,
+                self.jointModelFile(),
+                quantization, calibrationSize,
+                initialWeights(self.jointModelFile()) )}
+        elif parallel:
+            metrics = self.trainInParallel(
+                self.datasetCacheDir(), dataset.info['key'], testRatio, buckets,
+                icOptions, erOptions, quantization, calibrationSize )
+        else:
+            self.vv('Starting to train Intent Classifier...')
+            icMetrics = self.trainIntentClassifier(
+                dataset, trainRows, testRows, buckets,
+                *icOptions,
+                self.icModelFile(),
+                quantization, calibrationSize,
+                initialWeights(self.icModelFile()) )
+            self.vv('Starting to train Entity Recognizer...')
+            erMetrics = self.trainEntityRecognizer(
+                dataset, trainRows, testRows, buckets,
+                *erOptions,
+                self.erModelFile(),
+                quantization, calibrationSize,
+                initialWeights(self.erModelFile()) )
+            metrics = {'intentClassifier': icMetrics, 'entityRecognizer': erMetrics}
+
+        stamp = {
+            'textVocab': vocabReport,
+            'architecture': architecture,
+            'parallel': parallel,
+            'metrics': metrics,
+            'options': options,
+            'fingerprint': fingerprint,
+            'incremental': incrementalReport,
+        }
+        if compare:
+            stamp['comparison'] = self.compareArchitectures(
+                dataset, trainRows, testRows, buckets, architecture, metrics,
+                icOptions, erOptions, jointOptions )
+
+        # 모든 파일이 갖춰졌음을 마지막에 알린다.
+        self.vv('Writing the build stamp: ')
+        self.vv(self.buildFile())
+        return self.writeBuildStamp(stamp)
+
+    def compareArchitectures(self,
+        dataset, trainRows, testRows, buckets, architecture, metrics,
+        icOptions, erOptions, jointOptions ):
+        '''
+        학습한 구조architecture(그 결과 metrics)와 견주려고 다른 구조도 같은 Train/Test set으로 학습한다.
+        견주기만 하므로 다른 구조의 모델은 저장하지 않는다.
+        결과: {구조: {'intentAccuracy', 'entityAccuracy', 'params': 가중치 수, 'trainSeconds'}}
+            separate의 params와 trainSeconds는 두 모델의 합이다.
+        '''
+        other = 'joint' if architecture == 'separate' else 'separate'
+        self.vv('Training the {} architecture for comparison...'.format(other))
+        mapper = dataset.mapper
+
+        def fit(model, target, epochs, batchSize):
+            trainData = trainingPipeline(dataset, trainRows, target, batchSize, buckets)
+            testData  = trainingPipeline(dataset, testRows , target, batchSize, buckets, shuffle=False)
+            return self.fitAndValidate(model, trainData, testData, epochs)
+
+        wordEmbOutputDim, lstmUnits, epochs, batchSize = jointOptions
+        if other == 'joint':
+            otherMetrics = {'joint': fit(
+                self.jointModel(mapper, wordEmbOutputDim, lstmUnits), 'joint', epochs, batchSize )}
+        else:
+            wordEmbOutputDim, lstmUnits, epochsIC, batchSize = icOptions
+            icMetrics = fit(
+                self.intentClassifierModel(mapper, wordEmbOutputDim, lstmUnits),
+                'intent', epochsIC, batchSize )
+            wordEmbOutputDim, lstmUnits, epochsER, batchSize = erOptions
+            erMetrics = fit(
+                self.entityRecognizerModel(mapper, wordEmbOutputDim, lstmUnits),
+                'bio', epochsER, batchSize )
+            otherMetrics = {'intentClassifier': icMetrics, 'entityRecognizer': erMetrics}
+
+        comparison = {
+            architecture: metricsSummary(metrics),
+            other: metricsSummary(otherMetrics),
+        }
+        for name in ARCHITECTURES:
+            summary = comparison[name]
+            self.vv('{}: intent accuracy {:.4f}, entity accuracy {:.4f}, {} params, {:.1f}s'.format(
+                name, summary['intentAccuracy'], summary['entityAccuracy'],
+                summary['params'], summary['trainSeconds'] ))
+        return comparison
+
+    def publish(self, staging):
+        '''
+        다 쓴 임시 디렉토리staging을 모델 디렉토리로 바꿔 끼운다.
+        모델 디렉토리 MODEL_ROOT/<domain>은 학습마다 새로 만드는 버전 디렉토리(.<domain>.build<시각>-<pid>)를
+        가리키는 심볼릭 링크이다. 새 링크를 옆에 만든 뒤 os.replace로 덮어쓰므로,
+        어느 때에 보아도(도중에 죽어도) 온전한 모델 디렉토리가 있다.
+        바로 앞 버전은 그것을 불러오던 중인 서버를 위해 남겨 두고, 그보다 오래된 버전들은 지운다.
+        '''
+        target = self.modelDomainDir()
+        self.vv('Publishing the new model directory: ')
+        self.vv(target)
+        stamp = int(time.time() * 1000)
+        while True:
+            versionName = '.{}.build{}-{}'.format(self._domain, stamp, os.getpid())
+            if not os.path.lexists(os.path.join(MODEL_ROOT, versionName)):
+                break
+            stamp += 1
+        os.replace(staging, os.path.join(MODEL_ROOT, versionName))
+        previousName = None
+        if os.path.islink(target):
+            previousName = os.path.basename(os.readlink(target))
+        elif os.path.isdir(target):
+            # 링크가 아닌 예전 방식의 모델 디렉토리: 처음 한 번만, 버전 디렉토리로 옮긴다.
+            # (디렉토리는 링크로 덮어쓸 수 없으므로 이때만 잠깐 모델 디렉토리가 없다.)
+            previousName = '.{}.build0-{}'.format(self._domain, os.getpid())
+            os.replace(target, os.path.join(MODEL_ROOT, previousName))
+        link = os.path.join(MODEL_ROOT, '.{}.link{}'.format(self._domain, os.getpid()))
+        if os.path.lexists(link):
+            os.remove(link)
+        # 상대 경로로 가리켜야 MODEL_ROOT를 옮겨도 그대로 쓸 수 있다.
+        os.symlink(versionName, link)
+        os.replace(link, target)
+        self.pruneVersions(keep=(versionName, previousName))
+
+    def pruneVersions(self, keep=()):
+        '''이 도메인의 버전 디렉토리들 중 keep에 든 이름의 것들만 남기고 지운다.'''
+        pattern = re.compile(r'^\.{}\.build\d+-\d+$'.format(re.escape(self._domain)))
+        for name in os.listdir(MODEL_ROOT):
+            if pattern.match(name) and name not in keep:
+                self.vv('Removing an old model version: {}'.format(name))
+                shutil.rmtree(os.path.join(MODEL_ROOT, name), ignore_errors=True)
+
+    def trainInParallel(self,
+        datasetCacheDir, datasetKey, testRatio, buckets,
+        icOptions, erOptions, quantization=None, calibrationSize=200 ):
+        '''
+        두 모델을 따로 띄운(spawn) 프로세스에서 함께 학습한다.
+        이 프로세스가 쓸 수 있는 CPU 코어들을 둘로 나눠 프로세스마다 묶고(affinity),
+        TensorFlow 연산 스레드 수도 그 코어 수에 맞춘다.
+        두 프로세스는 캐시된 데이터셋(datasetKey)을 메모리맵해서 함께 읽고, 임시 디렉토리에 모델을 쓴다.
+        진행 상황과 결과(metrics)는 큐로 이 프로세스에 모인다.
+        하나라도 실패하면 다른 하나도 멈추고 TrainingError.
+        결과: {'intentClassifier': metrics, 'entityRecognizer': metrics}
+        '''
+        datasetDir = DatasetCache(datasetCacheDir).entryDir(datasetKey)
+        cores = _partitionCores(len(TASKS))
+        options = {
+            'intentClassifier': (icOptions, self.icModelFile()),
+            'entityRecognizer': (erOptions, self.erModelFile()),
+        }
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        processes = {}
+        for task, taskCores in zip(TASKS, cores):
+            taskOptions, modelFile = options[task]
+            processes[task] = context.Process(
+                target=_trainTask, name='nlu-train-{}'.format(task),
+                args=(
+                    self._domain, self._verbose, self.modelDomainDir(), task,
+                    datasetDir, datasetKey, testRatio, buckets,
+                    taskOptions, modelFile, quantization, calibrationSize,
+                    taskCores, queue ) )
+        results = {}
+        try:
+            for task, process in processes.items():
+                process.start()
+                self.vv('Training {} in pid {} on cores {}'.format(
+                    task, process.pid, cores[TASKS.index(task)] or 'any' ))
+            while len(results) < len(processes):
+                try:
+                    kind, task, payload = queue.get(timeout=1.0)
+                except Empty:
+                    # 결과를 보내지 못하고 죽은 프로세스 (메모리 부족으로 죽임을 당한 때 등)
+                    for task, process in processes.items():
+                        if task not in results and process.exitcode not in (None, 0):
+                            raise TrainingError('Training {} exited with code {}.'.format(
+                                task, process.exitcode ))
+                    continue
+                if kind == 'log':
+                    if self._verbose:
+                        print("[TRAINER:{}]".format(task), payload)
+                elif kind == 'error':
+                    raise TrainingError('Training {} failed:\n{}'.format(task, payload))
+                else:
+                    results[task] = payload
+        finally:
+            for process in processes.values():
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        return results
+
+    def writeBuildStamp(self, info=None):
+        '''학습이 모두 끝났음을 알리는 build.json을 쓴다. info가 있으면 함께 적는다. 결과: 쓴 내용'''
+        stamp = {
+            'domain': self._domain,
+            'builtAt': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        stamp.update(info or {})
+        with open(self.buildFile(), 'w') as f:
+            json.dump(stamp, f)
+        return stamp
         
 
+    def startFrom(self, model, initialWeights=None):
+        '''
+        이어서 학습할 때 모델model에 예전 모델의 NumPy 가중치 파일initialWeights를 싣는다.
+        매퍼가 늘어났으면 Embedding과 출력 층의 늘어난 자리만 새 초기값이다. (nlu.export.importNumpyWeights)
+        '''
+        if initialWeights is None:
+            return
+        self.vv('Starting from the weights: ')
+        self.vv(initialWeights)
+        importNumpyWeights(model, initialWeights)
+
+    def fitAndValidate(self, model, trainData, testData, epochs):
+        '''
+        모델을 학습하고 Test set에서 검증한다.
+        결과: {'accuracy', 'loss': Test set에서의 값, 'trainLoss': 에포크마다의 값, 'epochs', 'trainSeconds',
+            'params': 가중치 수}
+            출력이 여럿인 모델은 Test set에서의 값이 출력마다 따로 있다. 예) 'intent_accuracy', 'bio_loss'
+        '''
+        myVerbose = 0
+        if self._verbose: myVerbose = 1
+        callbacks = []
+        if self._log is not None:
+            # 진행 막대 대신 에포크마다 한 줄씩 log로 보낸다.
+            myVerbose = 0
+            callbacks.append(LambdaCallback(
+                on_epoch_end=lambda epoch, logs: self.vv('Epoch {}/{}: {}'.format(
+                    epoch+1, epochs,
+                    ', '.join( '{} {:.4f}'.format(k, v) for k, v in sorted(logs.items()) ) )) ))
+        started = time.time()
+        trainLoss = []
+        if epochs > 0:
+            history = model.fit(
+                trainData,
+                epochs=epochs,
+                verbose=myVerbose,
+                callbacks=callbacks )
+            trainLoss = history.history['loss']
+        trainSeconds = time.time() - started
+
+        # Validation
+        self.vv('Validation time...')
+        results = model.evaluate(testData, verbose=0, return_dict=True)
+        metrics = { name: float(value) for name, value in results.items() }
+        for name, value in sorted(metrics.items()):
+            if name.endswith('accuracy'):
+                self.vv( '%s: %.4f' % ('Accuracy' if name == 'accuracy' else name, value) )
+        metrics.update({
+            'trainLoss': [ float(v) for v in trainLoss ],
+            'epochs': epochs,
+            'trainSeconds': round(trainSeconds, 3),
+            'params': int(model.count_params()),
+        })
+        return metrics
+
     def trainIntentClassifier(self,
-        trainTable, testTable, mapper,
-        paddedLen, wordEmbOutputDim, lstmUnits,
+        dataset, trainRows, testRows, buckets,
+        wordEmbOutputDim, lstmUnits,
         epochsIC, batchSize,
-        fnICModel ):
-        # X_train, ...
-        X_train = [ mapper.mapTextIC(t ) for t  in trainTable['text'  ] ]
-        y_train = [ mapper.mapIntent(it) for it in trainTable['intent'] ]
-        X_test  = [ mapper.mapTextIC(t ) for t  in testTable ['text'  ] ]
-        y_test  = [ mapper.mapIntent(it) for it in testTable ['intent'] ]
-        # Keras에서 받아들일 수 있는 데이터 형식으로 조정.
-        X_train = pad_sequences(X_train, maxlen=paddedLen)
-        y_train = np.array(y_train)
-        X_test  = pad_sequences(X_test , maxlen=paddedLen)
-        y_test  = np.array(y_test)
-        
+        fnICModel,
+        quantization=None, calibrationSize=200, initialWeights=None ):
+        mapper = dataset.mapper
+        # 학습과 검증은 길이 버킷으로 묶은 tf.data 파이프라인으로 흘려 넣는다.
+        trainData = trainingPipeline(dataset, trainRows, 'intent', batchSize, buckets)
+        testData  = trainingPipeline(dataset, testRows , 'intent', batchSize, buckets, shuffle=False)
+        # 내보낸 모델의 확인과 양자화 보정에는 paddedLen 너비의 배열을 쓴다.
+        X_train = dataset.X[trainRows]
+        X_test  = dataset.X[testRows]
+        y_test  = dataset.yIntent[testRows]
+
+        model = self.intentClassifierModel(mapper, wordEmbOutputDim, lstmUnits)
+        self.startFrom(model, initialWeights)
+        # 시작.
+        metrics = self.fitAndValidate(model, trainData, testData, epochsIC)
+
+        # Saving
+        self.vv('Saving the intent classifier model: ')
+        self.vv(fnICModel)
+        model.save(fnICModel)
+        # 서버가 빨리 뜨도록 미리 trace된 SavedModel로도 내보낸다.
+        self.vv(savedModelDir(fnICModel))
+        exportSavedModel(model, savedModelDir(fnICModel))
+        # TensorFlow 없이 돌릴 수 있는 NumPy 가중치. 시험 데이터에서 출력이 같은지 확인한다.
+        self.vv(numpyWeightsFile(fnICModel))
+        exportNumpyWeights(model, numpyWeightsFile(fnICModel), X_test[:256])
+        if quantization:
+            metrics['tflite'] = self.exportQuantized(
+                model, fnICModel, quantization, X_train[:calibrationSize], X_test, y_test )
+        return metrics
+
+
+    def intentClassifierModel(self, mapper, wordEmbOutputDim, lstmUnits):
+        '''의도분석 모델 (컴파일한 것)'''
         wordEmbInputDim = mapper.textVocabSize() + 2
         outputUnits = mapper.maxIntentID() + 1
         # Keras Layer를 쌓는다.
         model = Sequential()
-        model.add(Embedding(wordEmbInputDim, wordEmbOutputDim))
+        # 0번(Padding)은 가린다: 배치마다 길이가 다르고, 채운 자리는 계산과 손실에서 빠진다.
+        model.add(Embedding(wordEmbInputDim, wordEmbOutputDim, mask_zero=True))
         model.add(LSTM(lstmUnits, activation='sigmoid'))
         model.add(Dense(outputUnits, activation='softmax'))
-
-        myVerbose = 0
-        if self._verbose: myVerbose = 1
-        # 시작.
         model.compile(
             optimizer='adam',
             loss='sparse_categorical_crossentropy',
             metrics=['accuracy'] )
-        model.fit(
-            X_train, y_train,
-            epochs=epochsIC,
-            batch_size=batchSize,
-            verbose=myVerbose )
+        return model
 
-        # Validation
-        self.vv('Validation time...')
-        self.vv( 'Accuracy: %.4f' % (model.evaluate(X_test, y_test, verbose=0)[1]) )
+    def trainEntityRecognizer(self,
+        dataset, trainRows, testRows, buckets,
+        wordEmbOutputDim, lstmUnits,
+        epochsER, batchSize,
+        fneERModel,
+        quantization=None, calibrationSize=200, initialWeights=None ):
+        mapper = dataset.mapper
+        trainData = trainingPipeline(dataset, trainRows, 'bio', batchSize, buckets)
+        testData  = trainingPipeline(dataset, testRows , 'bio', batchSize, buckets, shuffle=False)
+        X_train = dataset.X[trainRows]
+        X_test  = dataset.X[testRows]
+        y_test  = dataset.yBio[testRows]
 
-        # Saving
-        self.vv('Saving the intent classifier model: ')
-        self.vv(fnICModel)
-        model.save(fnICModel)
+        model = self.entityRecognizerModel(mapper, wordEmbOutputDim, lstmUnits)
+        self.startFrom(model, initialWeights)
+        # 시작.
+        metrics = self.fitAndValidate(model, trainData, testData, epochsER)
 
+        # Saving
+        self.vv('Saving the entity recognizer model: ')
+        self.vv(fneERModel)
+        model.save(fneERModel)
+        self.vv(savedModelDir(fneERModel))
+        exportSavedModel(model, savedModelDir(fneERModel))
+        self.vv(numpyWeightsFile(fneERModel))
+        exportNumpyWeights(model, numpyWeightsFile(fneERModel), X_test[:256])
+        if quantization:
+            metrics['tflite'] = self.exportQuantized(
+                model, fneERModel, quantization, X_train[:calibrationSize], X_test, y_test )
+        return metrics
 
-    def trainEntityRecognizer(self,
-        trainTable, testTable, mapper,
-        paddedLen, wordEmbOutputDim, lstmUnits,
-        epochsER, batchSize,
-        fneERModel ):
-        rtper = RawTextParser()
-        numClassesBio = mapper.maxBiotagsID() + 1  #[0..maxID] -> maxID+1개
-
-        # X_train, ...
-        X_train = [ mapper.mapTextER(t) for t in trainTable['text'] ]
-        y_train = [ mapper.mapBioTags(rtper.bioTagsChar(t)) for t in trainTable['text'] ]
-        X_test = [ mapper.mapTextER(t) for t in testTable['text'] ]
-        y_test = [ mapper.mapBioTags(rtper.bioTagsChar(t)) for t in testTable['text'] ]
-        # Keras에서 받아들일 수 있는 데이터 형식으로 조정.
-        X_train = pad_sequences(X_train, maxlen=paddedLen)
-        y_train = pad_sequences(y_train, maxlen=paddedLen)
-        X_test  = pad_sequences(X_test , maxlen=paddedLen)
-        y_test  = pad_sequences(y_test , maxlen=paddedLen)
-        
+    def entityRecognizerModel(self, mapper, wordEmbOutputDim, lstmUnits):
+        '''개체명인식 모델 (컴파일한 것)'''
         wordEmbInputDim = mapper.textVocabSize() + 2
-        outputUnits = numClassesBio
+        outputUnits = mapper.maxBiotagsID() + 1  #[0..maxID] -> maxID+1개
         # Keras Layer를 쌓는다.
         model = Sequential()
-        model.add(Embedding(wordEmbInputDim, wordEmbOutputDim))
+        model.add(Embedding(wordEmbInputDim, wordEmbOutputDim, mask_zero=True))
         model.add(Bidirectional(LSTM(lstmUnits, return_sequences=True, activation='sigmoid')))
-        model.add(TimeDistributed(Dense(outputUnits, activation='softmax')))
-
-        myVerbose = 0
-        if self._verbose: myVerbose = 1
-        # 시작.
+        # 3차원 입력의 Dense는 시점마다 같은 층을 쓴다(TimeDistributed와 같은 계산).
+        # TimeDistributed는 배치마다 길이가 다르면 학습이 되지 않는다.
+        model.add(Dense(outputUnits, activation='softmax'))
         model.compile(
             optimizer='adam',
             loss='sparse_categorical_crossentropy',
             metrics=['accuracy'] )
-        model.fit(
-            X_train, y_train,
-            epochs=epochsER,
-            batch_size=batchSize,
-            verbose=myVerbose )
+        return model
 
-        # Validation
-        self.vv('Validation time...')
-        self.vv( 'Accuracy: %.4f' % (model.evaluate(X_test, y_test, verbose=0)[1]) )
+    def trainJointModel(self,
+        dataset, trainRows, testRows, buckets,
+        wordEmbOutputDim, lstmUnits,
+        epochs, batchSize,
+        fnJointModel,
+        quantization=None, calibrationSize=200, initialWeights=None ):
+        mapper = dataset.mapper
+        # 배치마다 두 출력의 정답을 함께 흘려 넣는다.
+        trainData = trainingPipeline(dataset, trainRows, 'joint', batchSize, buckets)
+        testData  = trainingPipeline(dataset, testRows , 'joint', batchSize, buckets, shuffle=False)
+        X_train = dataset.X[trainRows]
+        X_test  = dataset.X[testRows]
+        y_test  = [ dataset.yIntent[testRows], dataset.yBio[testRows] ]
+
+        model = self.jointModel(mapper, wordEmbOutputDim, lstmUnits)
+        self.startFrom(model, initialWeights)
+        # 시작.
+        metrics = self.fitAndValidate(model, trainData, testData, epochs)
 
         # Saving
-        self.vv('Saving the entity recognizer model: ')
-        self.vv(fneERModel)
-        model.save(fneERModel)
-        
\ No newline at end of file
+        self.vv('Saving the joint model: ')
+        self.vv(fnJointModel)
+        model.save(fnJointModel)
+        self.vv(savedModelDir(fnJointModel))
+        exportSavedModel(model, savedModelDir(fnJointModel))
+        self.vv(numpyWeightsFile(fnJointModel))
+        exportNumpyWeights(model, numpyWeightsFile(fnJointModel), X_test[:256])
+        if quantization:
+            metrics['tflite'] = self.exportQuantized(
+                model, fnJointModel, quantization, X_train[:calibrationSize], X_test, y_test )
+        return metrics
+
+    def jointModel(self, mapper, wordEmbOutputDim, lstmUnits):
+        '''
+        의도분석과 개체명인식을 함께 하는 결합 모델 (컴파일한 것).
+        글자 Embedding과 양방향 LSTM 인코더를 두 출력이 함께 쓴다.
+        'intent' 출력은 인코더 출력을 Padding을 빼고 평균해 의도를, 'bio' 출력은 글자마다 BIO 태그를 낸다.
+        nlu.export는 층 이름('intent', 'intent_*', 'bio', 'bio_*')으로 출력마다의 머리를 나눈다.
+        '''
+        text = Input(shape=(None,), dtype='int32', name='text')
+        encoded = Embedding(
+            mapper.textVocabSize() + 2, wordEmbOutputDim, mask_zero=True, name='embedding' )(text)
+        encoded = Bidirectional(
+            LSTM(lstmUnits, return_sequences=True, activation='sigmoid'), name='encoder' )(encoded)
+        intent = GlobalAveragePooling1D(name='intent_pool')(encoded)
+        intent = Dense(mapper.maxIntentID() + 1, activation='softmax', name='intent')(intent)
+        bio = Dense(mapper.maxBiotagsID() + 1, activation='softmax', name='bio')(encoded)
+        model = Model(text, [intent, bio])
+        model.compile(
+            optimizer='adam',
+            loss={
+                'intent': 'sparse_categorical_crossentropy',
+                'bio': 'sparse_categorical_crossentropy',
+            },
+            metrics={'intent': ['accuracy'], 'bio': ['accuracy']} )
+        return model
+
+    def exportQuantized(self, model, h5File, quantization, X_calibration, X_test, y_test):
+        '''
+        학습된 모델을 양자화된 TFLite 모델로 내보내고,
+        Test set에서 원래 모델과 견준 정확도 차이 보고서를 그 옆에 쓴다. 결과: 그 보고서
+        '''
+        self.vv('Quantizing the model ({}): '.format(quantization))
+        self.vv(tfliteFile(h5File))
+        exportTflite(model, tfliteFile(h5File), quantization, X_calibration)
+        report = tfliteReport(
+            model, tfliteFile(h5File), X_test, y_test,
+            quantization, len(X_calibration) if quantization == 'int8' else 0 )
+        report['kerasBytes'] = os.path.getsize(h5File)
+        # 출력이 여럿인 모델(결합 모델)은 출력마다 정확도가 있다.
+        for name, part in report.get('outputs', {None: report}).items():
+            self.vv( '%sAccuracy: %.4f -> %.4f (delta %+.4f)' % (
+                '' if name is None else name + ' ',
+                part['kerasAccuracy'], part['tfliteAccuracy'], part['accuracyDelta'] ) )
+        self.vv( 'Size: %d -> %d bytes' % (report['kerasBytes'], report['tfliteBytes']) )
+        with open(tfliteReportFile(h5File), 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+        
+
+def metricsSummary(metrics):
+    '''
+    Trainer의 학습 결과metrics(build.json의 'metrics')에서 구조와 상관없이 견줄 값들.
+    결과: {'intentAccuracy', 'entityAccuracy', 'params', 'trainSeconds'}
+    '''
+    if 'joint' in metrics:
+        joint = metrics['joint']
+        return {
+            'intentAccuracy': joint['intent_accuracy'],
+            'entityAccuracy': joint['bio_accuracy'],
+            'params': joint['params'],
+            'trainSeconds': joint['trainSeconds'],
+        }
+    ic, er = metrics['intentClassifier'], metrics['entityRecognizer']
+    return {
+        'intentAccuracy': ic['accuracy'],
+        'entityAccuracy': er['accuracy'],
+        'params': ic['params'] + er['params'],
+        'trainSeconds': round(ic['trainSeconds'] + er['trainSeconds'], 3),
+    }
+
+def _partitionCores(parts):
+    '''
+    이 프로세스가 쓸 수 있는 CPU 코어들을 parts묶음으로 고르게 나눈다. 남는 코어는 뒤쪽 묶음부터 준다.
+    (뒤쪽인 개체명인식 모델이 양방향이라 더 무겁다.)
+    코어를 묶을 수 없는 OS이거나 코어가 parts개보다 적으면 [None, ...] (나누지 않음)
+    '''
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * parts
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < parts:
+        return [None] * parts
+    size, extra = divmod(len(cores), parts)
+    groups = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i >= parts - extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+def _trainTask(
+    domain, verbose, outputDir, task,
+    datasetDir, datasetKey, testRatio, buckets,
+    options, modelFile, quantization, calibrationSize,
+    cores, queue ):
+    '''Trainer.trainInParallel이 띄운 프로세스에서 모델 하나task를 학습한다.'''
+    try:
+        if cores is not None:
+            os.sched_setaffinity(0, cores)
+            # 맡은 코어 수만큼만 연산 스레드를 둔다. (TensorFlow가 처음 돌기 전이어야 한다.)
+            configureThreads(intraOp=len(cores), interOp=min(2, len(cores)))
+        trainer = Trainer(domain, verbose, log=lambda line: queue.put(('log', task, line)))
+        trainer._outputDir = outputDir
+        dataset = Dataset.loadFromDir(datasetDir, datasetKey)
+        trainRows, testRows = dataset.split(testRatio)
+        if task == 'intentClassifier':
+            train = trainer.trainIntentClassifier
+        else:
+            train = trainer.trainEntityRecognizer
+        metrics = train(
+            dataset, trainRows, testRows, buckets,
+            *options,
+            modelFile,
+            quantization, calibrationSize )
+        metrics['cores'] = cores
+        queue.put(('done', task, metrics))
+    except BaseException:
+        queue.put(('error', task, traceback.format_exc()))
@@ -1,41 +1,82 @@
-from html.parser import HTMLParser
+import html
+import re
+
+# 주석(annotation) 텍스트의 슬롯 표현: <슬롯명>값</슬롯명>
+# 시작 태그나 끝 태그가 아닌 '<'는 (예: 'a < b') 그냥 글자이다.
+# 예전의 HTMLParser처럼 HTML 주석(<!-- -->), 선언(<!...>), 처리 지시(<?...>)는 버리고,
+# 스스로 닫는 태그(<br/>)는 시작하자마자 끝나는 태그로 본다.
+_TAG_PATTERN = re.compile(
+    r'<!--.*?-->|<[!?][^<>]*>|<(/?)([a-zA-Z][^<>]*?)(/?)>', re.DOTALL )
+
+def hasMarkup(text):
+    '''텍스트에 슬롯 표현(XML태그)이나 문자 참조(&amp; 등)가 있을 수 있는지'''
+    return '<' in text or '&' in text
+
+def parseAnnotation(text):
+    '''
+    주석 텍스트를 한 번 훑어서 (순수 텍스트, 문자당 BIO태그 배열, 슬롯 구간들)을 얻는다.
+    슬롯 구간: [(슬롯명, 시작, 끝), ...] 순수 텍스트에서의 위치 [시작, 끝)
+    예) '<loc>서울</loc>의 개발자' -> ('서울의 개발자', ['B-loc', 'I-loc', 'O', ...], [('loc', 0, 2)])
+    문자 참조(&amp; 등)는 풀어서 한 글자로 센다.
+    '''
+    if not hasMarkup(text):
+        return text, ['O'] * len(text), []
+    pieces = []
+    bio = []
+    spans = []
+    length = 0
+    slotName = None #현재 글자들이 무슨 슬롯명에 해당하는지
+    position = 0
+    for match in _TAG_PATTERN.finditer(text):
+        length = _addData(
+            html.unescape(text[position:match.start()]), slotName, length, pieces, bio, spans )
+        if match.group(2) is None:  # 주석 등: 글자도 아니고 슬롯도 바꾸지 않는다.
+            pass
+        elif match.group(1) or match.group(3):  # 끝 태그, 또는 스스로 닫는 태그
+            slotName = None
+        else:
+            slotName = match.group(2)
+        position = match.end()
+    _addData(html.unescape(text[position:]), slotName, length, pieces, bio, spans)
+    return ''.join(pieces), bio, spans
+
+def _addData(data, slotName, length, pieces, bio, spans):
+    if not data:
+        return length
+    pieces.append(data)
+    if slotName is not None:
+        bio.append('B-{}'.format(slotName))
+        bio.extend(['I-{}'.format(slotName)] * (len(data) - 1))
+        spans.append((slotName, length, length + len(data)))
+    else:
+        bio.extend(['O'] * len(data))
+    return length + len(data)
+
+def parseRawtable(rawTable):
+    '''
+    rawTable의 'text' 열을 행마다 한 번씩만 파싱해 둔다.
+    'ptext'(순수 텍스트), 'bioTags'(문자당 BIO태그 배열), 'spans'(슬롯 구간들) 열을 더한
+    새 표를 돌려준다. 이미 파싱된 표이면 그대로 돌려준다.
+    '''
+    if 'ptext' in rawTable:
+        return rawTable
+    parsed = [ parseAnnotation(t) for t in rawTable['text'] ]
+    return rawTable.assign(
+        ptext=[ p[0] for p in parsed ],
+        bioTags=[ p[1] for p in parsed ],
+        spans=[ p[2] for p in parsed ] )
+
+
+class RawTextParser:
+    '''parseAnnotation을 감싼 것. 순수 텍스트나 BIO태그 배열 하나만 필요할 때 쓴다.'''
 
-class RawTextParser(HTMLParser):
-    _pureText = ''
-    _bio = []
-    _currentXmlTag = None #현재 data가 무슨 슬롯명에 해당하는지 알기 위해 사용됨.
-    
     def pureText(self, text):
         '''텍스트(text=annotation)에서 슬롯 표현(XML태그)이 빠진 것을 얻는다.'''
-        self._pureText = ''
-        self.feed(text)
-        return self._pureText
-    
+        # 태그도 문자 참조(&amp; 등)도 없으면 파싱할 것이 없다.
+        if not hasMarkup(text):
+            return text
+        return parseAnnotation(text)[0]
+
     def bioTagsChar(self, text):
         '''ᅟ텍스트(text=annotation)에서 문자당 BIO태깅 배열을 얻는다.'''
-        self._bio = []
-        self._currentXmlTag = None
-        self.feed(text)
-        return self._bio
-
-    def handle_data(self, data):
-        # pureText
-        self._pureText += data
-        # slots
-        slotName = self._currentXmlTag
-        if slotName != None:
-            BI_tags = ['I-{}'.format(slotName) for _ in data]
-            B_tag = 'B-{}'.format(slotName)
-            BI_tags[0] = B_tag
-            self._bio.extend(BI_tags)
-        else:
-            O_tags = ['O' for _ in data]
-            self._bio.extend(O_tags)
-
-    def handle_starttag(self, tag, attrs):
-        #self._currentXmlTag = tag
-        self._currentXmlTag = self.get_starttag_text().strip('<>')
-
-    def handle_endtag(self, tag):
-        self._currentXmlTag = None
-        
\ No newline at end of file
+        return parseAnnotation(text)[1]
@@ -0,0 +1,33 @@
+import argparse
+from nlu.train import Trainer
+from nlu.export import exportSavedModelFromFile, exportNumpyWeightsFromFile
+from nlu.mapper import Mapper, BUNDLE_FILE
+import os
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--domain', help='Domain name', default='recruit')
+    parser.add_argument('--format', choices=['savedmodel', 'numpy', 'mapper', 'all'], default='all',
+        help='savedmodel: traced SavedModel, numpy: weights for the NumPy engine (*.npz), '
+            'mapper: single-file mapper bundle from the *.vocab files')
+    args = parser.parse_args()
+
+    tr = Trainer(domain=args.domain, verbose=True)
+    try:
+        if args.format in ('mapper', 'all'):
+            tr.vv('Writing the mapper bundle: ')
+            bundleFile = os.path.join(tr.mapperDir(), BUNDLE_FILE)
+            Mapper.loadFromVocabFiles(tr.mapperDir()).saveBundle(bundleFile)
+            tr.vv(bundleFile)
+        h5Files = [tr.icModelFile(), tr.erModelFile()]
+        if os.path.exists(tr.jointModelFile()):
+            h5Files = [tr.jointModelFile()]
+        for h5File in h5Files:
+            if args.format in ('savedmodel', 'all'):
+                tr.vv('Exporting a SavedModel: ')
+                tr.vv(exportSavedModelFromFile(h5File))
+            if args.format in ('numpy', 'all'):
+                tr.vv('Exporting NumPy weights: ')
+                tr.vv(exportNumpyWeightsFromFile(h5File))
+    except (FileNotFoundError, OSError):
+        print("MODEL NOT FOUND - model/{}/*.h5".format(args.domain))
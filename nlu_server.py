@@ -1,23 +1,115 @@
-from nlu.predict import Predictor
+from nlu.predict import BACKENDS, configureThreads
+from nlu.batcher import QueueFullError
+from nlu.pool import PredictorPool, UnknownDomainError
+from nlu.cache import ResultCache, normalizeText
+from nlu.aio_http import AsyncHttpServer
+from nlu.prefork import PreforkServer, listenSocket
 import argparse
+import asyncio
 import json
+import os
+import signal
+import threading
 import time  #elapsed_time
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 import sys
 
 # GLOBAL ---------------------
-_predictor = None
+_pool = None  # 도메인별 Predictor와 배처(동시 질의를 모아 한 배치로 예측)
+_defaultDomain = None  # 질의에 도메인이 없을 때 쓰는 도메인
+_cache = None  # 예측 결과 캐시. 없으면 캐시하지 않음.
+_ready = threading.Event()  # 기본 도메인을 불러와 데우기까지 끝났는지
+_retryAfter = 1  # 대기열이 가득 찼을 때 다시 시도하라고 알려줄 시간(초)
 
-def predictAsJsonString(textToQuery):
-    pr = _predictor
+def parseNluQuery(target):
+    '''
+    GET /nlu?text=어쩌구저쩌구  (기본 도메인)
+    GET /nlu?domain=recruit&text=어쩌구저쩌구
+    GET /nlu/recruit?text=어쩌구저쩌구
+    에서 도메인과 질의 텍스트를 꺼낸다.
+    결과: (200, domain, text) 또는 잘못된 요청이면 (HTTP 상태코드, None, None)
+    '''
+    path = urlparse(target).path
+    query = parse_qs(urlparse(target).query)
 
+    # domain
+    if path == '/nlu':
+        domain = query['domain'][0] if 'domain' in query else _defaultDomain
+    elif path.startswith('/nlu/') and path.count('/') == 2:
+        domain = path[len('/nlu/'):]
+    else:
+        return 404, None, None
+    if not domain:
+        return 404, None, None
+    # text
+    if not 'text' in query:
+        return 400, None, None
+    text = query['text'][0]
+    text = text.strip()
+    if len(text) <= 0:
+        return 400, None, None
+    return 200, domain, text
+
+def submitQuery(domain, textToQuery):
+    '''
+    질의를 정규화하여 예측을 맡긴다. 캐시에 있으면 캐시의 결과를 쓴다.
+    결과: (정규화된 텍스트, 예측 결과를 받을 Future)
+    '''
+    text = normalizeText(textToQuery)
+    if _cache is None:
+        return text, _pool.submit(domain, text)
+    return text, _cache.submit(
+        domain, _pool.version(domain), text,
+        lambda: _pool.submit(domain, text) )
+
+def predictAsJsonString(domain, textToQuery):
+    startTime = time.time()
+    text, future = submitQuery(domain, textToQuery)
+    result = future.result()
+    return formatPrediction(domain, text, result, time.time() - startTime)
+
+async def predictAsJsonStringAsync(domain, textToQuery):
     startTime = time.time()
-    intent, intent_prob = pr.predictIntent(textToQuery)
-    bioTags, tags_prob = pr.predictEntity(textToQuery)
-    elapsedTime = time.time() - startTime
+    # 처음 쓰이는(또는 내려졌던) 도메인은 모델을 불러와 데우느라, 캐시는 모델 파일을 살피느라
+    # 몇 초씩 걸릴 수 있다. 이벤트 루프를 막지 않도록 스레드에서 맡기고 기다린다.
+    loop = asyncio.get_running_loop()
+    text, future = await loop.run_in_executor(None, submitQuery, domain, textToQuery)
+    result = await asyncio.wrap_future(future)
+    return formatPrediction(domain, text, result, time.time() - startTime)
+
+def requestReload(target):
+    '''
+    POST /admin/reload?domain=recruit
+    도메인의 모델을 뒤에서 다시 불러와 바꿔 끼우도록 한다.
+    결과: (HTTP 상태코드, JSON 문자열 또는 None)
+    '''
+    query = parse_qs(urlparse(target).query)
+    domain = query['domain'][0] if 'domain' in query else _defaultDomain
+    if not domain:
+        return 400, None
+    try:
+        _pool.reload(domain)
+    except UnknownDomainError:
+        return 404, None
+    return 202, json.dumps({'domain': domain, 'reloading': True}, ensure_ascii=False)
+
+def readyAsJsonString():
+    '''GET /ready: 질의를 받을 준비가 되었으면 200, 아니면 503'''
+    msg = json.dumps({'ready': _ready.is_set()})
+    return (200 if _ready.is_set() else 503), msg
+
+def statsAsJsonString():
+    obj = {
+        'domains': _pool.versions(),
+        'cache': _cache.stats() if _cache is not None else None,
+    }
+    return json.dumps(obj, ensure_ascii=False)
+
+def formatPrediction(domain, textToQuery, result, elapsedTime):
+    intent, intent_prob, bioTags, tags_prob = result
     return formatJson(
-        domain = pr.domain(),
+        domain = domain,
         text = textToQuery,
         intent = intent, intent_prob = intent_prob,
         tags = bioTags, tags_prob = tags_prob,
@@ -65,30 +157,43 @@ class NluHandler(BaseHTTPRequestHandler):
     def _setHeadersInternalError(self):
         self.send_response(500)
         self.end_headers()
+
+    def _setHeadersServiceUnavailable(self):
+        self.send_response(503)
+        self.send_header('Retry-After', str(_retryAfter))
+        self.end_headers()
     
 
     # GET /nlu?text=어쩌구저쩌구
     def do_GET(self):
-        path = urlparse(self.path).path
-        query = parse_qs(urlparse(self.path).query)
-        
-        if path != '/nlu':
-            self._setHeadersNotFound()
+        if urlparse(self.path).path == '/ready':
+            status, msg = readyAsJsonString()
+            self.send_response(status)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write( msg.encode('utf-8') )
             return
-        
-        # text
-        if not 'text' in query:
-            self._setHeadersBadRequest()
+        if urlparse(self.path).path == '/stats':
+            self._setHeadersOK()
+            self.wfile.write( statsAsJsonString().encode('utf-8') )
             return
-        text = query['text'][0]
-        text = text.strip()
-        if len(text) <= 0:
+        status, domain, text = parseNluQuery(self.path)
+        if status == 404:
+            self._setHeadersNotFound()
+            return
+        if status == 400:
             self._setHeadersBadRequest()
             return
         # predict & result
         try:
-            msg = predictAsJsonString(text)
+            msg = predictAsJsonString(domain, text)
             print(msg)
+        except UnknownDomainError:
+            self._setHeadersNotFound()
+            return
+        except QueueFullError:
+            self._setHeadersServiceUnavailable()
+            return
         except:
             print("Error has occured during the prediction.")
             self._setHeadersInternalError()
@@ -96,28 +201,187 @@ class NluHandler(BaseHTTPRequestHandler):
         self._setHeadersOK()
         self.wfile.write( msg.encode('utf-8') )
 
+    # POST /admin/reload?domain=어쩌구
     def do_POST(self):
-        self._setHeadersNotFound()
+        if urlparse(self.path).path != '/admin/reload':
+            self._setHeadersNotFound()
+            return
+        status, msg = requestReload(self.path)
+        self.send_response(status)
+        if msg is None:
+            self.end_headers()
+            return
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write( msg.encode('utf-8') )
+
+
+async def handleAsync(method, target):
+    '''AsyncHttpServer용 요청 처리. NluHandler와 같은 규약을 따른다.'''
+    if method == 'POST' and urlparse(target).path == '/admin/reload':
+        status, msg = requestReload(target)
+        if msg is None:
+            return status, {}, b''
+        return status, {'Content-type': 'application/json'}, msg.encode('utf-8')
+    if method != 'GET':
+        return 404, {}, b''
+    if urlparse(target).path == '/ready':
+        status, msg = readyAsJsonString()
+        return status, {'Content-type': 'application/json'}, msg.encode('utf-8')
+    if urlparse(target).path == '/stats':
+        return 200, {'Content-type': 'application/json'}, statsAsJsonString().encode('utf-8')
+    status, domain, text = parseNluQuery(target)
+    if status != 200:
+        return status, {}, b''
+    # predict & result
+    try:
+        msg = await predictAsJsonStringAsync(domain, text)
+        print(msg)
+    except UnknownDomainError:
+        return 404, {}, b''
+    except QueueFullError:
+        # 대기열이 가득 참: 지연이 한없이 늘어나지 않게 바로 거절한다.
+        return 503, {'Retry-After': str(_retryAfter)}, b''
+    except Exception:
+        print("Error has occured during the prediction.")
+        return 500, {}, b''
+    return 200, {'Content-type': 'application/json'}, msg.encode('utf-8')
+
+def startPredicting(args):
+    '''
+    도메인별 Predictor 풀을 준비한다.
+    기본 도메인은 뒤에서 불러와 데우며, 끝나면 /ready가 200을 답한다.
+    '''
+    global _pool, _defaultDomain, _cache, _retryAfter
+    warmupTexts = None
+    if args.warmup_file:
+        with open(args.warmup_file, 'r', encoding='utf-8') as f:
+            warmupTexts = [ line.strip() for line in f if line.strip() ]
+    _pool = PredictorPool(
+        maxDomains=args.max_domains,
+        maxBatchSize=args.max_batch_size,
+        maxWaitMs=args.max_wait_ms,
+        maxQueueSize=args.max_queue,
+        useExactIndex=args.exact_match,
+        backend=args.backend,
+        warmupTexts=warmupTexts )
+    _defaultDomain = args.domain
+    if args.cache_size > 0:
+        _cache = ResultCache(maxEntries=args.cache_size, ttl=args.cache_ttl)
+    _retryAfter = args.retry_after
+    if args.watch_interval > 0:
+        _pool.startWatching(args.watch_interval)
+    threading.Thread(target=loadDefaultDomain, daemon=True).start()
+
+def loadDefaultDomain():
+    try:
+        if _defaultDomain:
+            _pool.predictor(_defaultDomain)
+    except Exception:
+        # 기본 도메인 없이는 뜰 수 없다. (프리포크 워커라면 다시 띄워진다)
+        import traceback; traceback.print_exc()
+        print('Could not load the domain: {}'.format(_defaultDomain))
+        os._exit(1)
+    _ready.set()
+    print('Ready.')
+
+def serve(args, sock):
+    '''
+    이미 열린 listening 소켓 sock에서 요청을 받는다.
+    SIGTERM을 받으면 처리 중인 요청을 마치고 돌아온다.
+    '''
+    if args.server == 'async':
+        print('Starting asyncio http server on {}.'.format(sock.getsockname()))
+        AsyncHttpServer(handleAsync).serveForever(
+            sock=sock, stopSignals=(signal.SIGTERM,) )
+    else:
+        # 요청마다 스레드를 두어야 동시 질의가 한 배치로 모일 수 있다.
+        httpd = ThreadingHTTPServer(
+            sock.getsockname(), NluHandler, bind_and_activate=False )
+        httpd.socket.close()
+        httpd.socket = sock
+        httpd.daemon_threads = False  # 끝낼 때 처리 중인 요청을 기다린다.
+        signal.signal(signal.SIGTERM, lambda signum, frame:
+            threading.Thread(target=httpd.shutdown).start() )
+        print('Starting http server on {}.'.format(sock.getsockname()))
+        httpd.serve_forever()
+        httpd.server_close()
+
+def runWorker(args, sock, workerIndex):
+    '''프리포크 워커 프로세스 하나. 워커마다 TF 스레드 수를 나눠 갖는다.'''
+    if args.backend == 'tensorflow':
+        configureThreads(args.intra_op_threads, args.inter_op_threads)
+    startPredicting(args)
+    try:
+        serve(args, sock)
+    finally:
+        _pool.close()
+
+def availableCpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 if __name__ == '__main__':
     domain = 'recruit'
     parser = argparse.ArgumentParser()
-    parser.add_argument('--domain', help='Domain name', default='recruit')
+    parser.add_argument('--domain', help='Default domain name', default='recruit')
+    parser.add_argument('--max-domains', type=int, default=4,
+        help='Maximum number of domains kept loaded (least recently used ones are unloaded)')
+    parser.add_argument('--cache-size', type=int, default=10000,
+        help='Maximum number of cached prediction results (0 = no cache)')
+    parser.add_argument('--cache-ttl', type=float, default=300,
+        help='Seconds a cached prediction result stays valid')
+    parser.add_argument('--exact-match', action='store_true',
+        help='Answer queries identical to a training text from the exact-match index')
+    parser.add_argument('--backend', choices=BACKENDS, default='tensorflow',
+        help='tensorflow: SavedModel/HDF5 models, numpy: exported *.npz weights without TensorFlow, '
+            'tflite: quantized *.tflite models')
+    parser.add_argument('--watch-interval', type=float, default=10,
+        help='Seconds between checks for retrained models to hot-reload (0 = off)')
+    parser.add_argument('--warmup-file',
+        help='Text file of queries (one per line) used to warm up each loaded model')
     parser.add_argument('--port', help='Port number for the server', default='5555')
+    parser.add_argument('--max-batch-size', type=int, default=32,
+        help='Maximum number of queries predicted together in one batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5,
+        help='Maximum time (ms) to wait for a batch to fill up')
+    parser.add_argument('--max-queue', type=int, default=256,
+        help='Maximum number of pending queries before answering 503 (0 = unlimited)')
+    parser.add_argument('--retry-after', type=int, default=1,
+        help='Retry-After seconds sent with 503 responses')
+    parser.add_argument('--server', choices=['thread', 'async'], default='thread',
+        help='thread: one thread per connection, async: asyncio with keep-alive')
+    parser.add_argument('--workers', type=int, default=0,
+        help='Number of pre-forked worker processes sharing the port (0 = single process)')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+        help='TensorFlow intra-op threads per worker (default: CPUs / workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=1,
+        help='TensorFlow inter-op threads per worker')
     args = parser.parse_args()
     try: portnum = int(args.port)
     except ValueError:
         print('port={} is not an integer.'.format(args.port))
         sys.exit(1)
-    
-    _predictor = Predictor(domain=args.domain)
-    try:
-        print('-------------------------------------')
-        serverAddr = ('0.0.0.0', portnum)
-        httpd = HTTPServer(serverAddr, NluHandler)
-        print('Starting http server on {}.'.format(serverAddr))
-        httpd.serve_forever()
 
+    print('-------------------------------------')
+    sock = listenSocket('0.0.0.0', portnum)
+    if args.workers > 0:
+        # 워커들이 CPU를 나눠 쓰도록 TF 스레드 수를 제한한다.
+        if args.intra_op_threads is None:
+            args.intra_op_threads = max(1, availableCpus() // args.workers)
+        # 모델은 워커마다 fork 뒤에 불러온다. TF 런타임은 fork를 견디지 못하기 때문.
+        PreforkServer(
+            sock, lambda sock, workerIndex: runWorker(args, sock, workerIndex),
+            args.workers ).run()
+        sys.exit(0)
+
+    startPredicting(args)
+    try:
+        serve(args, sock)
     except KeyboardInterrupt:
         print()
         print('[Received KeyboardInterrupt. Quitting...]')
+    finally:
+        _pool.close()
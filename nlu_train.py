@@ -1,13 +1,75 @@
 import argparse
-from nlu.train import Trainer
+import sys
+from nlu.train import Trainer, ARCHITECTURES
+from nlu.export import QUANTIZATIONS
+from nlu.batch import discoverDomains, trainDomains, formatSummary, MEMORY_PER_WORKER
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--domain', help='Domain name', default='recruit')
+    parser.add_argument('--domains', nargs='+', metavar='DOMAIN',
+        help='Train these domains at once in a pool of processes')
+    parser.add_argument('--all', action='store_true',
+        help='Train every domain that has data/<domain>/raw.xlsx at once in a pool of processes')
+    parser.add_argument('--workers', type=int, default=None,
+        help='Number of domains trained at the same time with --domains/--all '
+             '(default: bounded by the CPU cores and the available memory)')
+    parser.add_argument('--memory-per-worker', type=float, default=MEMORY_PER_WORKER / (1 << 30),
+        help='Estimated memory (GiB) one training process needs, used to bound --workers')
+    parser.add_argument('--force', action='store_true',
+        help='With --domains/--all, also retrain domains whose data and options are unchanged '
+             'since their last successful build')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS,
+        help='Also export quantized TFLite models (with an accuracy report on the test split)')
+    parser.add_argument('--vocab-min-count', type=int, default=1,
+        help='Characters seen fewer times than this map to UNK')
+    parser.add_argument('--vocab-max-size', type=int, default=None,
+        help='Keep at most this many of the most frequent characters in the vocab')
+    parser.add_argument('--parallel', action='store_true',
+        help='Train the intent classifier and the entity recognizer at the same time '
+             'in two processes, each on its own half of the CPU cores')
+    parser.add_argument('--architecture', choices=ARCHITECTURES, default='separate',
+        help='separate: an intent classifier and an entity recognizer, '
+             'joint: one model with a shared encoder and both outputs')
+    parser.add_argument('--compare', action='store_true',
+        help='Also train the other architecture on the same split and record '
+             'both accuracies in build.json')
+    parser.add_argument('--incremental', action='store_true',
+        help='Continue from the current model: extend its vocab and label sets and fine-tune '
+             'on the new or re-annotated rows plus a replayed sample of the old ones')
+    parser.add_argument('--replay-ratio', type=float, default=2.0,
+        help='With --incremental, number of old rows replayed per new row')
     args = parser.parse_args()
 
-    try: 
+    trainArgs = dict(
+        quantization=args.quantization,
+        vocabMinCount=args.vocab_min_count,
+        vocabMaxSize=args.vocab_max_size,
+        architecture=args.architecture,
+        compare=args.compare,
+        incremental=args.incremental,
+        replayRatio=args.replay_ratio )
+
+    if args.all or args.domains:
+        if args.parallel:
+            parser.error('--parallel cannot be used with --domains/--all')
+        domains = args.domains or discoverDomains()
+        if not domains:
+            print("NO DOMAINS FOUND - data/<domain>/raw.xlsx")
+            sys.exit(1)
+        results = trainDomains(
+            domains, trainArgs,
+            workers=args.workers,
+            memoryPerWorker=int(args.memory_per_worker * (1 << 30)),
+            force=args.force,
+            verbose=True )
+        print('-------------------------------------')
+        for line in formatSummary(results):
+            print(line)
+        sys.exit(1 if any( r['status'] == 'failed' for r in results ) else 0)
+
+    try:
         tr = Trainer(domain=args.domain, verbose=True)
-        tr.train()
+        tr.train(parallel=args.parallel, **trainArgs)
     except FileNotFoundError:
         print("FILE NOT FOUND - data/{}/raw.xlsx".format(args.domain))
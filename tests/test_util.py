@@ -0,0 +1,83 @@
+'''
+Tests for parsing annotation texts (nlu.util)
+    python -m unittest discover -s tests
+'''
+
+import unittest
+from nlu.util import RawTextParser, parseAnnotation
+
+class RawTextParserTest(unittest.TestCase):
+
+    def testMarkupFreeText(self):
+        # 태그도 문자 참조도 없으면 파싱하지 않고 그대로 돌려준다.
+        parser = RawTextParser()
+        text = '서울 개발자 채용'
+        self.assertIs(parser.pureText(text), text)
+        self.assertEqual(parser.bioTagsChar(text), ['O'] * len(text))
+        self.assertEqual(parseAnnotation(text), (text, ['O'] * len(text), []))
+
+    def testSlots(self):
+        parser = RawTextParser()
+        text = '<loc>서울</loc>의 <job>개발자</job>'
+        self.assertEqual(parser.pureText(text), '서울의 개발자')
+        self.assertEqual(parser.bioTagsChar(text),
+            ['B-loc', 'I-loc', 'O', 'O', 'B-job', 'I-job', 'I-job'])
+        self.assertEqual(parseAnnotation(text)[2], [('loc', 0, 2), ('job', 4, 7)])
+
+    def testStateIsNotShared(self):
+        # 예전에는 BIO태그 배열이 클래스 속성이라 부를 때마다 길어졌다.
+        first = RawTextParser()
+        second = RawTextParser()
+        text = '<loc>서울</loc> 날씨'
+        expected = ['B-loc', 'I-loc', 'O', 'O', 'O']
+        self.assertEqual(first.bioTagsChar(text), expected)
+        self.assertEqual(first.bioTagsChar(text), expected)
+        self.assertEqual(second.bioTagsChar('안녕'), ['O', 'O'])
+        self.assertEqual(first.bioTagsChar(text), expected)
+
+    def testCharacterReferences(self):
+        # 문자 참조는 풀어서 한 글자로 센다.
+        parser = RawTextParser()
+        self.assertEqual(parser.pureText('반가워 &amp; 고마워'), '반가워 & 고마워')
+        self.assertEqual(parser.pureText('<job>R&amp;D</job> 공고'), 'R&D 공고')
+        self.assertEqual(parser.bioTagsChar('<job>R&amp;D</job> 공고'),
+            ['B-job', 'I-job', 'I-job', 'O', 'O', 'O'])
+
+    def testTrailingAmpersand(self):
+        # 끝이 '&abc'인 텍스트가 남아서 그 뒤의 텍스트들까지 빈 문자열이 되던 문제
+        parser = RawTextParser()
+        self.assertEqual(parser.pureText('a &abc'), 'a &abc')
+        self.assertEqual(parser.bioTagsChar('a &abc'), ['O'] * 6)
+        self.assertEqual(parser.pureText('<loc>서울</loc>'), '서울')
+        self.assertEqual(parser.pureText('끝에 &'), '끝에 &')
+
+    def testLessThanIsText(self):
+        # 태그가 아닌 '<'는 그냥 글자이다.
+        parser = RawTextParser()
+        self.assertEqual(parser.pureText('a < b'), 'a < b')
+        self.assertEqual(parser.bioTagsChar('a < b'), ['O'] * 5)
+
+    def testSelfClosingTag(self):
+        # HTMLParser처럼 시작하자마자 끝나는 태그이다. 뒤의 글자는 슬롯이 아니다.
+        parser = RawTextParser()
+        self.assertEqual(parser.pureText('<br/>x'), 'x')
+        self.assertEqual(parser.bioTagsChar('<br/>x'), ['O'])
+        self.assertEqual(parser.bioTagsChar('<br />x'), ['O'])
+        self.assertEqual(parser.bioTagsChar('<loc>서<br/>울</loc>'), ['B-loc', 'O'])
+
+    def testComments(self):
+        # 주석, 선언, 처리 지시는 버리고 슬롯도 바꾸지 않는다.
+        parser = RawTextParser()
+        self.assertEqual(parser.pureText('서울<!-- 메모 --> 날씨'), '서울 날씨')
+        self.assertEqual(parser.pureText('<!--\n<loc>x</loc>\n-->a'), 'a')
+        self.assertEqual(parser.pureText('<!DOCTYPE html><?xml x?>a'), 'a')
+        self.assertEqual(parser.bioTagsChar('<loc>서<!-- x -->울</loc>'), ['B-loc', 'B-loc'])
+
+    def testEmptyText(self):
+        parser = RawTextParser()
+        self.assertEqual(parser.pureText(''), '')
+        self.assertEqual(parser.bioTagsChar(''), [])
+        self.assertEqual(parser.bioTagsChar('<loc></loc>'), [])
+
+if __name__ == '__main__':
+    unittest.main()